@@ -0,0 +1,87 @@
+"""
+Compare the sync redirect view behind the WSGI handler with the async one behind the ASGI handler.
+
+    python manage.py test benchmarks.bench_async_redirect
+
+The async requests are sent BENCHMARK_CONCURRENCY (default 50) at a time, as an ASGI server would interleave them.
+TransactionTestCase keeps the rows visible to the threads of the async ORM.
+The numbers are only comparable with each other, the test client skips the network and the server.
+"""
+import asyncio
+import os
+from time import perf_counter
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import AsyncClient, Client, TransactionTestCase
+from django.test.utils import override_settings
+from django.urls import path
+
+from benchmarks.utils import percentile, print_table
+from urls.api.views import AsyncRedirectView, RedirectAPIView
+from urls.models import URL
+from urls.usage_logger import UsageBuffer
+
+REQUESTS_PER_RUN = int(os.environ.get("BENCHMARK_REQUESTS_PER_RUN", "1000"))
+CONCURRENCY = int(os.environ.get("BENCHMARK_CONCURRENCY", "50"))
+
+urlpatterns = [
+    path("sync/<str:token>/", RedirectAPIView.as_view()),
+    path("async/<str:token>/", AsyncRedirectView.as_view()),
+]
+
+
+def run_sync(token):
+    client = Client()
+    latencies = []
+    started_at = perf_counter()
+    for _ in range(REQUESTS_PER_RUN):
+        request_started_at = perf_counter()
+        client.get(f"/sync/{token}/")
+        latencies.append(perf_counter() - request_started_at)
+    return perf_counter() - started_at, latencies
+
+
+async def run_async(token):
+    client = AsyncClient()
+    latencies = []
+
+    async def send():
+        request_started_at = perf_counter()
+        await client.get(f"/async/{token}/")
+        latencies.append(perf_counter() - request_started_at)
+
+    started_at = perf_counter()
+    for first in range(0, REQUESTS_PER_RUN, CONCURRENCY):
+        await asyncio.gather(*(send() for _ in range(min(CONCURRENCY, REQUESTS_PER_RUN - first))))
+    return perf_counter() - started_at, latencies
+
+
+def format_row(name, seconds, latencies):
+    return (
+        name,
+        f"{REQUESTS_PER_RUN / seconds:.0f}",
+        f"{percentile(latencies, 0.5) * 1000:.2f}",
+        f"{percentile(latencies, 0.99) * 1000:.2f}",
+    )
+
+
+@override_settings(ROOT_URLCONF="benchmarks.bench_async_redirect")
+# Keep the database writes of the usage logging out of the comparison
+@patch("urls.api.views.usage_buffer", UsageBuffer(flush_callback=lambda usages: None, use_timer=False))
+class AsyncRedirectBenchmark(TransactionTestCase):
+    def test_wsgi_and_asgi_redirect(self):
+        token = URL.objects.create(url="https://example.com").token
+        rows = []
+        for use_cache in (False, True):
+            with override_settings(URL_SHORTENER_USE_CACHE=use_cache):
+                cache.clear()
+                rows.append(format_row(f"wsgi cache={use_cache}", *run_sync(token)))
+                cache.clear()
+                rows.append(format_row(f"asgi cache={use_cache}", *asyncio.run(run_async(token))))
+
+        print_table(
+            f"{REQUESTS_PER_RUN} redirects, {CONCURRENCY} concurrent asgi requests",
+            ("handler", "requests/s", "p50 ms", "p99 ms"),
+            rows,
+        )
@@ -0,0 +1,66 @@
+"""
+Compare the legacy redirect cache entries (a dict under the bare token) with the packed entries of `redirect_cache`.
+
+    python manage.py test benchmarks.bench_cache_entries
+
+The bytes per entry are the pickled size, which is what the Django cache backends store (except for integers
+on Redis), without the key. The get and set rates are measured against the cache of URL_SHORTENER_CACHE_ALIAS.
+BENCHMARK_ITERATIONS (default 2000) sets the calls per case.
+"""
+import os
+import pickle
+from itertools import count
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from benchmarks.utils import print_table, report, run
+from urls.cache import build_redirect_entry, pack_redirect_entry, redirect_cache
+from urls.models import URL
+
+ITERATIONS = int(os.environ.get("BENCHMARK_ITERATIONS", "2000"))
+REDIRECT_URL = "https://example.com/some/landing/page?utm_source=newsletter"
+
+
+def get_pickled_size(value):
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class CacheEntryBenchmark(TestCase):
+    def test_entry_size(self):
+        rows = []
+        for refresh_interval in (None, 60):
+            with override_settings(URL_SHORTENER_CACHE_REFRESH_INTERVAL=refresh_interval):
+                entry = build_redirect_entry(REDIRECT_URL, 123_456, 3600)
+            legacy_size = get_pickled_size(entry)
+            packed_size = get_pickled_size(pack_redirect_entry(entry))
+            rows.append([
+                "with refresh fields" if refresh_interval else "plain",
+                legacy_size,
+                packed_size,
+                f"{1 - packed_size / legacy_size:.0%}",
+            ])
+        print_table(
+            f"Redirect cache bytes per entry ({len(REDIRECT_URL)} characters url)",
+            ["entry", "dict", "packed", "saved"],
+            rows,
+        )
+
+    def test_get_set(self):
+        cache = caches[settings.URL_SHORTENER_CACHE_ALIAS]
+        cache.clear()
+        self.addCleanup(cache.clear)
+        tokens = [URL.create_token() for _ in range(ITERATIONS)]
+        entry = build_redirect_entry(REDIRECT_URL, 123_456, 3600)
+        legacy_set_tokens, packed_set_tokens = iter(tokens), iter(tokens)
+        legacy_get_tokens, packed_get_tokens = count(), count()
+
+        results = [
+            run("dict entry set", lambda: cache.set(next(legacy_set_tokens), entry, 3600), ITERATIONS),
+            run("dict entry get", lambda: cache.get(tokens[next(legacy_get_tokens)]), ITERATIONS),
+            run("packed entry set", lambda: redirect_cache.set(next(packed_set_tokens), entry, 3600), ITERATIONS),
+            run("packed entry get", lambda: redirect_cache.get(tokens[next(packed_get_tokens)]), ITERATIONS),
+        ]
+        report("Redirect cache entries", results)
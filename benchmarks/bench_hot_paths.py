@@ -0,0 +1,90 @@
+"""
+Throughput, latency and queries of the hot paths, compared with the stored baseline of the database vendor.
+
+    python manage.py test benchmarks.bench_hot_paths
+    POSTGRES_DB=url_shortener python manage.py test benchmarks.bench_hot_paths
+
+BENCHMARK_ITERATIONS (default 500) sets the operations per benchmark. BENCHMARK_SAVE_BASELINE=1 stores the results
+in benchmarks/baselines/<vendor>.json and BENCHMARK_STRICT=1 fails on the regressions reported against it.
+"""
+import os
+from unittest.mock import patch
+
+from celery import current_app
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.test.utils import override_settings
+
+from benchmarks.bench_token_filter import KEYSPACE_SIZE, TOKEN_LENGTH, occupy_keyspace
+from benchmarks.utils import report, run
+from urls.models import URL, UrlUsage
+from urls.tasks import USAGE_DATETIME_FORMAT
+from urls.usage_logger import UsageBuffer, flush_usages
+
+ITERATIONS = int(os.environ.get("BENCHMARK_ITERATIONS", "500"))
+OCCUPANCIES = (0.1, 0.5, 0.9)
+
+
+class HotPathBenchmark(TestCase):
+    def report(self, title, results):
+        regressions = report(title, results)
+        if os.environ.get("BENCHMARK_STRICT") == "1":
+            self.assertEqual(regressions, [], "Slower than the baseline")
+
+    # The usage logging has its own benchmark
+    @patch("urls.api.views.usage_buffer", UsageBuffer(flush_callback=lambda usages: None, use_timer=False))
+    def test_redirect(self):
+        client = Client()
+        path = f"/u/{URL.objects.create(url='https://example.com').token}/"
+        results = []
+        with override_settings(URL_SHORTENER_USE_CACHE=False):
+            results.append(run("redirect without cache", lambda: client.get(path), ITERATIONS))
+        with override_settings(URL_SHORTENER_USE_CACHE=True):
+            client.get(path)
+            results.append(run("redirect cache hit", lambda: client.get(path), ITERATIONS))
+            results.append(run("redirect cache miss", lambda: client.get(path), ITERATIONS, setup=cache.clear))
+        self.report("Redirects", results)
+
+    def test_create_url(self):
+        def fill_pool():
+            URL.objects.bulk_create_ready_to_set_tokens(1)
+
+        def create():
+            URL.objects.create(url="https://example.com")
+
+        results = [
+            run("create with pool tokens", create, ITERATIONS, setup=fill_pool),
+            run("create without pool tokens", create, ITERATIONS, setup=URL.objects.all_ready_to_set_token().delete),
+        ]
+        self.report("URLManager.create", results)
+
+    @patch("urls.models.MAXIMUM_TOKEN_LENGTH", TOKEN_LENGTH)
+    @patch("urls.models.MAXIMUM_RECURSION_DEPTH", 1000)
+    def test_create_token(self):
+        results = []
+        for occupancy in OCCUPANCIES:
+            occupy_keyspace(occupancy)
+            results.append(run(f"create_token at {occupancy:.0%} of {KEYSPACE_SIZE}", URL.create_token, ITERATIONS))
+        self.report("URL.create_token", results)
+
+    def test_usage_logging(self):
+        url = URL.objects.create(url="https://example.com")
+        usage = [url.pk, url.created_at.strftime(USAGE_DATETIME_FORMAT)]
+        usage_buffer = UsageBuffer(flush_callback=flush_usages, use_timer=False)
+
+        def log_usage():
+            usage_buffer.add(*usage)
+
+        results = []
+        with override_settings(URL_SHORTENER_USE_CELERY_AS_USAGE_LOGGER=False):
+            results.append(run("usage logging sync", log_usage, ITERATIONS))
+        with override_settings(URL_SHORTENER_USE_CELERY_AS_USAGE_LOGGER=True):
+            always_eager = current_app.conf.task_always_eager
+            current_app.conf.task_always_eager = True
+            try:
+                results.append(run("usage logging celery eager", log_usage, ITERATIONS))
+            finally:
+                current_app.conf.task_always_eager = always_eager
+        usage_buffer.flush()
+        self.assertEqual(UrlUsage.objects.count(), ITERATIONS * 2)
+        self.report("Usage logging", results)
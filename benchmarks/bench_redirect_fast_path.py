@@ -0,0 +1,73 @@
+"""
+Measure the per-request overhead of the redirect through DRF and the full middleware stack,
+through a plain Django view and through RedirectFastPathMiddleware.
+
+    python manage.py test benchmarks.bench_redirect_fast_path
+
+The redirects are served from the cache so the numbers are mostly the request handling overhead.
+"""
+import os
+from time import perf_counter
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.test.utils import override_settings
+from django.urls import include, path
+
+from benchmarks.utils import percentile, print_table
+from urls.api.views import RedirectView
+from urls.models import URL
+from urls.usage_logger import UsageBuffer
+
+REQUESTS_PER_RUN = int(os.environ.get("BENCHMARK_REQUESTS_PER_RUN", "2000"))
+
+plain_view_urlpatterns = [
+    path("u/<str:token>/", RedirectView.as_view()),
+]
+urlpatterns = [
+    path("plain/", include(plain_view_urlpatterns)),
+    path("", include("config.urls")),
+]
+
+
+def run(path):
+    # A new client loads the middlewares with the current settings
+    client = Client()
+    client.get(path)
+    latencies = []
+    for _ in range(REQUESTS_PER_RUN):
+        started_at = perf_counter()
+        client.get(path)
+        latencies.append(perf_counter() - started_at)
+    return latencies
+
+
+def format_row(name, latencies):
+    return (
+        name,
+        f"{len(latencies) / sum(latencies):.0f}",
+        f"{percentile(latencies, 0.5) * 1_000_000:.0f}",
+        f"{percentile(latencies, 0.99) * 1_000_000:.0f}",
+    )
+
+
+@override_settings(ROOT_URLCONF="benchmarks.bench_redirect_fast_path", URL_SHORTENER_USE_CACHE=True)
+@patch("urls.api.views.usage_buffer", UsageBuffer(flush_callback=lambda usages: None, use_timer=False))
+class RedirectFastPathBenchmark(TestCase):
+    def test_redirect_overhead(self):
+        cache.clear()
+        token = URL.objects.create(url="https://example.com").token
+
+        rows = [
+            format_row("drf view", run(f"/u/{token}/")),
+            format_row("plain view", run(f"/plain/u/{token}/")),
+        ]
+        with override_settings(URL_SHORTENER_USE_REDIRECT_FAST_PATH=True):
+            rows.append(format_row("fast path", run(f"/u/{token}/")))
+
+        print_table(
+            f"{REQUESTS_PER_RUN} cached redirects",
+            ("handler", "requests/s", "p50 us", "p99 us"),
+            rows,
+        )
@@ -0,0 +1,67 @@
+"""
+Measure the redirect lookup of tokens that have many expired rows, with and without the active_token_lookup index.
+
+    python manage.py test benchmarks.bench_redirect_lookup
+
+BENCHMARK_TOKENS (default 200) tokens get BENCHMARK_EXPIRED_ROWS_PER_TOKEN (default 100) expired rows and one active row.
+"""
+import os
+from datetime import timedelta
+
+from django.db import connection
+from django.test import TransactionTestCase
+from django.utils.timezone import now
+
+from benchmarks.utils import measure, print_table
+from urls.api.views import RedirectView
+from urls.models import URL
+
+TOKENS = int(os.environ.get("BENCHMARK_TOKENS", "200"))
+EXPIRED_ROWS_PER_TOKEN = int(os.environ.get("BENCHMARK_EXPIRED_ROWS_PER_TOKEN", "100"))
+LOOKUP_INDEX = next(index for index in URL._meta.indexes if index.name == "active_token_lookup")
+
+
+def look_up(tokens):
+    view = RedirectView()
+    for token in tokens:
+        assert view.get_object(token) is not None
+
+
+def create_urls():
+    tokens = [f"{i:05d}" for i in range(TOKENS)]
+    expired_at = now() - timedelta(days=1)
+    URL.objects.bulk_create(
+        [
+            URL(url=f"https://example.com/{token}/{i}", token=token, expiration_date=expired_at - timedelta(days=i))
+            for token in tokens for i in range(EXPIRED_ROWS_PER_TOKEN)
+        ]
+        + [URL(url=f"https://example.com/{token}", token=token) for token in tokens],
+        batch_size=10_000,
+    )
+    with connection.cursor() as cursor:
+        # Let the planner see the real row counts
+        cursor.execute("ANALYZE")
+    return tokens
+
+
+class RedirectLookupBenchmark(TransactionTestCase):
+    def test_lookup_with_many_expired_rows_per_token(self):
+        tokens = create_urls()
+        rows = []
+        seconds, queries = measure(look_up, tokens)
+        rows.append(("active_token_lookup", f"{TOKENS / seconds:.0f}", f"{queries / TOKENS:.2f}"))
+
+        with connection.schema_editor() as schema_editor:
+            schema_editor.remove_index(URL, LOOKUP_INDEX)
+        try:
+            seconds, queries = measure(look_up, tokens)
+            rows.append(("token index only", f"{TOKENS / seconds:.0f}", f"{queries / TOKENS:.2f}"))
+        finally:
+            with connection.schema_editor() as schema_editor:
+                schema_editor.add_index(URL, LOOKUP_INDEX)
+
+        print_table(
+            f"Redirect lookup of {TOKENS} tokens with {EXPIRED_ROWS_PER_TOKEN} expired rows each",
+            ("index", "lookups/s", "queries/lookup"),
+            rows,
+        )
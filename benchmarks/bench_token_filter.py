@@ -0,0 +1,68 @@
+"""
+Measure URL.create_token with and without the active token filter at 10%, 50% and 90% keyspace occupancy.
+
+    python manage.py test benchmarks.bench_token_filter
+
+The keyspace is shrunk to BENCHMARK_TOKEN_LENGTH characters (default 3, 238,328 tokens) so that it can be filled.
+"""
+import os
+from itertools import product
+from random import sample
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from benchmarks.utils import measure, print_table
+from urls.models import AVAILABLE_CHARS, URL
+from urls.token_filter import active_token_filter
+
+TOKEN_LENGTH = int(os.environ.get("BENCHMARK_TOKEN_LENGTH", "3"))
+OCCUPANCIES = (0.1, 0.5, 0.9)
+TOKENS_PER_RUN = int(os.environ.get("BENCHMARK_TOKENS_PER_RUN", "1000"))
+KEYSPACE_SIZE = len(AVAILABLE_CHARS) ** TOKEN_LENGTH
+
+
+def create_tokens(count):
+    for _ in range(count):
+        URL.create_token()
+
+
+def occupy_keyspace(occupancy):
+    URL.objects.all().delete()
+    occupied_indexes = set(sample(range(KEYSPACE_SIZE), int(KEYSPACE_SIZE * occupancy)))
+    all_tokens = ("".join(chars) for chars in product(AVAILABLE_CHARS, repeat=TOKEN_LENGTH))
+    URL.objects.bulk_create(
+        [
+            URL(url="https://example.com", token=token)
+            for index, token in enumerate(all_tokens) if index in occupied_indexes
+        ],
+        batch_size=10_000,
+    )
+
+
+@patch("urls.models.MAXIMUM_TOKEN_LENGTH", TOKEN_LENGTH)
+@patch("urls.models.MAXIMUM_RECURSION_DEPTH", 1000)
+class TokenFilterBenchmark(TestCase):
+    def test_create_token_with_keyspace_occupancy(self):
+        rows = []
+        for occupancy in OCCUPANCIES:
+            occupy_keyspace(occupancy)
+            with override_settings(URL_SHORTENER_USE_TOKEN_FILTER=False):
+                seconds, queries = measure(create_tokens, TOKENS_PER_RUN)
+            with override_settings(URL_SHORTENER_USE_TOKEN_FILTER=True):
+                # The rebuild happens once per process, keep it out of the measurement
+                active_token_filter.rebuild()
+                filter_seconds, filter_queries = measure(create_tokens, TOKENS_PER_RUN)
+            active_token_filter.clear()
+            rows.append((
+                f"{occupancy:.0%}",
+                f"{TOKENS_PER_RUN / seconds:.0f}", f"{queries / TOKENS_PER_RUN:.2f}",
+                f"{TOKENS_PER_RUN / filter_seconds:.0f}", f"{filter_queries / TOKENS_PER_RUN:.2f}",
+            ))
+
+        print_table(
+            f"URL.create_token over a keyspace of {KEYSPACE_SIZE} tokens",
+            ("occupancy", "tokens/s", "queries/token", "filter tokens/s", "filter queries/token"),
+            rows,
+        )
@@ -0,0 +1,58 @@
+"""
+Compare URLManager.create with a claimed token of the database pool and of the Redis pool.
+
+    python manage.py test benchmarks.bench_token_pool
+
+The Redis pool uses the server of URL_SHORTENER_TOKEN_POOL_REDIS_URL, or fakeredis when the server
+is not reachable (which leaves out the network round trip). BENCHMARK_ITERATIONS (default 500) sets the claims per pool.
+"""
+import os
+from unittest import SkipTest
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from benchmarks.utils import report, run
+from urls.models import URL
+from urls.token_pool import RedisTokenPool
+
+ITERATIONS = int(os.environ.get("BENCHMARK_ITERATIONS", "500"))
+
+
+def get_redis_token_pool():
+    pool = RedisTokenPool()
+    try:
+        pool.client.ping()
+        return pool, "redis"
+    except Exception:
+        pass
+    try:
+        import fakeredis
+    except ImportError:
+        raise SkipTest("Neither a Redis server nor fakeredis is available")
+    return RedisTokenPool(client=fakeredis.FakeRedis(decode_responses=True)), "fakeredis"
+
+
+# Keep the claims from scheduling refills
+@override_settings(URL_SHORTENER_TOKEN_POOL_LOW_WATERMARK=0)
+class TokenPoolClaimBenchmark(TestCase):
+    def test_claim(self):
+        redis_token_pool, redis_name = get_redis_token_pool()
+        redis_token_pool.client.delete(redis_token_pool.key)
+        self.addCleanup(redis_token_pool.client.delete, redis_token_pool.key)
+
+        def create():
+            URL.objects.create(url="https://example.com")
+
+        def fill_database_pool():
+            URL.objects.bulk_create_ready_to_set_tokens(1)
+
+        def fill_redis_pool():
+            redis_token_pool.add(URL.create_tokens(1))
+
+        results = [run("create with a database pool token", create, ITERATIONS, setup=fill_database_pool)]
+        with override_settings(URL_SHORTENER_TOKEN_POOL_BACKEND="redis"), \
+                patch("urls.querysets.redis_token_pool", redis_token_pool):
+            results.append(run(f"create with a {redis_name} pool token", create, ITERATIONS, setup=fill_redis_pool))
+        report("Token pool claims", results)
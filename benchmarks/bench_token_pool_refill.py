@@ -0,0 +1,42 @@
+"""
+Compare refilling the ready-to-set token pool one token at a time with the bulk refill.
+
+    python manage.py test benchmarks.bench_token_pool_refill
+
+The pool sizes can be changed with BENCHMARK_POOL_SIZES (default "10,1000,100000").
+"""
+import os
+
+from django.test import TestCase
+
+from benchmarks.utils import measure, print_table
+from urls.models import URL
+
+POOL_SIZES = [int(size) for size in os.environ.get("BENCHMARK_POOL_SIZES", "10,1000,100000").split(",")]
+
+
+def refill_one_by_one(count):
+    for _ in range(count):
+        URL.objects.create_ready_to_set_token()
+
+
+class TokenPoolRefillBenchmark(TestCase):
+    def test_refill_ready_to_set_token_pool(self):
+        rows = []
+        for pool_size in POOL_SIZES:
+            loop_seconds, loop_queries = measure(refill_one_by_one, pool_size)
+            URL.objects.all().delete()
+            bulk_seconds, bulk_queries = measure(URL.objects.bulk_create_ready_to_set_tokens, pool_size)
+            URL.objects.all().delete()
+            rows.append((
+                pool_size,
+                f"{loop_seconds:.3f}", loop_queries,
+                f"{bulk_seconds:.3f}", bulk_queries,
+                f"{loop_seconds / bulk_seconds:.1f}x",
+            ))
+
+        print_table(
+            "Ready-to-set token pool refill",
+            ("pool size", "loop (s)", "loop queries", "bulk (s)", "bulk queries", "speedup"),
+            rows,
+        )
@@ -0,0 +1,124 @@
+import json
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from time import perf_counter
+
+from django.db import connection
+
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(func, *args, **kwargs):
+    """
+    Run `func` once and return the elapsed seconds and the number of executed queries.
+    """
+    query_counter = QueryCounter()
+    with connection.execute_wrapper(query_counter):
+        started_at = perf_counter()
+        func(*args, **kwargs)
+        elapsed = perf_counter() - started_at
+    return elapsed, query_counter.count
+
+
+def print_table(title, headers, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    print(f"\n{title}")
+    for row in (headers, *rows):
+        print("  ".join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+@dataclass
+class Result:
+    name: str
+    ops_per_second: float
+    p50_ms: float
+    p99_ms: float
+    queries_per_op: float
+
+
+def run(name, func, iterations, setup=None):
+    """
+    Call `func` `iterations` times, `setup` runs before every call and is not measured.
+    """
+    query_counter = QueryCounter()
+    latencies = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        with connection.execute_wrapper(query_counter):
+            started_at = perf_counter()
+            func()
+            latencies.append(perf_counter() - started_at)
+    return Result(
+        name=name,
+        ops_per_second=iterations / sum(latencies),
+        p50_ms=percentile(latencies, 0.5) * 1000,
+        p99_ms=percentile(latencies, 0.99) * 1000,
+        queries_per_op=query_counter.count / iterations,
+    )
+
+
+def get_baseline_path():
+    return BASELINE_DIR / f"{connection.vendor}.json"
+
+
+def load_baseline():
+    path = get_baseline_path()
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_baseline(results):
+    BASELINE_DIR.mkdir(exist_ok=True)
+    baseline = load_baseline()
+    baseline.update({result.name: asdict(result) for result in results})
+    get_baseline_path().write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+
+def report(title, results):
+    """
+    Print the results next to the stored baseline of the database vendor, store them as the new baseline
+    with BENCHMARK_SAVE_BASELINE=1. Return the names of the results that are slower than the baseline
+    by more than BENCHMARK_MAX_REGRESSION (default 0.25) or that run more queries.
+    """
+    baseline = load_baseline()
+    max_regression = float(os.environ.get("BENCHMARK_MAX_REGRESSION", "0.25"))
+    rows = []
+    regressions = []
+    for result in results:
+        baseline_result = baseline.get(result.name)
+        change = "-"
+        if baseline_result:
+            ratio = result.ops_per_second / baseline_result["ops_per_second"]
+            change = f"{ratio - 1:+.0%}"
+            if ratio < 1 - max_regression or result.queries_per_op > baseline_result["queries_per_op"]:
+                regressions.append(result.name)
+        rows.append((
+            result.name, f"{result.ops_per_second:.0f}", f"{result.p50_ms:.3f}", f"{result.p99_ms:.3f}",
+            f"{result.queries_per_op:.2f}", change,
+        ))
+    print_table(
+        f"{title} ({connection.vendor})",
+        ("benchmark", "ops/s", "p50 ms", "p99 ms", "queries/op", "vs baseline"),
+        rows,
+    )
+
+    if os.environ.get("BENCHMARK_SAVE_BASELINE") == "1":
+        save_baseline(results)
+    return regressions
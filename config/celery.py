@@ -17,8 +17,21 @@ celery_app.conf.task_always_eager = False
 celery_app.conf.worker_prefetch_multiplier = 1
 
 celery_app.conf.beat_schedule = {
-    'create_ready_to_set_token': {
-        'task': 'urls.tasks.create_ready_to_set_token',
-        'schedule': crontab(hour=0, minute=5),  # 00:05
+    # The claims that cross the low watermark of the pool schedule the refill too, this one is a safety net
+    'create_ready_to_set_token_periodically': {
+        'task': 'urls.tasks.create_ready_to_set_token_periodically',
+        'schedule': timedelta(minutes=15),
+    },
+    'compact_url_usages': {
+        'task': 'urls.tasks.compact_url_usages',
+        'schedule': crontab(hour=1, minute=5),  # 01:05
+    },
+    'reap_expired_urls': {
+        'task': 'urls.tasks.reap_expired_urls',
+        'schedule': crontab(hour=2, minute=5),  # 02:05
+    },
+    'maintain_url_usage_partitions': {
+        'task': 'urls.tasks.maintain_url_usage_partitions',
+        'schedule': crontab(hour=0, minute=15),  # 00:15
     },
 }
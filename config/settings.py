@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -20,6 +21,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'urls.middleware.RedirectFastPathMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -53,6 +55,21 @@ DATABASES = {
         'NAME': BASE_DIR / 'db.sqlite3',
     }
 }
+if os.environ.get('POSTGRES_DB'):
+    # e.g. to run the tests and the benchmarks against a local PostgreSQL
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ['POSTGRES_DB'],
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+    }
+
+SILENCED_SYSTEM_CHECKS = [
+    # The covering columns of the indexes are only used by PostgreSQL
+    'models.W040',
+]
 
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -78,7 +95,70 @@ URL_SHORTENER_MAXIMUM_TOKEN_LENGTH = 5
 URL_SHORTENER_MAXIMUM_URL_LENGTH = 255
 URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT = 10
 URL_SHORTENER_MAXIMUM_RECURSION_DEPTH = 5
+URL_SHORTENER_TOKEN_BATCH_SIZE = 500
+URL_SHORTENER_USE_TOKEN_FILTER = False
+URL_SHORTENER_TOKEN_FILTER_ERROR_RATE = 0.01
+URL_SHORTENER_TOKEN_FILTER_REBUILD_INTERVAL = 60 * 60  # seconds
+URL_SHORTENER_TOKEN_GENERATOR = 'random'  # 'random' or 'counter'
+URL_SHORTENER_TOKEN_COUNTER_BLOCK_SIZE = 1000
+# Changing the key of a running deployment makes the new counter tokens collide with the existing ones
+URL_SHORTENER_TOKEN_COUNTER_KEY = 'url-shortener-token-counter'
 URL_SHORTENER_READY_TO_SET_TOKEN_URL = 'https://shayestehhs.com'
+URL_SHORTENER_TOKEN_POOL_BACKEND = 'database'  # 'database' or 'redis'
+URL_SHORTENER_TOKEN_POOL_REDIS_URL = 'redis://localhost:6379/0'
+URL_SHORTENER_TOKEN_POOL_REDIS_KEY = 'url_shortener:token_pool'
+URL_SHORTENER_TOKEN_POOL_LOW_WATERMARK = 3  # tokens, a refill is scheduled below it
+URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL = False
+URL_SHORTENER_TOKEN_POOL_MAX_SIZE = 10_000
+URL_SHORTENER_TOKEN_POOL_RATE_WINDOW = 15 * 60  # seconds of claims the claim rate is measured over
+URL_SHORTENER_TOKEN_POOL_REFILL_HORIZON = 60 * 60  # seconds of claims a refill covers
+URL_SHORTENER_TOKEN_POOL_REFILL_LEAD_TIME = 60  # seconds of claims left when a refill is scheduled
 URL_SHORTENER_DEFAULT_EXPIRATION_DAYS = 365 * 5
+# What reap_expired_urls does with the expired urls: "archive", "delete" or None to keep them
+URL_SHORTENER_EXPIRED_URL_REAPER_MODE = None
+URL_SHORTENER_EXPIRED_URL_GRACE_DAYS = 30
+URL_SHORTENER_EXPIRED_URL_REAPER_BATCH_SIZE = 1000
+URL_SHORTENER_EXPIRED_URL_REAPER_MAX_BATCHES = 100  # per run
 URL_SHORTENER_USE_CELERY_AS_USAGE_LOGGER = False
 URL_SHORTENER_USE_CACHE = False
+# Cache of the redirect entries, e.g. a dedicated alias of CACHES that only holds the redirects
+URL_SHORTENER_CACHE_ALIAS = "default"
+URL_SHORTENER_CACHE_KEY_PREFIX = "r:"
+# Bumping the version drops every cached redirect entry at once
+URL_SHORTENER_CACHE_KEY_VERSION = 1
+# Serve the redirects with an async view, only useful when running under an ASGI server
+URL_SHORTENER_USE_ASYNC_REDIRECT = False
+# Serve the redirects from RedirectFastPathMiddleware, skipping the rest of the middlewares and DRF
+URL_SHORTENER_USE_REDIRECT_FAST_PATH = False
+# Cache the entries of the created and claimed urls when their transaction commits instead of on their first redirect
+URL_SHORTENER_USE_CACHE_WRITE_THROUGH = False
+URL_SHORTENER_NEGATIVE_CACHE_TTL = 30  # seconds, 0 disables caching the unknown and expired tokens
+# Entries are reloaded from the database this often while the stale entry is still served, None disables it
+URL_SHORTENER_CACHE_REFRESH_INTERVAL = None  # seconds
+URL_SHORTENER_CACHE_EARLY_REFRESH_BETA = 1.0
+# Let a single process fill a missing entry while the other processes wait for it
+URL_SHORTENER_USE_CACHE_LOCK = False
+URL_SHORTENER_CACHE_LOCK_TIMEOUT = 5  # seconds
+URL_SHORTENER_CACHE_LOCK_WAIT = 0.5  # seconds
+URL_SHORTENER_CACHE_WARM_UP_LIMIT = 1000
+URL_SHORTENER_CACHE_WARM_UP_DAYS = 7
+URL_SHORTENER_USE_LOCAL_CACHE = False
+URL_SHORTENER_LOCAL_CACHE_MAX_SIZE = 10_000
+URL_SHORTENER_LOCAL_CACHE_TTL = 60  # seconds
+URL_SHORTENER_LOCAL_CACHE_GENERATION_CHECK_INTERVAL = 1  # seconds
+URL_SHORTENER_BULK_CREATE_LIMIT = 10_000
+URL_SHORTENER_RESOLVE_LIMIT = 1000
+# Expose the redirect counters and latency histograms on /u/api/metrics/ in the Prometheus text format
+URL_SHORTENER_USE_METRICS = False
+# Shared by the processes of a host (e.g. the gunicorn workers) to add up their metrics, None keeps them per process
+URL_SHORTENER_METRICS_MULTIPROCESS_DIR = None
+URL_SHORTENER_METRICS_WRITE_INTERVAL = 5  # seconds
+URL_SHORTENER_USAGE_LOG_BATCH_SIZE = 100
+URL_SHORTENER_USAGE_LOG_FLUSH_INTERVAL = 5  # seconds
+URL_SHORTENER_USAGE_LOG_BUFFER_CAPACITY = 10_000
+URL_SHORTENER_USAGE_LOG_MAX_RETRY_DELAY = 60  # seconds between the flush attempts while flushing fails
+URL_SHORTENER_USAGE_RETENTION_DAYS = 30
+URL_SHORTENER_USAGE_COMPACTION_BATCH_SIZE = 10_000
+# Store the usages in monthly partitions, see urls/partitions.py
+URL_SHORTENER_USE_USAGE_PARTITIONS = False
+URL_SHORTENER_USAGE_PARTITIONS_AHEAD = 2  # months
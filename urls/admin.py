@@ -1,9 +1,10 @@
 from django.conf import settings
 from django.contrib import admin
 from django.core.exceptions import ValidationError
+from django.db.models import OuterRef, Subquery, Sum
 from django.forms import ModelForm
 
-from urls.models import URL, UrlUsage
+from urls.models import URL, ArchivedURL, UrlUsage, UrlUsageCounter
 
 
 class UrlAdminForm(ModelForm):
@@ -33,10 +34,24 @@ class UrlAdminForm(ModelForm):
 @admin.register(URL)
 class UrlAdmin(admin.ModelAdmin):
     form = UrlAdminForm
-    list_display = ("__str__", "token", "created_at", "is_active")
+    list_display = ("__str__", "token", "created_at", "is_active", "clicks")
     ordering = ("-updated_at",)
     search_fields = ("token", "url")
     search_help_text = "Search by 'URL' or 'Token' to quickly find specific records."
+    # The total count would be a second COUNT of the whole table on every page
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # A correlated subquery is an index lookup per row of the page, a join would group the whole url table
+        clicks = (
+            UrlUsageCounter.objects
+            .filter(url=OuterRef("pk"))
+            .order_by()
+            .values("url")
+            .annotate(total=Sum("count"))
+            .values("total")
+        )
+        return super().get_queryset(request).annotate(clicks=Subquery(clicks))
 
     def is_active(self, obj):
         return obj.is_active
@@ -44,18 +59,19 @@ class UrlAdmin(admin.ModelAdmin):
     is_active.short_description = 'Is Active'
     is_active.boolean = True
 
+    def clicks(self, obj):
+        return obj.clicks or 0
+
+    clicks.short_description = 'Clicks'
+    clicks.admin_order_field = 'clicks'
+
     def has_change_permission(self, request, obj=None):
         if obj:
             return False
         return True
 
     def save_model(self, request, obj, form, change):
-        token = form.cleaned_data["token"]
-        ready_to_set_token = URL.objects.all_ready_to_set_token().filter(token=token).first()
-        if ready_to_set_token:
-            ready_to_set_token.url = form.cleaned_data["url"]
-            ready_to_set_token.name = form.cleaned_data["name"]
-            ready_to_set_token.save(update_fields=["url", "name"])
+        if URL.objects.claim_ready_to_set_token(**form.cleaned_data):
             return
 
         URL.objects.create(**form.cleaned_data)
@@ -70,7 +86,9 @@ class UrlAdmin(admin.ModelAdmin):
 @admin.register(UrlUsage)
 class UrlUsageAdmin(admin.ModelAdmin):
     list_display = ("id", "url", "get_token", "created_at",)
-    ordering = ("-id",)
+    # Served by the created_at index, also when the table is partitioned on it
+    ordering = ("-created_at",)
+    show_full_result_count = False
 
     def get_queryset(self, request):
         return super().get_queryset(request).select_related("url")
@@ -79,3 +97,26 @@ class UrlUsageAdmin(admin.ModelAdmin):
         return obj.url.token
 
     get_token.short_description = 'Token'
+
+
+@admin.register(UrlUsageCounter)
+class UrlUsageCounterAdmin(admin.ModelAdmin):
+    list_display = ("id", "url", "get_token", "bucket", "count")
+    ordering = ("-bucket",)
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("url")
+
+    def get_token(self, obj: UrlUsageCounter):
+        return obj.url.token
+
+    get_token.short_description = 'Token'
+
+
+@admin.register(ArchivedURL)
+class ArchivedURLAdmin(admin.ModelAdmin):
+    list_display = ("original_id", "url", "token", "expiration_date", "clicks", "archived_at")
+    search_fields = ("token", "url")
+    ordering = ("-archived_at",)
+    show_full_result_count = False
@@ -0,0 +1,38 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from urls.models import URL
+
+
+class URLSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = URL
+        fields = ("url", "name", "token", "short_url", "expiration_date")
+
+
+class BulkCreateURLItemSerializer(serializers.Serializer):
+    url = serializers.CharField()
+    token = serializers.CharField(required=False, allow_blank=True)
+    name = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    expiration_date = serializers.DateTimeField(required=False, allow_null=True)
+
+
+class BulkCreateURLSerializer(serializers.Serializer):
+    urls = BulkCreateURLItemSerializer(
+        many=True,
+        allow_empty=False,
+        max_length=settings.URL_SHORTENER_BULK_CREATE_LIMIT,
+    )
+
+
+class ResolveTokensSerializer(serializers.Serializer):
+    tokens = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        max_length=settings.URL_SHORTENER_RESOLVE_LIMIT,
+    )
+
+
+class ResolvedTokenSerializer(serializers.Serializer):
+    url = serializers.CharField()
+    expiration_date = serializers.DateTimeField()
@@ -1,8 +1,17 @@
+from django.conf import settings
 from django.urls import path
 from urls.api import views
 
 app_name = "urls"
 
+if settings.URL_SHORTENER_USE_ASYNC_REDIRECT:
+    redirect_view = views.AsyncRedirectView.as_view()
+else:
+    redirect_view = views.RedirectAPIView.as_view()
+
 urlpatterns = [
-    path('<str:token>/', views.RedirectAPIView.as_view(), name='redirect'),
+    path('api/urls/bulk/', views.BulkCreateURLAPIView.as_view(), name='bulk-create'),
+    path('api/urls/resolve/', views.ResolveTokensAPIView.as_view(), name='resolve'),
+    path('api/metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('<str:token>/', redirect_view, name='redirect'),
 ]
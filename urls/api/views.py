@@ -1,61 +1,163 @@
+from datetime import datetime, timezone
+from time import monotonic
+
 from django.conf import settings
-from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.db.models import F, ExpressionWrapper, DurationField
 from django.db.models.functions import Now
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.utils.timezone import now
+from django.views import View
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from urls.api.serializers import (
+    BulkCreateURLSerializer,
+    ResolvedTokenSerializer,
+    ResolveTokensSerializer,
+    URLSerializer,
+)
+from urls.cache import (
+    NOT_FOUND,
+    aacquire_fill_lock,
+    acquire_fill_lock,
+    arelease_fill_lock,
+    async_single_flight,
+    await_entry,
+    build_redirect_entry,
+    cache_redirect_entries,
+    get_remaining_seconds,
+    local_cache,
+    redirect_cache,
+    release_fill_lock,
+    should_refresh_early,
+    single_flight,
+    wait_for_entry,
+)
+from urls import metrics
 from urls.models import URL
-from urls.tasks import log_the_url_usages
+from urls.tasks import USAGE_DATETIME_FORMAT
+from urls.usage_logger import usage_buffer
 
-USE_CELERY_AS_USAGE_LOGGER = settings.URL_SHORTENER_USE_CELERY_AS_USAGE_LOGGER
 MAXIMUM_TOKEN_LENGTH = settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH
 
 
-class RedirectAPIView(APIView):
-    authorization_classes = []
-
-    def get(self, *args, **kwargs):
-        token = self.kwargs["token"]
+class RedirectMixin:
+    @metrics.redirect_seconds.time()
+    def redirect(self, token):
         if len(token) != MAXIMUM_TOKEN_LENGTH:
-            return HttpResponseRedirect(redirect_to=settings.URL_SHORTENER_404_PAGE)
+            return self.get_not_found_response()
 
-        if settings.URL_SHORTENER_USE_CACHE and (cached_value := cache.get(token)):
+        if settings.URL_SHORTENER_USE_CACHE:
+            cached_value = self.get_cached_value(token)
+            if cached_value and should_refresh_early(cached_value):
+                cached_value = self.refresh_cached_value(token, cached_value)
+            elif not cached_value:
+                # Concurrent misses of the same token in this process share a single query
+                cached_value = single_flight.do(token, self.fill_cache, token)
+
+            if cached_value == NOT_FOUND:
+                return self.get_not_found_response()
             redirect_url = cached_value["redirect_url"]
             url_pk = cached_value["url_pk"]
         else:
             url_obj = self.get_object(token)
             if not url_obj:
-                return HttpResponseRedirect(redirect_to=settings.URL_SHORTENER_404_PAGE)
-
+                return self.get_not_found_response()
             redirect_url = url_obj.url
             url_pk = url_obj.pk
-            if settings.URL_SHORTENER_USE_CACHE:
-                data = {
-                    "redirect_url": redirect_url,
-                    "url_pk": url_pk
-                }
-                cache.set(token, data, url_obj.remaining_seconds)
 
         self.log_the_url_usages(url_pk)
+        metrics.redirect_requests.inc(result="found")
         return HttpResponseRedirect(redirect_to=redirect_url)
 
+    def get_not_found_response(self):
+        metrics.redirect_requests.inc(result="not_found")
+        return HttpResponseRedirect(redirect_to=settings.URL_SHORTENER_404_PAGE)
+
+    def refresh_cached_value(self, token, stale_value):
+        # The stale entry is served while another request refreshes it
+        if single_flight.is_running(token):
+            return stale_value
+        return single_flight.do(token, self.fill_cache, token, stale_value)
+
+    def fill_cache(self, token, stale_value=None):
+        """
+        Load the entry of `token` from the database and cache it.
+        NOT_FOUND is returned for the tokens that do not have an active url.
+        """
+        has_lock = False
+        if settings.URL_SHORTENER_USE_CACHE_LOCK:
+            has_lock = acquire_fill_lock(token)
+            if not has_lock:
+                # Another process is filling this entry
+                if stale_value is not None:
+                    return stale_value
+                if (cached_value := wait_for_entry(token)) is not None:
+                    return cached_value
+
+        try:
+            return self.load_cached_value(token)
+        finally:
+            if has_lock:
+                release_fill_lock(token)
+
+    def load_cached_value(self, token):
+        started_at = monotonic()
+        url_obj = self.get_object(token)
+        if not url_obj:
+            if settings.URL_SHORTENER_NEGATIVE_CACHE_TTL:
+                # The post_save signal deletes this entry once the token gets an active url
+                redirect_cache.set(token, NOT_FOUND, settings.URL_SHORTENER_NEGATIVE_CACHE_TTL)
+            return NOT_FOUND
+
+        data, timeout = self.get_redirect_entry(url_obj, compute_seconds=monotonic() - started_at)
+        redirect_cache.set(token, data, timeout)
+        self.set_local_cached_value(token, data, timeout)
+        return data
+
+    def get_cached_value(self, token):
+        if settings.URL_SHORTENER_USE_LOCAL_CACHE and (cached_value := local_cache.get(token)):
+            metrics.redirect_cache_lookups.inc(result="local_hit")
+            return cached_value
+
+        cached_value = redirect_cache.get(token)
+        metrics.redirect_cache_lookups.inc(result="hit" if cached_value else "miss")
+        # Misses are not kept locally, other processes can not invalidate them when the token is created
+        if cached_value and cached_value != NOT_FOUND and settings.URL_SHORTENER_USE_LOCAL_CACHE:
+            self.set_local_cached_value(token, cached_value, get_remaining_seconds(cached_value))
+        return cached_value
+
+    @metrics.usage_log_seconds.time()
     def log_the_url_usages(self, url_pk):
-        usage_log_args = (url_pk, now().strftime("%Y-%m-%d %H:%M:%S %z"))
-        if USE_CELERY_AS_USAGE_LOGGER:
-            log_the_url_usages.delay(*usage_log_args)
-        else:
-            log_the_url_usages(*usage_log_args)
+        usage_buffer.add(url_pk, now().strftime(USAGE_DATETIME_FORMAT))
 
+    @metrics.redirect_lookup_seconds.time()
     def get_object(self, token):
+        return self.get_object_queryset(token).first()
+
+    def set_local_cached_value(self, token, data, timeout):
+        if settings.URL_SHORTENER_USE_LOCAL_CACHE:
+            local_cache.set(token, data, min(timeout, settings.URL_SHORTENER_LOCAL_CACHE_TTL))
+
+    def get_redirect_entry(self, url_obj, compute_seconds=0):
+        timeout = int(url_obj.remaining_seconds.total_seconds())
+        return build_redirect_entry(url_obj.url, url_obj.pk, timeout, compute_seconds), timeout
+
+    def get_object_queryset(self, token):
+        return self.get_lookup_queryset(token=token)
+
+    def get_lookup_queryset(self, **token_lookup):
         queryset = (
             URL.objects
-            .filter(token=token)
+            .filter(**token_lookup)
             .exclude_ready_to_set_urls()
             .all_actives()
             .only("url")
-            .order_by()
+            # Follows the active_token_lookup index, so the first row is read without a sort
+            .order_by("-expiration_date")
         )
         if settings.URL_SHORTENER_USE_CACHE:
             queryset = queryset.annotate(
@@ -64,4 +166,192 @@ class RedirectAPIView(APIView):
                     output_field=DurationField(),
                 )
             )
-        return queryset.first()
+        return queryset
+
+
+class RedirectAPIView(RedirectMixin, APIView):
+    authorization_classes = []
+
+    def get(self, *args, **kwargs):
+        return self.redirect(self.kwargs["token"])
+
+
+class RedirectView(RedirectMixin, View):
+    """
+    Same as `RedirectAPIView` without the DRF request wrapping, authentication and content negotiation.
+    """
+
+    def get(self, request, token):
+        return self.redirect(token)
+
+
+class AsyncRedirectView(RedirectMixin, View):
+    """
+    Same as `RedirectAPIView` for ASGI servers, the cache and database calls do not block the event loop
+    and the usages are flushed in the background.
+    """
+
+    async def get(self, request, token):
+        with metrics.redirect_seconds.time():
+            return await self.aredirect(token)
+
+    async def aredirect(self, token):
+        if len(token) != MAXIMUM_TOKEN_LENGTH:
+            return self.get_not_found_response()
+
+        if settings.URL_SHORTENER_USE_CACHE:
+            cached_value = await self.aget_cached_value(token)
+            if cached_value and should_refresh_early(cached_value):
+                cached_value = await self.arefresh_cached_value(token, cached_value)
+            elif not cached_value:
+                # Concurrent misses of the same token in this event loop share a single query
+                cached_value = await async_single_flight.do(token, self.afill_cache, token)
+
+            if cached_value == NOT_FOUND:
+                return self.get_not_found_response()
+            redirect_url = cached_value["redirect_url"]
+            url_pk = cached_value["url_pk"]
+        else:
+            url_obj = await self.aget_object(token)
+            if not url_obj:
+                return self.get_not_found_response()
+            redirect_url = url_obj.url
+            url_pk = url_obj.pk
+
+        await self.alog_the_url_usages(url_pk)
+        metrics.redirect_requests.inc(result="found")
+        return HttpResponseRedirect(redirect_to=redirect_url)
+
+    async def arefresh_cached_value(self, token, stale_value):
+        if async_single_flight.is_running(token):
+            return stale_value
+        return await async_single_flight.do(token, self.afill_cache, token, stale_value)
+
+    async def afill_cache(self, token, stale_value=None):
+        """
+        Same as `fill_cache` without blocking the event loop.
+        """
+        has_lock = False
+        if settings.URL_SHORTENER_USE_CACHE_LOCK:
+            has_lock = await aacquire_fill_lock(token)
+            if not has_lock:
+                if stale_value is not None:
+                    return stale_value
+                if (cached_value := await await_entry(token)) is not None:
+                    return cached_value
+
+        try:
+            return await self.aload_cached_value(token)
+        finally:
+            if has_lock:
+                await arelease_fill_lock(token)
+
+    async def aload_cached_value(self, token):
+        started_at = monotonic()
+        url_obj = await self.aget_object(token)
+        if not url_obj:
+            if settings.URL_SHORTENER_NEGATIVE_CACHE_TTL:
+                await redirect_cache.aset(token, NOT_FOUND, settings.URL_SHORTENER_NEGATIVE_CACHE_TTL)
+            return NOT_FOUND
+
+        data, timeout = self.get_redirect_entry(url_obj, compute_seconds=monotonic() - started_at)
+        await redirect_cache.aset(token, data, timeout)
+        await self.aset_local_cached_value(token, data, timeout)
+        return data
+
+    async def aget_cached_value(self, token):
+        if settings.URL_SHORTENER_USE_LOCAL_CACHE and (cached_value := await local_cache.aget(token)):
+            metrics.redirect_cache_lookups.inc(result="local_hit")
+            return cached_value
+
+        cached_value = await redirect_cache.aget(token)
+        metrics.redirect_cache_lookups.inc(result="hit" if cached_value else "miss")
+        if cached_value and cached_value != NOT_FOUND and settings.URL_SHORTENER_USE_LOCAL_CACHE:
+            await self.aset_local_cached_value(token, cached_value, get_remaining_seconds(cached_value))
+        return cached_value
+
+    async def aset_local_cached_value(self, token, data, timeout):
+        if settings.URL_SHORTENER_USE_LOCAL_CACHE:
+            await local_cache.aset(token, data, min(timeout, settings.URL_SHORTENER_LOCAL_CACHE_TTL))
+
+    async def alog_the_url_usages(self, url_pk):
+        with metrics.usage_log_seconds.time():
+            await usage_buffer.aadd(url_pk, now().strftime(USAGE_DATETIME_FORMAT))
+
+    async def aget_object(self, token):
+        with metrics.redirect_lookup_seconds.time():
+            return await self.get_object_queryset(token).afirst()
+
+
+class ResolveTokensAPIView(RedirectMixin, APIView):
+    """
+    Targets and expiration dates of many tokens at once, e.g. for link previews. The usages are not logged.
+
+    The cached tokens are read with a single get_many, the others with a single query with the filters of
+    `get_object`, and their entries (or misses) are cached for the next requests.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        serializer = ResolveTokensSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        tokens = list(dict.fromkeys(serializer.validated_data["tokens"]))
+        entries = self.get_redirect_entries([token for token in tokens if len(token) == MAXIMUM_TOKEN_LENGTH])
+        results = {token: self.get_resolved_target(entries.get(token, NOT_FOUND)) for token in tokens}
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    def get_redirect_entries(self, tokens):
+        entries = redirect_cache.get_many(tokens) if settings.URL_SHORTENER_USE_CACHE else {}
+        if missing_tokens := [token for token in tokens if token not in entries]:
+            loaded_entries = self.load_redirect_entries(missing_tokens)
+            entries.update({token: entry for token, (entry, timeout) in loaded_entries.items()})
+            if settings.URL_SHORTENER_USE_CACHE:
+                cache_redirect_entries(loaded_entries)
+                missing_entries = {token: NOT_FOUND for token in missing_tokens if token not in loaded_entries}
+                if missing_entries and settings.URL_SHORTENER_NEGATIVE_CACHE_TTL:
+                    redirect_cache.set_many(missing_entries, settings.URL_SHORTENER_NEGATIVE_CACHE_TTL)
+        return entries
+
+    def load_redirect_entries(self, tokens):
+        """
+        `(entry, timeout)` of the tokens of `tokens` that have an active url.
+        """
+        entries = {}
+        for url_obj in self.get_lookup_queryset(token__in=tokens).only("token", "url", "expiration_date"):
+            # Ordered by expiration date like `get_object`, the first url of a token wins
+            if url_obj.token not in entries:
+                timeout = int((url_obj.expiration_date - now()).total_seconds())
+                entries[url_obj.token] = (build_redirect_entry(url_obj.url, url_obj.pk, timeout), timeout)
+        return entries
+
+    def get_resolved_target(self, entry):
+        if entry == NOT_FOUND:
+            return None
+        return ResolvedTokenSerializer({
+            "url": entry["redirect_url"],
+            "expiration_date": datetime.fromtimestamp(int(entry["expires_at"]), timezone.utc),
+        }).data
+
+
+class BulkCreateURLAPIView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = BulkCreateURLSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results = []
+        for result in URL.objects.bulk_create_urls(serializer.validated_data["urls"]):
+            if isinstance(result, ValidationError):
+                results.append({"errors": result.message_dict})
+            else:
+                results.append(URLSerializer(result).data)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class MetricsView(View):
+    def get(self, request):
+        if not settings.URL_SHORTENER_USE_METRICS:
+            raise Http404
+        return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
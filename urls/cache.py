@@ -0,0 +1,425 @@
+import asyncio
+import struct
+import threading
+from collections import OrderedDict, defaultdict
+from math import log
+from random import random
+from time import monotonic, sleep, time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.timezone import now
+
+LOCAL_CACHE_MAX_SIZE = settings.URL_SHORTENER_LOCAL_CACHE_MAX_SIZE
+LOCAL_CACHE_GENERATION_CHECK_INTERVAL = settings.URL_SHORTENER_LOCAL_CACHE_GENERATION_CHECK_INTERVAL
+GENERATION_KEY = "url_shortener:local_cache_generation"
+# Cached for the tokens that do not have an active url
+NOT_FOUND = "not_found"
+FILL_LOCK_KEY_PREFIX = "url_shortener:fill_lock:"
+FILL_LOCK_POLL_INTERVAL = 0.02  # seconds
+# Format byte of the packed entries, followed by the url pk and the expiry (and the refresh time and the compute
+# time of the entry with URL_SHORTENER_CACHE_REFRESH_INTERVAL), the rest of the bytes is the utf-8 redirect url
+ENTRY_FORMAT = 1
+ENTRY_FORMAT_WITH_REFRESH = 2
+ENTRY_HEADER = struct.Struct("<BQI")
+ENTRY_REFRESH_HEADER = struct.Struct("<If")
+PACKED_NOT_FOUND = b"\x00"
+
+
+def pack_redirect_entry(entry):
+    """
+    Pack an entry of `build_redirect_entry` (or NOT_FOUND) into bytes, the times are rounded down to seconds.
+    """
+    if entry == NOT_FOUND:
+        return PACKED_NOT_FOUND
+    redirect_url = entry["redirect_url"].encode()
+    if "refresh_at" not in entry:
+        return ENTRY_HEADER.pack(ENTRY_FORMAT, entry["url_pk"], int(entry["expires_at"])) + redirect_url
+    return b"".join([
+        ENTRY_HEADER.pack(ENTRY_FORMAT_WITH_REFRESH, entry["url_pk"], int(entry["expires_at"])),
+        ENTRY_REFRESH_HEADER.pack(int(entry["refresh_at"]), entry["compute_seconds"]),
+        redirect_url,
+    ])
+
+
+def unpack_redirect_entry(data):
+    """
+    Inverse of `pack_redirect_entry`, values of an unknown format are read as a miss.
+    """
+    if data == PACKED_NOT_FOUND:
+        return NOT_FOUND
+    if not isinstance(data, bytes) or len(data) < ENTRY_HEADER.size:
+        return None
+    entry_format, url_pk, expires_at = ENTRY_HEADER.unpack_from(data)
+    entry = {"url_pk": url_pk, "expires_at": expires_at}
+    offset = ENTRY_HEADER.size
+    if entry_format == ENTRY_FORMAT_WITH_REFRESH:
+        entry["refresh_at"], entry["compute_seconds"] = ENTRY_REFRESH_HEADER.unpack_from(data, offset)
+        offset += ENTRY_REFRESH_HEADER.size
+    elif entry_format != ENTRY_FORMAT:
+        return None
+    entry["redirect_url"] = data[offset:].decode()
+    return entry
+
+
+class RedirectCache:
+    """
+    Redirect entries of the tokens, packed by `pack_redirect_entry` into the cache of URL_SHORTENER_CACHE_ALIAS.
+
+    The keys are the tokens prefixed with URL_SHORTENER_CACHE_KEY_PREFIX and versioned with
+    URL_SHORTENER_CACHE_KEY_VERSION, so they do not collide with the other keys of a shared cache and bumping
+    the version drops every entry at once.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.URL_SHORTENER_CACHE_ALIAS]
+
+    @property
+    def version(self):
+        return settings.URL_SHORTENER_CACHE_KEY_VERSION
+
+    def make_key(self, token):
+        return settings.URL_SHORTENER_CACHE_KEY_PREFIX + token
+
+    def get(self, token):
+        return unpack_redirect_entry(self.cache.get(self.make_key(token), version=self.version))
+
+    async def aget(self, token):
+        return unpack_redirect_entry(await self.cache.aget(self.make_key(token), version=self.version))
+
+    def get_many(self, tokens):
+        """
+        Entries of the cached `tokens` by token, the missing tokens are left out.
+        """
+        tokens_by_key = {self.make_key(token): token for token in tokens}
+        entries = {}
+        for key, data in self.cache.get_many(tokens_by_key, version=self.version).items():
+            if (entry := unpack_redirect_entry(data)) is not None:
+                entries[tokens_by_key[key]] = entry
+        return entries
+
+    def set(self, token, entry, timeout):
+        self.cache.set(self.make_key(token), pack_redirect_entry(entry), timeout, version=self.version)
+
+    async def aset(self, token, entry, timeout):
+        await self.cache.aset(self.make_key(token), pack_redirect_entry(entry), timeout, version=self.version)
+
+    def set_many(self, entries, timeout):
+        self.cache.set_many(
+            {self.make_key(token): pack_redirect_entry(entry) for token, entry in entries.items()},
+            timeout,
+            version=self.version,
+        )
+
+    def delete(self, token):
+        self.cache.delete(self.make_key(token), version=self.version)
+
+    def delete_many(self, tokens):
+        self.cache.delete_many([self.make_key(token) for token in tokens], version=self.version)
+
+
+class LocalCache:
+    """
+    Bounded in-process LRU cache, every entry expires after its own timeout.
+
+    All the local caches are cleared when the generation stored in the shared cache changes,
+    which is checked at most once per `generation_check_interval` seconds.
+    """
+
+    def __init__(self, max_size=LOCAL_CACHE_MAX_SIZE, generation_check_interval=LOCAL_CACHE_GENERATION_CHECK_INTERVAL):
+        self.max_size = max_size
+        self.generation_check_interval = generation_check_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_checked_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        self._check_generation()
+        return self._get(key)
+
+    async def aget(self, key):
+        await self._acheck_generation()
+        return self._get(key)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, timeout):
+        if timeout <= 0:
+            return
+        self._check_generation()
+        self._set(key, value, timeout)
+
+    async def aset(self, key, value, timeout):
+        if timeout <= 0:
+            return
+        await self._acheck_generation()
+        self._set(key, value, timeout)
+
+    def _set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (value, monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def _is_generation_check_due(self):
+        return (
+            self._generation_checked_at is None
+            or monotonic() - self._generation_checked_at >= self.generation_check_interval
+        )
+
+    def _check_generation(self):
+        if self._is_generation_check_due():
+            self._set_generation(redirect_cache.cache.get(GENERATION_KEY, 0))
+
+    async def _acheck_generation(self):
+        if self._is_generation_check_due():
+            self._set_generation(await redirect_cache.cache.aget(GENERATION_KEY, 0))
+
+    def _set_generation(self, generation):
+        self._generation_checked_at = monotonic()
+        if generation != self._generation:
+            with self._lock:
+                self._entries.clear()
+            self._generation = generation
+
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time in this process.
+
+    Concurrent callers of a key that is already running wait for that call and share its result.
+    """
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def is_running(self, key):
+        return key in self._calls
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = self.Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """
+    Same as `SingleFlight` for the coroutines of the event loop of this process.
+    """
+
+    def __init__(self):
+        self._futures = {}
+
+    def is_running(self, key):
+        return key in self._futures
+
+    async def do(self, key, func, *args):
+        if (future := self._futures.get(key)) is not None:
+            # A cancelled waiter must not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = self._futures[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func(*args)
+        except Exception as error:
+            future.set_exception(error)
+            # The waiters get the exception, without waiters it must not be reported as never retrieved
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._futures[key]
+            if not future.done():
+                # The call was cancelled
+                future.cancel()
+        return result
+
+
+def acquire_fill_lock(token):
+    """
+    Let only one process fill the entry of `token`, the lock expires if its holder dies.
+    """
+    return redirect_cache.cache.add(FILL_LOCK_KEY_PREFIX + token, 1, settings.URL_SHORTENER_CACHE_LOCK_TIMEOUT)
+
+
+def release_fill_lock(token):
+    redirect_cache.cache.delete(FILL_LOCK_KEY_PREFIX + token)
+
+
+def wait_for_entry(token):
+    """
+    Poll the cache until the lock holder stores the entry of `token`, return None after the lock wait.
+    """
+    deadline = monotonic() + settings.URL_SHORTENER_CACHE_LOCK_WAIT
+    while monotonic() < deadline:
+        sleep(FILL_LOCK_POLL_INTERVAL)
+        if (entry := redirect_cache.get(token)) is not None:
+            return entry
+    return None
+
+
+async def aacquire_fill_lock(token):
+    return await redirect_cache.cache.aadd(FILL_LOCK_KEY_PREFIX + token, 1, settings.URL_SHORTENER_CACHE_LOCK_TIMEOUT)
+
+
+async def arelease_fill_lock(token):
+    await redirect_cache.cache.adelete(FILL_LOCK_KEY_PREFIX + token)
+
+
+async def await_entry(token):
+    """
+    Same as `wait_for_entry` without blocking the event loop.
+    """
+    deadline = monotonic() + settings.URL_SHORTENER_CACHE_LOCK_WAIT
+    while monotonic() < deadline:
+        await asyncio.sleep(FILL_LOCK_POLL_INTERVAL)
+        if (entry := await redirect_cache.aget(token)) is not None:
+            return entry
+    return None
+
+
+def bump_local_cache_generation():
+    """
+    Make every process drop its local cache on its next generation check.
+    """
+    redirect_cache.cache.add(GENERATION_KEY, 0, timeout=None)
+    try:
+        redirect_cache.cache.incr(GENERATION_KEY)
+    except ValueError:
+        # Evicted since the add, any other value is a new generation for the processes
+        redirect_cache.cache.add(GENERATION_KEY, 1, timeout=None)
+
+
+def delete_redirect_entries(tokens):
+    redirect_cache.delete_many(tokens)
+
+
+def cache_redirect_entries(entries):
+    """
+    Cache the `(entry, timeout)` of every token of `entries`.
+
+    set_many takes one timeout, so every timeout is rounded down to a power of two to share it:
+    the entries never outlive their url and a few set_many calls cover all of them.
+    """
+    entries_by_timeout = defaultdict(dict)
+    for token, (entry, timeout) in entries.items():
+        if timeout > 0:
+            entries_by_timeout[1 << (timeout.bit_length() - 1)][token] = entry
+    for timeout, timeout_entries in entries_by_timeout.items():
+        redirect_cache.set_many(timeout_entries, timeout)
+    return sum(len(timeout_entries) for timeout_entries in entries_by_timeout.values())
+
+
+def uses_write_through_cache():
+    return settings.URL_SHORTENER_USE_CACHE and settings.URL_SHORTENER_USE_CACHE_WRITE_THROUGH
+
+
+def write_redirect_entries(urls):
+    """
+    Cache the entries of the active urls of `urls`, tuples of token, redirect url, url pk and expiration date,
+    until their expiration date. Return how many are cached.
+    """
+    entries = {}
+    for token, redirect_url, url_pk, expiration_date in urls:
+        timeout = int((expiration_date - now()).total_seconds())
+        entries[token] = (build_redirect_entry(redirect_url, url_pk, timeout), timeout)
+    if len(entries) == 1:
+        # A single entry keeps its exact timeout
+        [(token, (entry, timeout))] = entries.items()
+        if timeout <= 0:
+            return 0
+        redirect_cache.set(token, entry, timeout)
+        return 1
+    return cache_redirect_entries(entries)
+
+
+def build_redirect_entry(redirect_url, url_pk, timeout, compute_seconds=0):
+    entry = {
+        "redirect_url": redirect_url,
+        "url_pk": url_pk,
+        "expires_at": time() + timeout,
+    }
+    if settings.URL_SHORTENER_CACHE_REFRESH_INTERVAL:
+        entry["refresh_at"] = time() + min(timeout, settings.URL_SHORTENER_CACHE_REFRESH_INTERVAL)
+        entry["compute_seconds"] = compute_seconds
+    return entry
+
+
+def get_remaining_seconds(entry):
+    return entry["expires_at"] - time()
+
+
+def should_refresh_early(entry):
+    """
+    Probabilistic early refresh, the closer the entry is to its `refresh_at` and the slower it was to compute,
+    the more likely a request refreshes it. Requests rarely refresh the same entry at the same time.
+    """
+    if entry == NOT_FOUND or "refresh_at" not in entry:
+        return False
+    # 1 - random() is in (0, 1], so the logarithm is defined
+    early_seconds = -entry["compute_seconds"] * settings.URL_SHORTENER_CACHE_EARLY_REFRESH_BETA * log(1 - random())
+    return time() + early_seconds >= entry["refresh_at"]
+
+
+redirect_cache = RedirectCache()
+
+
+single_flight = SingleFlight()
+async_single_flight = AsyncSingleFlight()
+
+
+local_cache = LocalCache()
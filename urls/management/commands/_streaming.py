@@ -0,0 +1,37 @@
+from time import perf_counter
+
+from urls.models import URL, UrlUsage
+
+MODELS = {
+    "url": (URL, ("id", "name", "url", "token", "expiration_date", "description", "created_at", "updated_at")),
+    "usage": (UrlUsage, ("id", "url_id", "created_at", "is_counted")),
+}
+FORMATS = ("csv", "jsonl")
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def add_streaming_arguments(parser):
+    parser.add_argument("path", help="File path, use '-' for stdin/stdout.")
+    parser.add_argument("--model", choices=MODELS, default="url")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+
+
+class ProgressReporter:
+    def __init__(self, stream, verb):
+        self.stream = stream
+        self.verb = verb
+        self.count = 0
+        self.started_at = perf_counter()
+
+    @property
+    def rows_per_second(self):
+        return self.count / max(perf_counter() - self.started_at, 1e-9)
+
+    def update(self, count):
+        self.count += count
+        self.stream.write(f"{self.verb} {self.count} rows ({self.rows_per_second:.0f} rows/s)")
+
+    def finish(self):
+        elapsed = perf_counter() - self.started_at
+        self.stream.write(f"{self.verb} {self.count} rows in {elapsed:.2f}s ({self.rows_per_second:.0f} rows/s)")
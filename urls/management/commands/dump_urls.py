@@ -0,0 +1,42 @@
+import csv
+import json
+import sys
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand
+
+from urls.management.commands._streaming import MODELS, ProgressReporter, add_streaming_arguments
+
+
+class Command(BaseCommand):
+    help = "Stream URL or UrlUsage rows to a CSV or JSON Lines file with constant memory."
+
+    def add_arguments(self, parser):
+        add_streaming_arguments(parser)
+
+    def handle(self, *args, path, model, format, chunk_size, **options):
+        model_class, fields = MODELS[model]
+        rows = model_class.objects.order_by("pk").values_list(*fields).iterator(chunk_size=chunk_size)
+        progress = ProgressReporter(self.stderr, "Exported")
+
+        with (nullcontext(sys.stdout) if path == "-" else open(path, "w", newline="")) as file:
+            if format == "csv":
+                writer = csv.writer(file)
+                writer.writerow(fields)
+                write_row = writer.writerow
+            else:
+                def write_row(row):
+                    # str() keeps the microseconds of the datetimes, same as the csv format
+                    file.write(json.dumps(dict(zip(fields, row)), default=str) + "\n")
+
+            pending = 0
+            for row in rows:
+                write_row(row)
+                pending += 1
+                if pending == chunk_size:
+                    progress.update(pending)
+                    pending = 0
+            if pending:
+                progress.update(pending)
+
+        progress.finish()
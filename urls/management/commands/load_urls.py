@@ -0,0 +1,51 @@
+import csv
+import json
+import sys
+from contextlib import nullcontext
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from urls.management.commands._streaming import MODELS, ProgressReporter, add_streaming_arguments
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream URL or UrlUsage rows from a CSV or JSON Lines file (as written by dump_urls) "
+        "and insert them with chunked bulk_create."
+    )
+
+    def add_arguments(self, parser):
+        add_streaming_arguments(parser)
+        parser.add_argument("--ignore-conflicts", action="store_true", help="Skip the rows that already exist.")
+
+    def handle(self, *args, path, model, format, chunk_size, ignore_conflicts, **options):
+        model_class, fields = MODELS[model]
+        progress = ProgressReporter(self.stderr, "Imported")
+
+        with (nullcontext(sys.stdin) if path == "-" else open(path, newline="")) as file:
+            rows = csv.DictReader(file) if format == "csv" else (json.loads(line) for line in file if line.strip())
+            objs = (self.build_obj(model_class, fields, row) for row in rows)
+            while chunk := list(islice(objs, chunk_size)):
+                with transaction.atomic():
+                    model_class.objects.bulk_create(chunk, ignore_conflicts=ignore_conflicts)
+                progress.update(len(chunk))
+
+        # Rows are imported with their ids, so the sequence has to continue after them
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [model_class]):
+                cursor.execute(sql)
+        progress.finish()
+
+    @staticmethod
+    def build_obj(model_class, fields, row):
+        values = {}
+        for name in fields:
+            field = model_class._meta.get_field(name.removesuffix("_id"))
+            value = row.get(name)
+            if value == "" and field.null:
+                value = None
+            values[field.attname] = field.to_python(value) if value is not None else None
+        return model_class(**values)
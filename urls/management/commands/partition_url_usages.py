@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from urls.partitions import create_usage_partitions, partition_usage_table, uses_native_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Turn the url usage table of PostgreSQL into a table partitioned by month. "
+        "The usage table is locked until the existing rows are checked."
+    )
+
+    def handle(self, *args, **options):
+        if not uses_native_partitions():
+            self.stdout.write("Native partitions need PostgreSQL, the usage table is rotated monthly instead.")
+            return
+
+        if partition_usage_table():
+            self.stdout.write("The usage table is partitioned.")
+        else:
+            self.stdout.write("The usage table is already partitioned.")
+        for partition_name in create_usage_partitions():
+            self.stdout.write(f"Created {partition_name}.")
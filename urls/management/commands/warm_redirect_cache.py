@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from urls.tasks import warm_redirect_cache
+
+
+class Command(BaseCommand):
+    help = "Cache the redirect entries of the most used active URLs, e.g. before switching traffic to a new deploy."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=settings.URL_SHORTENER_CACHE_WARM_UP_LIMIT)
+        parser.add_argument("--async", action="store_true", dest="run_async", help="Run the warm up in a Celery worker.")
+
+    def handle(self, *args, limit, run_async, **options):
+        if run_async:
+            warm_redirect_cache.delay(limit)
+            self.stdout.write("Warm up task is sent.")
+            return
+
+        cached_count = warm_redirect_cache(limit)
+        self.stdout.write(f"Cached {cached_count} tokens.")
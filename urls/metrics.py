@@ -0,0 +1,357 @@
+"""
+In-process counters and histograms of the redirect path, rendered in the Prometheus text format.
+
+Every process keeps its own values. When URL_SHORTENER_METRICS_MULTIPROCESS_DIR is set, every process also writes them
+to a file of its own in that directory (at most every URL_SHORTENER_METRICS_WRITE_INTERVAL seconds and on exit),
+and the metrics endpoint of any process adds up the files of all the processes, e.g. of the gunicorn workers.
+
+The files are named after the pid of their process. The file of a process that exited, or that is found dead by
+a collecting process, is added to a single file of the exited processes and removed, so the directory does not
+grow with the worker restarts and the summed counters do not go backwards. A process whose pid was used before
+adds the file left with that pid to the exited processes before writing its own, instead of overwriting it.
+The dead processes are detected with `os.kill(pid, 0)`, the directory must only be shared by the processes
+of one host.
+"""
+import atexit
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from glob import glob
+from math import inf
+from time import monotonic, perf_counter, time
+
+from django.conf import settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SNAPSHOT_FILE_PREFIX = "metrics_"
+SNAPSHOT_FILE_PATTERN = re.compile(rf"^{SNAPSHOT_FILE_PREFIX}(\d+)\.json$")
+EXITED_SNAPSHOT_FILE = "exited_metrics.json"
+EXITED_SNAPSHOT_LOCK_FILE = "exited_metrics.lock"
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, but owned by another user
+        return True
+    return True
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as snapshot_file:
+            return json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot_file(path, snapshot):
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    # The readers never see a partially written file
+    os.replace(temporary_path, path)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._written_at = None
+        self._written_by = None
+        self._write_lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+    def get_snapshot_path(self, pid=None):
+        return os.path.join(
+            settings.URL_SHORTENER_METRICS_MULTIPROCESS_DIR, f"{SNAPSHOT_FILE_PREFIX}{pid or os.getpid()}.json"
+        )
+
+    def get_exited_snapshot_path(self):
+        return os.path.join(settings.URL_SHORTENER_METRICS_MULTIPROCESS_DIR, EXITED_SNAPSHOT_FILE)
+
+    def write_snapshot(self):
+        if not settings.URL_SHORTENER_METRICS_MULTIPROCESS_DIR:
+            return
+        with self._write_lock:
+            self._written_at = monotonic()
+            path = self.get_snapshot_path()
+            if self._written_by != os.getpid():
+                # A file with the pid of this process was left by an exited process
+                self._written_by = os.getpid()
+                if os.path.exists(path):
+                    self.add_exited_snapshots([path])
+            write_snapshot_file(path, self.snapshot())
+
+    def write_exit_snapshot(self):
+        """
+        Add the values of this process to the exited processes and remove its file.
+        """
+        if not settings.URL_SHORTENER_METRICS_MULTIPROCESS_DIR:
+            return
+        self.write_snapshot()
+        self.add_exited_snapshots([self.get_snapshot_path()])
+
+    def add_exited_snapshots(self, paths):
+        """
+        Add up the files of exited processes into the file of the exited processes and remove them.
+        """
+        import fcntl
+
+        lock_path = os.path.join(settings.URL_SHORTENER_METRICS_MULTIPROCESS_DIR, EXITED_SNAPSHOT_LOCK_FILE)
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another process may have added them already
+                existing_paths = [path for path in paths if os.path.exists(path)]
+                if not existing_paths:
+                    return
+                snapshots = [read_snapshot(self.get_exited_snapshot_path()) or {}]
+                snapshots.extend(snapshot for path in existing_paths if (snapshot := read_snapshot(path)))
+                values = self.merge_snapshots(snapshots)
+                write_snapshot_file(self.get_exited_snapshot_path(), {
+                    name: [[list(labels), value] for labels, value in metric_values.items()]
+                    for name, metric_values in values.items()
+                })
+                for path in existing_paths:
+                    os.remove(path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def write_snapshot_if_due(self):
+        if not settings.URL_SHORTENER_METRICS_MULTIPROCESS_DIR:
+            return
+        if self._written_at is None or monotonic() - self._written_at >= settings.URL_SHORTENER_METRICS_WRITE_INTERVAL:
+            self.write_snapshot()
+
+    def collect(self):
+        """
+        Values of this process, added up with the last written values of the other processes
+        and with the values of the exited processes.
+        """
+        snapshots = [self.snapshot()]
+        if settings.URL_SHORTENER_METRICS_MULTIPROCESS_DIR:
+            own_path = self.get_snapshot_path()
+            exited_paths = []
+            for path in glob(self.get_snapshot_path("*")):
+                match = SNAPSHOT_FILE_PATTERN.match(os.path.basename(path))
+                if path == own_path or not match:
+                    continue
+                if not is_process_alive(int(match.group(1))):
+                    exited_paths.append(path)
+                elif snapshot := read_snapshot(path):
+                    snapshots.append(snapshot)
+            if exited_paths:
+                self.add_exited_snapshots(exited_paths)
+            if snapshot := read_snapshot(self.get_exited_snapshot_path()):
+                snapshots.append(snapshot)
+        return self.merge_snapshots(snapshots)
+
+    def merge_snapshots(self, snapshots):
+        values = {}
+        for snapshot in snapshots:
+            for name, metric_values in snapshot.items():
+                if name not in self.metrics:
+                    continue
+                merged_values = values.setdefault(name, {})
+                for labels, value in metric_values:
+                    labels = tuple(labels)
+                    merged_values[labels] = self.metrics[name].merge(merged_values.get(labels), value)
+        return values
+
+    def render(self):
+        lines = []
+        values = self.collect()
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for labels, value in sorted(values.get(name, {}).items()):
+                lines.extend(metric.render(dict(zip(metric.labelnames, labels)), value))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels.items()) + "}"
+
+
+def format_value(value):
+    if value == inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def get_key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def get(self, **labels):
+        return self._values.get(self.get_key(labels))
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), self.copy_value(value)] for labels, value in self._values.items()]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def copy_value(self, value):
+        return value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not settings.URL_SHORTENER_USE_METRICS:
+            return
+        key = self.get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        registry.write_snapshot_if_due()
+
+    def merge(self, value, other_value):
+        return (value or 0) + other_value
+
+    def render(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {format_value(value)}"]
+
+
+class Gauge(Metric):
+    """
+    Last value set by any process, e.g. of a shared resource. The values of the processes are not added up,
+    the most recently set one wins.
+    """
+    type = "gauge"
+
+    def set(self, value, **labels):
+        if not settings.URL_SHORTENER_USE_METRICS:
+            return
+        key = self.get_key(labels)
+        with self._lock:
+            self._values[key] = [value, time()]
+        registry.write_snapshot_if_due()
+
+    def get(self, **labels):
+        value = super().get(**labels)
+        return None if value is None else value[0]
+
+    def copy_value(self, value):
+        return list(value)
+
+    def merge(self, value, other_value):
+        if value is None or other_value[1] > value[1]:
+            return list(other_value)
+        return value
+
+    def render(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {format_value(value[0])}"]
+
+
+class Histogram(Metric):
+    """
+    Number of observations per bucket (not cumulative), followed by their sum and their count.
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (inf,)
+
+    def observe(self, value, **labels):
+        if not settings.URL_SHORTENER_USE_METRICS:
+            return
+        key = self.get_key(labels)
+        bucket_index = next(index for index, upper_bound in enumerate(self.buckets) if value <= upper_bound)
+        with self._lock:
+            bucket_counts = self._values.setdefault(key, [0] * len(self.buckets) + [0, 0])
+            bucket_counts[bucket_index] += 1
+            bucket_counts[-2] += value
+            bucket_counts[-1] += 1
+        registry.write_snapshot_if_due()
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a block or of every call of a function.
+        """
+        started_at = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started_at, **labels)
+
+    def copy_value(self, value):
+        return list(value)
+
+    def merge(self, value, other_value):
+        if value is None:
+            return list(other_value)
+        return [count + other_count for count, other_count in zip(value, other_value)]
+
+    def render(self, labels, value):
+        lines = []
+        cumulative_count = 0
+        for upper_bound, count in zip(self.buckets, value):
+            cumulative_count += count
+            bucket_labels = format_labels({**labels, "le": format_value(upper_bound)})
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative_count}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(value[-2])}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {value[-1]}")
+        return lines
+
+
+redirect_requests = Counter(
+    "url_shortener_redirect_requests_total", "Redirects by their result, found or not_found.", ["result"],
+)
+redirect_cache_lookups = Counter(
+    "url_shortener_redirect_cache_lookups_total", "Redirect cache lookups by their result, local_hit, hit or miss.", ["result"],
+)
+redirect_seconds = Histogram("url_shortener_redirect_seconds", "Time to serve a redirect.")
+redirect_lookup_seconds = Histogram("url_shortener_redirect_lookup_seconds", "Time of the database lookup of a redirect.")
+usage_log_seconds = Histogram("url_shortener_usage_log_seconds", "Time to hand a usage to the usage logger.")
+task_seconds = Histogram(
+    "url_shortener_task_seconds", "Run time of the token pool tasks.", ["task"], buckets=(0.01, 0.1, 1, 10, 60, 600),
+)
+pool_tokens_created = Counter("url_shortener_pool_tokens_created_total", "Ready-to-set tokens created by the pool tasks.")
+pool_tokens_claimed = Counter("url_shortener_pool_tokens_claimed_total", "Ready-to-set tokens claimed by new urls.")
+pool_fallbacks = Counter(
+    "url_shortener_pool_fallbacks_total", "Urls that got a new token because the ready-to-set token pool was empty.",
+)
+pool_depth = Gauge("url_shortener_pool_depth", "Ready-to-set tokens left in the pool.")
+
+
+atexit.register(registry.write_exit_snapshot)
@@ -0,0 +1,54 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.urls import Resolver404, resolve
+
+from urls.api.views import AsyncRedirectView, RedirectView
+
+REDIRECT_VIEW_NAME = "urls:redirect"
+REDIRECT_METHODS = ("GET", "HEAD")
+
+
+class RedirectFastPathMiddleware:
+    """
+    Serve the redirects before the rest of the middleware stack and without DRF,
+    they need no session, CSRF check, user or content negotiation.
+
+    Every other request goes through the stack as usual.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.URL_SHORTENER_USE_REDIRECT_FAST_PATH:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.redirect_view = AsyncRedirectView.as_view()
+        else:
+            self.redirect_view = RedirectView.as_view()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if token := self.get_redirect_token(request):
+            return self.redirect_view(request, token=token)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if token := self.get_redirect_token(request):
+            return await self.redirect_view(request, token=token)
+        return await self.get_response(request)
+
+    def get_redirect_token(self, request):
+        if request.method not in REDIRECT_METHODS:
+            return None
+        try:
+            resolver_match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if resolver_match.view_name != REDIRECT_VIEW_NAME:
+            return None
+        return resolver_match.kwargs["token"]
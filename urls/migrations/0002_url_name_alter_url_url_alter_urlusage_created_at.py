@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:53
+
+import django.core.validators
+import django.utils.timezone
+import utils.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urls', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='url',
+            name='name',
+            field=models.CharField(blank=True, max_length=31, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='url',
+            name='url',
+            field=models.URLField(max_length=255, validators=[django.core.validators.URLValidator(message='The URL should start with https://', schemes=['https'])]),
+        ),
+        migrations.AlterField(
+            model_name='urlusage',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, validators=[utils.validators.validate_not_naive]),
+        ),
+    ]
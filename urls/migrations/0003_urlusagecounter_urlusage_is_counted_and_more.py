@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:54
+
+import django.db.models.deletion
+import utils.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urls', '0002_url_name_alter_url_url_alter_urlusage_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UrlUsageCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(validators=[utils.validators.validate_not_naive])),
+                ('count', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='urlusage',
+            name='is_counted',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='urlusage',
+            index=models.Index(fields=['created_at'], name='url_usage_created_at'),
+        ),
+        migrations.AddIndex(
+            model_name='urlusage',
+            index=models.Index(condition=models.Q(('is_counted', False)), fields=['id'], name='uncounted_url_usages'),
+        ),
+        migrations.AddField(
+            model_name='urlusagecounter',
+            name='url',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_counters', to='urls.url'),
+        ),
+        migrations.AddConstraint(
+            model_name='urlusagecounter',
+            constraint=models.UniqueConstraint(fields=('url', 'bucket'), name='unique_url_usage_counter_bucket'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:16
+
+import utils.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('urls', '0003_urlusagecounter_urlusage_is_counted_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedURL',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(db_index=True)),
+                ('name', models.CharField(blank=True, max_length=31, null=True)),
+                ('url', models.URLField(max_length=255)),
+                ('token', models.CharField(max_length=5)),
+                ('expiration_date', models.DateTimeField()),
+                ('description', models.TextField(blank=True, null=True)),
+                ('clicks', models.PositiveBigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(validators=[utils.validators.validate_not_naive])),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='url',
+            index=models.Index(fields=['expiration_date'], name='url_expiration_date'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:17
+
+from django.db import migrations, models
+
+
+class AddIndexConcurrentlyOnPostgres(migrations.AddIndex):
+    """
+    Build the index with AddIndexConcurrently on PostgreSQL, so the url table is not locked while it is built.
+    The other databases have no concurrent build and the postgres operations need psycopg, it is imported lazily.
+    """
+
+    atomic = False
+
+    def get_operation(self, schema_editor):
+        if schema_editor.connection.vendor != "postgresql":
+            return migrations.AddIndex(self.model_name, self.index)
+        from django.contrib.postgres.operations import AddIndexConcurrently
+        return AddIndexConcurrently(self.model_name, self.index)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        self.get_operation(schema_editor).database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        self.get_operation(schema_editor).database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can not run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('urls', '0004_archivedurl_url_url_expiration_date'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='url',
+            index=models.Index(condition=models.Q(('url', 'https://shayestehhs.com'), _negated=True), fields=['token', '-expiration_date'], include=('id', 'url'), name='active_token_lookup'),
+        ),
+    ]
@@ -5,11 +5,14 @@ from django.conf import settings
 from django.contrib.postgres.indexes import HashIndex
 from django.core.validators import URLValidator
 from django.db import models
-from django.utils.timezone import now
+from django.utils.timezone import localtime, now
 from rest_framework.exceptions import ValidationError
 from string import ascii_letters, digits
-from urls.querysets import URLManager
+from urls.querysets import URLManager, UrlUsageCounterQuerySet, UrlUsageQuerySet
+from urls.token_counter import counter_token_generator, uses_counter_tokens
+from urls.token_filter import active_token_filter
 from utils.models import TimeStampModel
+from utils.validators import validate_not_naive
 
 BASE_URL = settings.URL_SHORTENER_BASE_URL
 MAXIMUM_URL_LENGTH = settings.URL_SHORTENER_MAXIMUM_URL_LENGTH
@@ -17,6 +20,7 @@ MAXIMUM_TOKEN_LENGTH = settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH
 MAXIMUM_RECURSION_DEPTH = settings.URL_SHORTENER_MAXIMUM_RECURSION_DEPTH
 READY_TO_SET_TOKEN_URL = settings.URL_SHORTENER_READY_TO_SET_TOKEN_URL
 DEFAULT_EXPIRATION_DAYS = settings.URL_SHORTENER_DEFAULT_EXPIRATION_DAYS
+TOKEN_BATCH_SIZE = settings.URL_SHORTENER_TOKEN_BATCH_SIZE
 User = settings.AUTH_USER_MODEL
 AVAILABLE_CHARS = ascii_letters + digits
 
@@ -37,6 +41,10 @@ class URL(TimeStampModel):
     expiration_date = models.DateTimeField(default=get_default_expiration_date)
     description = models.TextField(null=True, blank=True)
     objects = URLManager()
+    # Set by the pool claims while the post_save signal of the claim runs, the row was a ready-to-set row that no cache holds
+    claimed_from_pool = False
+    # Set by the expired url reaper, which evicts the cached entries of a whole batch once it commits
+    reaped = False
 
     @property
     def short_url(self):
@@ -51,22 +59,63 @@ class URL(TimeStampModel):
             return False
         return True
 
+    def get_clicks(self, since=None):
+        counters = self.usage_counters.all()
+        if since:
+            counters = counters.filter(bucket__gte=UrlUsageCounter.get_bucket(since))
+        return counters.total()
+
     @classmethod
     def _create_random_string(cls):
         return "".join([choice(AVAILABLE_CHARS) for _ in range(MAXIMUM_TOKEN_LENGTH)])
 
     @classmethod
     def create_token(cls):
+        if uses_counter_tokens():
+            return counter_token_generator.create_tokens(1)[0]
+
         token: str
         for _ in range(MAXIMUM_RECURSION_DEPTH):
             token = cls._create_random_string()
+            if settings.URL_SHORTENER_USE_TOKEN_FILTER and token in active_token_filter:
+                # Most likely active, skip the query
+                continue
             if not URL.objects.all_actives().filter(token=token).exists():
                 return token
         raise Exception("Maximum recursion depth occurred.")
 
+    @classmethod
+    def create_tokens(cls, count, exclude=()):
+        """
+        Create `count` distinct tokens with one collision check query per `TOKEN_BATCH_SIZE` candidates.
+        Tokens in `exclude` are never returned.
+        """
+        if uses_counter_tokens():
+            return counter_token_generator.create_tokens(count, exclude=exclude)
+
+        tokens = set()
+        failed_rounds = 0
+        while len(tokens) < count:
+            candidates = {
+                cls._create_random_string() for _ in range(min(count - len(tokens), TOKEN_BATCH_SIZE))
+            } - tokens - set(exclude)
+            if settings.URL_SHORTENER_USE_TOKEN_FILTER:
+                candidates = {candidate for candidate in candidates if candidate not in active_token_filter}
+            if candidates:
+                candidates -= set(
+                    URL.objects.all_actives().filter(token__in=candidates).values_list("token", flat=True)
+                )
+            if not candidates:
+                failed_rounds += 1
+                if failed_rounds >= MAXIMUM_RECURSION_DEPTH:
+                    raise Exception("Maximum recursion depth occurred.")
+                continue
+            tokens |= candidates
+        return list(tokens)
+
     @classmethod
     def validate_token_is_unique(cls, token):
-        if Url.objects.all_actives().filter(token=token).exists():
+        if URL.objects.all_actives().filter(token=token).exists():
             raise ValidationError("Valid url object with this token already exists.")
 
     def save(self, *args, **kwargs):
@@ -81,7 +130,16 @@ class URL(TimeStampModel):
     class Meta:
         indexes = [
             models.Index(fields=['url'], name='ready_to_set_token_urls', condition=models.Q(url=READY_TO_SET_TOKEN_URL)),
-            HashIndex(fields=["token"])
+            HashIndex(fields=["token"]),
+            # Lets reap_expired_urls read the oldest expired urls without a full scan
+            models.Index(fields=["expiration_date"], name="url_expiration_date"),
+            # The redirect lookup reads its row from the index alone, skipping the expired rows of the token
+            models.Index(
+                fields=["token", "-expiration_date"],
+                name="active_token_lookup",
+                include=["id", "url"],
+                condition=~models.Q(url=READY_TO_SET_TOKEN_URL),
+            ),
         ]
 
 
@@ -95,8 +153,70 @@ class UrlUser(models.Model):
 
 class UrlUsage(TimeStampModel):
     url = models.ForeignKey(URL, on_delete=models.CASCADE, related_name="usages")
+    # Usages are written in batches, so keep the time of the redirect instead of the time of the insert
+    created_at = models.DateTimeField(default=now, validators=[validate_not_naive])
+    # Whether this usage is already added to its UrlUsageCounter bucket
+    is_counted = models.BooleanField(default=False)
     updated_at = None
+    objects = UrlUsageQuerySet.as_manager()
 
     def save(self, *args, **kwargs):
         self.full_clean()
         super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="url_usage_created_at"),
+            models.Index(fields=["id"], name="uncounted_url_usages", condition=models.Q(is_counted=False)),
+        ]
+
+
+class UrlUsageCounter(models.Model):
+    """
+    Number of usages of a url in an hourly bucket.
+    """
+    url = models.ForeignKey(URL, on_delete=models.CASCADE, related_name="usage_counters")
+    bucket = models.DateTimeField(validators=[validate_not_naive])
+    count = models.PositiveBigIntegerField(default=0)
+    objects = UrlUsageCounterQuerySet.as_manager()
+
+    @staticmethod
+    def get_bucket(created_at):
+        return localtime(created_at).replace(minute=0, second=0, microsecond=0)
+
+    def __str__(self):
+        return f"{self.url_id} - {self.bucket}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["url", "bucket"], name="unique_url_usage_counter_bucket"),
+        ]
+
+
+class TokenCounter(models.Model):
+    """
+    Last value reserved by the counter token generator, see urls.token_counter.
+    """
+    name = models.CharField(max_length=31, unique=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} - {self.value}"
+
+
+class ArchivedURL(models.Model):
+    """
+    Expired url that is removed by the reaper, its usages are summed up in `clicks`.
+    """
+    original_id = models.BigIntegerField(db_index=True)
+    name = models.CharField(max_length=31, null=True, blank=True)
+    url = models.URLField(max_length=MAXIMUM_URL_LENGTH)
+    token = models.CharField(max_length=MAXIMUM_TOKEN_LENGTH)
+    expiration_date = models.DateTimeField()
+    description = models.TextField(null=True, blank=True)
+    clicks = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(validators=[validate_not_naive])
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.url).replace("https://", "")
@@ -0,0 +1,248 @@
+"""
+Monthly partitions of the UrlUsage table, old usages are dropped a partition at a time instead of row by row.
+
+On PostgreSQL the table is turned into a native range partitioned table on `created_at` by `partition_usage_table`.
+On the other databases the table itself is renamed to an archive table once a month and a new empty table
+takes its place.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from urls.models import UrlUsage
+
+USAGE_TABLE = UrlUsage._meta.db_table
+PARTITION_NAME_FORMAT = f"{USAGE_TABLE}_p%Y%m"
+PARTITION_NAME_PATTERN = re.compile(rf"^{USAGE_TABLE}_p(\d{{4}})(\d{{2}})$")
+DEFAULT_PARTITION = f"{USAGE_TABLE}_default"
+PARTITION_ID_SEQUENCE = f"{USAGE_TABLE}_partitioned_id_seq"
+
+
+def uses_native_partitions():
+    return connection.vendor == "postgresql"
+
+
+def get_month_start(moment):
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month_start, months):
+    years, month_index = divmod(month_start.month - 1 + months, 12)
+    return month_start.replace(year=month_start.year + years, month=month_index + 1)
+
+
+def get_partition_name(month_start):
+    """
+    Name of the partition that holds the usages until the end of the month of `month_start`.
+    """
+    return month_start.strftime(PARTITION_NAME_FORMAT)
+
+
+def get_partition_end(partition_name):
+    year, month = PARTITION_NAME_PATTERN.match(partition_name).groups()
+    return add_months(datetime(int(year), int(month), 1, tzinfo=timezone.utc), 1)
+
+
+def get_partition_names():
+    with connection.cursor() as cursor:
+        if uses_native_partitions():
+            cursor.execute(
+                """
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE parent.relname = %s
+                """,
+                [USAGE_TABLE],
+            )
+            table_names = [row[0] for row in cursor.fetchall()]
+        else:
+            table_names = connection.introspection.table_names(cursor)
+    return sorted(name for name in table_names if PARTITION_NAME_PATTERN.match(name))
+
+
+def is_usage_table_partitioned():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [USAGE_TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def drops_usage_partitions():
+    """
+    Whether the expired usages are dropped a partition at a time, PostgreSQL only does it once the usage table
+    has been partitioned by `partition_usage_table`.
+    """
+    if not settings.URL_SHORTENER_USE_USAGE_PARTITIONS:
+        return False
+    return not uses_native_partitions() or is_usage_table_partitioned()
+
+
+def partition_usage_table(moment=None):
+    """
+    Turn the usage table of PostgreSQL into a table partitioned by month on `created_at`.
+
+    The current table is attached as the partition of everything until the end of the current month, so the
+    conversion does not copy any row. Its identity and primary key are replaced by the `(id, created_at)` primary
+    key of the partitions and the ids of the new rows come from a sequence of the partitioned table.
+    The table is locked while the partition constraint is checked.
+    Return False if the table is already partitioned.
+    """
+    month_start = get_month_start(moment or now())
+    legacy_partition = get_partition_name(month_start)
+    quote_name = connection.ops.quote_name
+    table = quote_name(USAGE_TABLE)
+
+    with transaction.atomic(), connection.schema_editor(atomic=False) as schema_editor:
+        if is_usage_table_partitioned():
+            return False
+
+        schema_editor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        schema_editor.execute(f"ALTER TABLE {table} RENAME TO {quote_name(legacy_partition)}")
+        for index in UrlUsage._meta.indexes:
+            schema_editor.execute(
+                f"ALTER INDEX {quote_name(index.name)} RENAME TO {quote_name(f'{legacy_partition}_{index.name}')}"
+            )
+        # A partition can not have an identity column nor a primary key without the partition key,
+        # the ids are kept and the new rows take their id from a sequence of their own
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, legacy_partition)
+        primary_key = next(name for name, constraint in constraints.items() if constraint["primary_key"])
+        schema_editor.execute(f"ALTER TABLE {quote_name(legacy_partition)} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+        schema_editor.execute(f"ALTER TABLE {quote_name(legacy_partition)} DROP CONSTRAINT {quote_name(primary_key)}")
+        schema_editor.execute(f"ALTER TABLE {quote_name(legacy_partition)} ADD PRIMARY KEY (id, created_at)")
+
+        schema_editor.execute(
+            f"CREATE TABLE {table} (LIKE {quote_name(legacy_partition)} INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)"
+        )
+        # Primary keys of partitioned tables have to include the partition key
+        schema_editor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+        schema_editor.execute(f"CREATE SEQUENCE {quote_name(PARTITION_ID_SEQUENCE)} OWNED BY {table}.id")
+        schema_editor.execute(
+            f"SELECT setval(%s, COALESCE((SELECT MAX(id) FROM {quote_name(legacy_partition)}), 0) + 1, false)",
+            [PARTITION_ID_SEQUENCE],
+        )
+        schema_editor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval(%s)", [PARTITION_ID_SEQUENCE])
+        schema_editor.execute(
+            f"ALTER TABLE {table} ADD CONSTRAINT {quote_name(f'{USAGE_TABLE}_url_id_fk')} "
+            f"FOREIGN KEY (url_id) REFERENCES {quote_name(UrlUsage.url.field.related_model._meta.db_table)} (id) "
+            f"DEFERRABLE INITIALLY DEFERRED"
+        )
+        schema_editor.execute(f"CREATE INDEX {quote_name(f'{USAGE_TABLE}_url_id')} ON {table} (url_id)")
+        for index in UrlUsage._meta.indexes:
+            schema_editor.execute(index.create_sql(UrlUsage, schema_editor))
+
+        schema_editor.execute(
+            f"ALTER TABLE {table} ATTACH PARTITION {quote_name(legacy_partition)} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{add_months(month_start, 1).isoformat()}')"
+        )
+        # Catches the usages of the months that do not have a partition yet
+        schema_editor.execute(f"CREATE TABLE {quote_name(DEFAULT_PARTITION)} PARTITION OF {table} DEFAULT")
+    return True
+
+
+def create_usage_partitions(moment=None):
+    """
+    Create the missing native partitions of the current month and of the next
+    `URL_SHORTENER_USAGE_PARTITIONS_AHEAD` months, return the names of the created partitions.
+    """
+    if not is_usage_table_partitioned():
+        return []
+
+    quote_name = connection.ops.quote_name
+    month_start = get_month_start(moment or now())
+    existing_partitions = set(get_partition_names())
+    created_partitions = []
+    with connection.cursor() as cursor:
+        for months in range(settings.URL_SHORTENER_USAGE_PARTITIONS_AHEAD + 1):
+            partition_start = add_months(month_start, months)
+            partition_name = get_partition_name(partition_start)
+            if partition_name in existing_partitions:
+                continue
+            cursor.execute(
+                f"CREATE TABLE {quote_name(partition_name)} PARTITION OF {quote_name(USAGE_TABLE)} "
+                f"FOR VALUES FROM ('{partition_start.isoformat()}') TO ('{add_months(partition_start, 1).isoformat()}')"
+            )
+            created_partitions.append(partition_name)
+    return created_partitions
+
+
+def rotate_usage_table(moment=None):
+    """
+    Rename the usage table to the archive table of the previous month and create an empty usage table,
+    if the usage table still has usages from before the current month.
+
+    The usages are counted into their buckets first. The usages of the current month are moved back into the
+    new table, so the archive only holds usages from before the month it is named after (several months of them
+    if the rotation ran late) and is not dropped before all of them are past the retention period.
+    On SQLite the archive is a copy of the old usages without the foreign key to the urls.
+    Return the name of the archive table or None.
+    """
+    month_start = get_month_start(moment or now())
+    archive_table = get_partition_name(add_months(month_start, -1))
+    if archive_table in get_partition_names() or not UrlUsage.objects.filter(created_at__lt=month_start).exists():
+        return None
+
+    # SQLite can not drop the foreign key of a table, which would keep the urls with archived usages from being
+    # deleted, so its archive is a copy of the old usages without any constraint
+    copies_archive = connection.vendor == "sqlite"
+    rotated_table = f"{archive_table}_rotated" if copies_archive else archive_table
+    with connection.schema_editor() as schema_editor:
+        UrlUsage.objects.count_into_buckets(settings.URL_SHORTENER_USAGE_COMPACTION_BATCH_SIZE)
+        schema_editor.alter_db_table(UrlUsage, USAGE_TABLE, rotated_table)
+        # Index and constraint names have to be free for the new table, the archive is only kept to be dropped
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, rotated_table)
+        for name, constraint in constraints.items():
+            if constraint["index"] and not constraint["primary_key"] and not name.startswith("sqlite_autoindex"):
+                schema_editor.execute(
+                    schema_editor.sql_delete_index % {
+                        "table": schema_editor.quote_name(rotated_table),
+                        "name": schema_editor.quote_name(name),
+                    }
+                )
+            elif constraint["foreign_key"] and not copies_archive:
+                schema_editor.execute(
+                    schema_editor.sql_delete_fk % {
+                        "table": schema_editor.quote_name(rotated_table),
+                        "name": schema_editor.quote_name(name),
+                    }
+                )
+        schema_editor.create_model(UrlUsage)
+
+        quote_name = connection.ops.quote_name
+        columns = ", ".join(quote_name(field.column) for field in UrlUsage._meta.concrete_fields)
+        created_at = quote_name(UrlUsage._meta.get_field("created_at").column)
+        month_start_value = connection.ops.adapt_datetimefield_value(month_start)
+        schema_editor.execute(
+            f"INSERT INTO {quote_name(USAGE_TABLE)} ({columns}) "
+            f"SELECT {columns} FROM {quote_name(rotated_table)} WHERE {created_at} >= %s",
+            [month_start_value],
+        )
+        if copies_archive:
+            schema_editor.execute(
+                f"CREATE TABLE {quote_name(archive_table)} AS "
+                f"SELECT {columns} FROM {quote_name(rotated_table)} WHERE {created_at} < %s",
+                [month_start_value],
+            )
+            schema_editor.execute(f"DROP TABLE {quote_name(rotated_table)}")
+        else:
+            schema_editor.execute(
+                f"DELETE FROM {quote_name(archive_table)} WHERE {created_at} >= %s", [month_start_value]
+            )
+    return archive_table
+
+
+def drop_expired_usage_partitions(moment=None):
+    """
+    Drop the partitions whose usages are all older than the retention period, return their names.
+    """
+    retention_start = (moment or now()) - timedelta(days=settings.URL_SHORTENER_USAGE_RETENTION_DAYS)
+    expired_partitions = [name for name in get_partition_names() if get_partition_end(name) <= retention_start]
+    with connection.cursor() as cursor:
+        for partition_name in expired_partitions:
+            cursor.execute(f"DROP TABLE {connection.ops.quote_name(partition_name)}")
+    return expired_partitions
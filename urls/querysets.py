@@ -1,11 +1,24 @@
+from functools import reduce
+from operator import or_
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncHour
+from django.db.models.signals import post_save
 
 from django.utils.timezone import now
 
+from urls.cache import delete_redirect_entries, uses_write_through_cache, write_redirect_entries
+from urls.token_filter import active_token_filter
+from urls.token_pool import record_claims, record_fallbacks, redis_token_pool, uses_redis_token_pool
+
 READY_TO_SET_TOKEN_URL = settings.URL_SHORTENER_READY_TO_SET_TOKEN_URL
+TOKEN_BATCH_SIZE = settings.URL_SHORTENER_TOKEN_BATCH_SIZE
+MAXIMUM_RECURSION_DEPTH = settings.URL_SHORTENER_MAXIMUM_RECURSION_DEPTH
+# Keeps the conditions of the increment UPDATE below the expression depth limit of SQLite
+COUNTER_INCREMENT_BATCH_SIZE = 100
 
 
 class URLQuerySet(models.QuerySet):
@@ -37,21 +50,217 @@ class URLManager(models.Manager):
                     .filter(Q(url=READY_TO_SET_TOKEN_URL) | Q(expiration_date__gte=now()))
                     .exists()):
                 raise ValidationError("This token is already active.")
+            if uses_redis_token_pool():
+                redis_token_pool.discard([suggested_token])
             return super().create(url=url, token=suggested_token, **kwargs)
 
-        if ready_to_set_token_obj := self.all_ready_to_set_token().first():
-            ready_to_set_token_obj.url = url
-            ready_to_set_token_obj.expiration_date = kwargs.get('expiration_date', None)
-            ready_to_set_token_obj.created_at = now()
-            ready_to_set_token_obj.save()
+        if uses_redis_token_pool():
+            if pooled_tokens := redis_token_pool.pop():
+                return super().create(url=url, token=pooled_tokens[0], **kwargs)
+        elif ready_to_set_token_obj := self.claim_ready_to_set_token(url, **kwargs):
             return ready_to_set_token_obj
 
+        record_fallbacks(1)
         token = self.model.create_token()
         return super().create(url=url, token=token, **kwargs)
 
+    def claim_ready_to_set_token(self, url, token=None, **kwargs):
+        """
+        Set `url` on a ready_to_set_token object that can not be claimed by any concurrent caller.
+        Return None if there is no ready_to_set_token object (with the given token) to claim.
+        """
+        queryset = self.all_ready_to_set_token()
+        if token:
+            queryset = queryset.filter(token=token)
+        fields = {
+            **kwargs,
+            "url": url,
+            "expiration_date": kwargs.get("expiration_date") or self.model._meta.get_field("expiration_date").get_default(),
+            "created_at": now(),
+        }
+
+        if connections[self.db].features.has_select_for_update_skip_locked:
+            # Concurrent callers skip the locked rows instead of waiting for them
+            with transaction.atomic(using=self.db):
+                ready_to_set_token_obj = queryset.select_for_update(skip_locked=True).first()
+                if ready_to_set_token_obj:
+                    for field, value in fields.items():
+                        setattr(ready_to_set_token_obj, field, value)
+                    ready_to_set_token_obj.claimed_from_pool = True
+                    ready_to_set_token_obj.save()
+                    ready_to_set_token_obj.claimed_from_pool = False
+                    # A refill scheduled before the commit would still count the claimed row
+                    transaction.on_commit(lambda: record_claims(1), using=self.db)
+                return ready_to_set_token_obj
+
+        # Without row locks (SQLite) the update only applies if the row is still a ready_to_set_token object
+        for _ in range(MAXIMUM_RECURSION_DEPTH):
+            ready_to_set_token_obj = queryset.first()
+            if not ready_to_set_token_obj:
+                return None
+            for field, value in fields.items():
+                setattr(ready_to_set_token_obj, field, value)
+            ready_to_set_token_obj.full_clean()
+            ready_to_set_token_obj.updated_at = now()
+            if queryset.filter(pk=ready_to_set_token_obj.pk).update(**fields, updated_at=ready_to_set_token_obj.updated_at):
+                ready_to_set_token_obj.claimed_from_pool = True
+                post_save.send(
+                    sender=self.model, instance=ready_to_set_token_obj, created=False,
+                    update_fields=None, raw=False, using=self.db,
+                )
+                ready_to_set_token_obj.claimed_from_pool = False
+                transaction.on_commit(lambda: record_claims(1), using=self.db)
+                return ready_to_set_token_obj
+        return None
+
+    def bulk_create_urls(self, items):
+        """
+        Create a url object for every item (a dict of url and the optional token, name and expiration_date)
+        with a number of queries that does not depend on the number of items.
+        Return the created url object or the ValidationError of every item in the same order as `items`.
+        """
+        results = [None] * len(items)
+        objs = {}
+        for index, item in enumerate(items):
+            obj = self.model(
+                url=item["url"],
+                token=item.get("token") or "",
+                name=item.get("name") or None,
+                expiration_date=item.get("expiration_date") or self.model._meta.get_field("expiration_date").get_default(),
+            )
+            try:
+                if obj.url == READY_TO_SET_TOKEN_URL:
+                    raise ValidationError({"url": "You can not use ready_to_set_token_url"})
+                obj.clean_fields(exclude=None if obj.token else ["token"])
+            except ValidationError as e:
+                results[index] = e
+                continue
+            objs[index] = obj
+
+        def reject(index, field, message):
+            results[index] = ValidationError({field: message})
+            del objs[index]
+
+        suggested_tokens = {obj.token for obj in objs.values() if obj.token}
+        active_tokens = set(
+            self.get_queryset()
+            .filter(token__in=suggested_tokens)
+            .filter(Q(url=READY_TO_SET_TOKEN_URL) | Q(expiration_date__gte=now()))
+            .values_list("token", flat=True)
+        ) if suggested_tokens else set()
+        names = {obj.name for obj in objs.values() if obj.name}
+        existing_names = set(
+            self.get_queryset().filter(name__in=names).values_list("name", flat=True)
+        ) if names else set()
+
+        seen_tokens, seen_names = set(), set()
+        for index, obj in list(objs.items()):
+            if obj.token and (obj.token in active_tokens or obj.token in seen_tokens):
+                reject(index, "token", "This token is already active.")
+            elif obj.name and (obj.name in existing_names or obj.name in seen_names):
+                reject(index, "name", "Url with this Name already exists.")
+            else:
+                seen_tokens.add(obj.token)
+                seen_names.add(obj.name)
+
+        objs_without_token = [obj for obj in objs.values() if not obj.token]
+        with transaction.atomic(using=self.db):
+            if uses_redis_token_pool():
+                redis_token_pool.discard([obj.token for obj in objs.values() if obj.token])
+                claimed_count = self.bulk_claim_pooled_tokens(objs_without_token)
+            else:
+                claimed_count = self.bulk_claim_ready_to_set_tokens(objs_without_token)
+            new_tokens = self.model.create_tokens(len(objs_without_token) - claimed_count, exclude=suggested_tokens)
+            for obj, token in zip(objs_without_token[claimed_count:], new_tokens):
+                obj.token = token
+            self.bulk_create([obj for obj in objs.values() if obj.pk is None], batch_size=TOKEN_BATCH_SIZE)
+            # bulk_create and bulk_update do not send the post_save signal that invalidates the cached tokens
+            created_tokens = [obj.token for obj in objs.values()]
+            transaction.on_commit(lambda: delete_redirect_entries(created_tokens), using=self.db)
+            if uses_write_through_cache():
+                created_urls = [(obj.token, obj.url, obj.pk, obj.expiration_date) for obj in objs.values() if obj.pk]
+                transaction.on_commit(lambda: write_redirect_entries(created_urls), using=self.db)
+            active_token_filter.add(created_tokens)
+
+        if not uses_redis_token_pool():
+            # The Redis pool counts its claims when it pops them
+            transaction.on_commit(lambda: record_claims(claimed_count), using=self.db)
+        record_fallbacks(len(objs_without_token) - claimed_count)
+        for index, obj in objs.items():
+            results[index] = obj
+        return results
+
+    def bulk_claim_ready_to_set_tokens(self, objs):
+        """
+        Assign the token of a ready_to_set_token object to as many of the unsaved `objs` as possible,
+        update those ready_to_set_token objects and return how many of `objs` are claimed.
+        Must be called in a transaction.
+        """
+        queryset = self.all_ready_to_set_token()
+        if connections[self.db].features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        ready_to_set_tokens = list(queryset.order_by("pk").values_list("pk", "token")[:len(objs)]) if objs else []
+
+        claimed_at = now()
+        claimed_objs = objs[:len(ready_to_set_tokens)]
+        for obj, (pk, token) in zip(claimed_objs, ready_to_set_tokens):
+            obj.pk, obj.token, obj.created_at, obj.updated_at = pk, token, claimed_at, claimed_at
+        if not claimed_objs:
+            return 0
+
+        # The update only applies to the rows that are still ready_to_set_token objects
+        updated_count = self.all_ready_to_set_token().bulk_update(
+            claimed_objs, ["url", "name", "expiration_date", "created_at", "updated_at"],
+        )
+        if updated_count != len(claimed_objs):
+            raise IntegrityError("Ready to set tokens are claimed concurrently.")
+        return len(claimed_objs)
+
+    def bulk_claim_pooled_tokens(self, objs):
+        """
+        Assign a token of the Redis token pool to as many of the unsaved `objs` as possible,
+        return how many of `objs` are claimed.
+        """
+        pooled_tokens = redis_token_pool.pop(len(objs)) if objs else []
+        for obj, token in zip(objs, pooled_tokens):
+            obj.token = token
+        return len(pooled_tokens)
+
     def create_ready_to_set_token(self):
         return super().create(url=READY_TO_SET_TOKEN_URL, token=self.model.create_token())
 
+    def bulk_create_ready_to_set_tokens(self, count):
+        tokens = self.model.create_tokens(count)
+        active_token_filter.add(tokens)
+        return self.bulk_create(
+            [self.model(url=READY_TO_SET_TOKEN_URL, token=token) for token in tokens],
+            batch_size=TOKEN_BATCH_SIZE,
+        )
+
+    def recycle_tokens(self, tokens):
+        """
+        Put the tokens of expired urls back into the ready_to_set_token pool, up to READY_TO_SET_TOKEN_LIMIT objects.
+        Tokens that are active again are skipped. Return the recycled tokens.
+        """
+        pool_size = len(redis_token_pool) if uses_redis_token_pool() else self.all_ready_to_set_token().count()
+        free_slots = settings.URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT - pool_size
+        if free_slots <= 0 or not tokens:
+            return []
+
+        used_tokens = set(
+            self.get_queryset()
+            .filter(token__in=tokens)
+            .filter(Q(url=READY_TO_SET_TOKEN_URL) | Q(expiration_date__gte=now()))
+            .values_list("token", flat=True)
+        )
+        recycled_tokens = [token for token in dict.fromkeys(tokens) if token not in used_tokens][:free_slots]
+        if uses_redis_token_pool():
+            redis_token_pool.add(recycled_tokens)
+            return recycled_tokens
+        self.bulk_create([self.model(url=READY_TO_SET_TOKEN_URL, token=token) for token in recycled_tokens])
+        active_token_filter.add(recycled_tokens)
+        return recycled_tokens
+
     def all_ready_to_set_token(self):
         return super().all().filter(url=READY_TO_SET_TOKEN_URL).order_by()
 
@@ -60,3 +269,55 @@ class URLManager(models.Manager):
         if ready_to_set_token:
             return ready_to_set_token
         return self.create_ready_to_set_token()
+
+
+class UrlUsageQuerySet(models.QuerySet):
+    def count_into_buckets(self, batch_size):
+        """
+        Fold the not counted usages into their UrlUsageCounter buckets, `batch_size` usages per transaction.
+        """
+        from urls.models import UrlUsageCounter
+
+        while True:
+            with transaction.atomic(using=self.db):
+                pks = list(self.filter(is_counted=False).values_list("pk", flat=True)[:batch_size])
+                if not pks:
+                    return
+                batch = self.filter(pk__in=pks)
+                counts = (
+                    batch
+                    .annotate(bucket=TruncHour("created_at"))
+                    .values("url_id", "bucket")
+                    .annotate(count=Count("id"))
+                    .order_by()
+                )
+                UrlUsageCounter.objects.increment({(row["url_id"], row["bucket"]): row["count"] for row in counts})
+                batch.update(is_counted=True)
+
+
+class UrlUsageCounterQuerySet(models.QuerySet):
+    def total(self):
+        return self.aggregate(total=Coalesce(Sum("count"), 0))["total"]
+
+    def increment(self, counts):
+        """
+        Atomically add usages to the buckets, `counts` maps (url_id, bucket) to the number of usages.
+
+        Every COUNTER_INCREMENT_BATCH_SIZE buckets take two queries, whatever the number of urls:
+        the missing buckets are created empty and then all of them are incremented by a single UPDATE.
+        """
+        items = list(counts.items())
+        for start in range(0, len(items), COUNTER_INCREMENT_BATCH_SIZE):
+            batch = items[start:start + COUNTER_INCREMENT_BATCH_SIZE]
+            # A bucket created by a concurrent writer is kept as it is
+            self.bulk_create(
+                [self.model(url_id=url_id, bucket=bucket, count=0) for (url_id, bucket), _ in batch],
+                ignore_conflicts=True,
+            )
+            conditions = [Q(url_id=url_id, bucket=bucket) for (url_id, bucket), _ in batch]
+            self.filter(reduce(or_, conditions)).update(
+                count=F("count") + Case(
+                    *[When(condition, then=Value(count)) for condition, (_, count) in zip(conditions, batch)],
+                    default=Value(0),
+                )
+            )
@@ -1,18 +1,54 @@
+from django.conf import settings
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from django.core.cache import cache
-from urls.models import URL
+from urls.cache import (
+    bump_local_cache_generation,
+    local_cache,
+    redirect_cache,
+    uses_write_through_cache,
+    write_redirect_entries,
+)
+from urls.models import URL, READY_TO_SET_TOKEN_URL
+from urls.token_filter import active_token_filter
 
 
-def invalidate_cache(url_object: URL):
-    cache.delete(url_object.token)
+def invalidate_cache(url_object: URL, created=False):
+    redirect_cache.delete(url_object.token)
+    if settings.URL_SHORTENER_USE_LOCAL_CACHE:
+        local_cache.delete(url_object.token)
+        if not created and not url_object.claimed_from_pool:
+            # New and claimed rows can not be in any local cache, the existing ones may be cached by other processes
+            bump_local_cache_generation()
+
+
+def write_through_cache(url_object: URL, using=None):
+    """
+    Cache the entry of an active url once its transaction commits, a rolled back save does not touch the cache.
+    """
+    if url_object.url == READY_TO_SET_TOKEN_URL or not url_object.is_active:
+        return
+    url = (url_object.token, url_object.url, url_object.pk, url_object.expiration_date)
+    transaction.on_commit(lambda: write_redirect_entries([url]), using=using)
+
+
+@receiver(post_save, sender=URL)
+def invalidate_cache_on_update(sender, instance, created=False, using=None, **kwargs):
+    invalidate_cache(instance, created)
+    # The commits of concurrent updates may run their callbacks out of order, an older entry would overwrite
+    # the newer one until it expires. A new or claimed token has a single writer, the updates are only deleted.
+    if uses_write_through_cache() and (created or instance.claimed_from_pool):
+        write_through_cache(instance, using)
 
 
 @receiver(post_save, sender=URL)
-def invalidate_cache_on_update(sender, instance, **kwargs):
-    invalidate_cache(instance)
+def add_token_to_active_token_filter(sender, instance, **kwargs):
+    if instance.is_active:
+        active_token_filter.add([instance.token])
 
 
 @receiver(post_delete, sender=URL)
 def invalidate_cache_on_delete(sender, instance, **kwargs):
-    invalidate_cache(instance)
+    # The entries of expired urls can not be served by any cache, the reaper deletes them in bulk
+    if not instance.reaped:
+        invalidate_cache(instance)
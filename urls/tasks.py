@@ -1,22 +1,193 @@
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 
 from celery import shared_task
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.db.models.deletion import Collector
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
 
-from urls.models import URL, UrlUsage
+from urls import metrics
+from urls.cache import build_redirect_entry, cache_redirect_entries, delete_redirect_entries
+from urls.models import URL, ArchivedURL, UrlUsage, UrlUsageCounter
+from urls.partitions import (
+    create_usage_partitions,
+    drop_expired_usage_partitions,
+    drops_usage_partitions,
+    rotate_usage_table,
+    uses_native_partitions,
+)
+from urls.token_pool import (
+    get_claim_rate,
+    get_pool_sizes,
+    record_pool_depth,
+    redis_token_pool,
+    release_refill_lock,
+    uses_redis_token_pool,
+)
+
+USAGE_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S %z'
 
 
 @shared_task
-def create_ready_to_set_token_periodically():
-    ready_to_set_token_count = URL.objects.all_ready_to_set_token().count()
-    limit = settings.URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT
-    if ready_to_set_token_count < limit:
-        for _ in range(limit - ready_to_set_token_count):
-            # ToDo: Use bulk_create
-            URL.objects.create_ready_to_set_token()
+@metrics.task_seconds.time(task="create_ready_to_set_token_periodically")
+def create_ready_to_set_token_periodically(refill_lock_id=None):
+    """
+    Fill the ready-to-set token pool up to its target size, sized from the claim rate
+    with URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL.
+
+    `refill_lock_id` is the refill lock taken by the claim that scheduled this run, the runs of beat do not
+    release the lock of a scheduled refill.
+    """
+    try:
+        claim_rate = get_claim_rate() if settings.URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL else 0
+        target_size, low_watermark = get_pool_sizes(claim_rate)
+        if uses_redis_token_pool():
+            created_tokens = redis_token_pool.refill(target_size)
+            depth = len(redis_token_pool)
+        else:
+            ready_to_set_token_count = URL.objects.all_ready_to_set_token().count()
+            created_tokens = []
+            if ready_to_set_token_count < target_size:
+                created_tokens = URL.objects.bulk_create_ready_to_set_tokens(target_size - ready_to_set_token_count)
+            depth = ready_to_set_token_count + len(created_tokens)
+        metrics.pool_tokens_created.inc(len(created_tokens))
+        record_pool_depth(depth, low_watermark)
+    finally:
+        if refill_lock_id is not None:
+            release_refill_lock(refill_lock_id)
 
 
 @shared_task()
 def log_the_url_usages(url_id, created_at):
-    # ToDo: Use bulk create instead
-    UrlUsage.objects.create(url_id=url_id, created_at=datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S %z',))
+    log_the_url_usages_in_bulk([[url_id, created_at]])
+
+
+@shared_task()
+def log_the_url_usages_in_bulk(usages):
+    usages = [
+        UrlUsage(url_id=url_id, created_at=datetime.strptime(created_at, USAGE_DATETIME_FORMAT), is_counted=True)
+        for url_id, created_at in usages
+    ]
+    with transaction.atomic():
+        UrlUsage.objects.bulk_create(usages, batch_size=settings.URL_SHORTENER_USAGE_LOG_BATCH_SIZE)
+        UrlUsageCounter.objects.increment(
+            Counter((usage.url_id, UrlUsageCounter.get_bucket(usage.created_at)) for usage in usages)
+        )
+
+
+@shared_task
+def compact_url_usages():
+    """
+    Fold the not counted usages into their buckets and delete the usages that are older than the retention period.
+    """
+    batch_size = settings.URL_SHORTENER_USAGE_COMPACTION_BATCH_SIZE
+    UrlUsage.objects.count_into_buckets(batch_size)
+    if drops_usage_partitions():
+        # The old partitions are dropped as a whole by maintain_url_usage_partitions
+        return
+
+    expired_usages = UrlUsage.objects.filter(
+        created_at__lt=now() - timedelta(days=settings.URL_SHORTENER_USAGE_RETENTION_DAYS)
+    )
+    while pks := list(expired_usages.values_list("pk", flat=True)[:batch_size]):
+        UrlUsage.objects.filter(pk__in=pks).delete()
+
+
+@shared_task
+def maintain_url_usage_partitions():
+    """
+    Prepare the partition of the coming usages and drop the partitions that are older than the retention period.
+    """
+    if not settings.URL_SHORTENER_USE_USAGE_PARTITIONS:
+        return []
+
+    if uses_native_partitions():
+        create_usage_partitions()
+    else:
+        rotate_usage_table()
+    return drop_expired_usage_partitions()
+
+
+@shared_task
+def warm_redirect_cache(limit=None):
+    """
+    Cache the redirect entries of the most used active urls of the last days and return how many are cached.
+    """
+    since = now() - timedelta(days=settings.URL_SHORTENER_CACHE_WARM_UP_DAYS)
+    hot_urls = (
+        URL.objects
+        .exclude_ready_to_set_urls()
+        .all_actives()
+        .filter(usage_counters__bucket__gte=since)
+        .annotate(clicks=Sum("usage_counters__count"))
+        .order_by("-clicks")
+        .only("token", "url", "expiration_date")
+    )[:limit or settings.URL_SHORTENER_CACHE_WARM_UP_LIMIT]
+
+    entries = {}
+    for url in hot_urls:
+        remaining_seconds = int((url.expiration_date - now()).total_seconds())
+        entries[url.token] = (build_redirect_entry(url.url, url.pk, remaining_seconds), remaining_seconds)
+    return cache_redirect_entries(entries)
+
+
+@shared_task
+def reap_expired_urls():
+    """
+    Archive or delete the urls that are expired for more than URL_SHORTENER_EXPIRED_URL_GRACE_DAYS days,
+    together with their usages, and recycle their tokens. Return the number of reaped urls.
+
+    Each batch is a transaction of its own and a run stops after URL_SHORTENER_EXPIRED_URL_REAPER_MAX_BATCHES batches.
+    """
+    mode = settings.URL_SHORTENER_EXPIRED_URL_REAPER_MODE
+    if mode is None:
+        return 0
+
+    expired_urls = (
+        URL.objects
+        .exclude_ready_to_set_urls()
+        .filter(expiration_date__lt=now() - timedelta(days=settings.URL_SHORTENER_EXPIRED_URL_GRACE_DAYS))
+        .order_by("expiration_date")
+    )
+    if connection.features.has_select_for_update_skip_locked:
+        # Concurrent runs reap different batches
+        expired_urls = expired_urls.select_for_update(skip_locked=True, of=("self",))
+
+    reaped_count = 0
+    for _ in range(settings.URL_SHORTENER_EXPIRED_URL_REAPER_MAX_BATCHES):
+        with transaction.atomic():
+            batch = list(expired_urls.only("pk", "token")[:settings.URL_SHORTENER_EXPIRED_URL_REAPER_BATCH_SIZE])
+            if not batch:
+                break
+            pks = [url.pk for url in batch]
+            tokens = [url.token for url in batch]
+
+            if mode == "archive":
+                archived_urls = (
+                    URL.objects
+                    .filter(pk__in=pks)
+                    .annotate(clicks=Coalesce(Sum("usage_counters__count"), 0))
+                    .order_by()
+                )
+                ArchivedURL.objects.bulk_create([
+                    ArchivedURL(
+                        original_id=url.pk, name=url.name, url=url.url, token=url.token,
+                        expiration_date=url.expiration_date, description=url.description,
+                        clicks=url.clicks, created_at=url.created_at,
+                    )
+                    for url in archived_urls
+                ])
+            # The usages, usage counters and url users are deleted by the cascade. The post_delete signals get these
+            # flagged instances and skip the per-row eviction, the whole batch is evicted once it commits.
+            for url in batch:
+                url.reaped = True
+            collector = Collector(using=expired_urls.db)
+            collector.collect(batch)
+            collector.delete()
+            URL.objects.recycle_tokens(tokens)
+            transaction.on_commit(lambda tokens=tokens: delete_redirect_entries(tokens))
+        reaped_count += len(batch)
+    return reaped_count
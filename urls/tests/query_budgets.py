@@ -0,0 +1,31 @@
+"""
+Query budgets of the hot paths, checked by test_query_budgets.
+
+Raise a budget only together with the change that needs the extra queries.
+"""
+from utils.tests import QueryBudget
+
+QUERY_BUDGETS = {
+    # Redirects, the usage is buffered and written in batches
+    "RedirectAPIView": QueryBudget(max_queries=1),
+    "RedirectAPIView cache hit": QueryBudget(max_queries=0),
+    "RedirectAPIView cache miss": QueryBudget(max_queries=1),
+    # Token resolution, session and user then a single query for all the tokens that are not cached
+    "ResolveTokensAPIView": QueryBudget(max_queries=3),
+    "ResolveTokensAPIView cache hit": QueryBudget(max_queries=2),
+    # URLManager
+    "URLManager.create with a pool token": QueryBudget(max_queries=2),
+    "URLManager.create without pool tokens": QueryBudget(max_queries=3),
+    # Admin changelists, session, user, count and the page whatever the number of rows
+    "UrlAdmin changelist": QueryBudget(max_queries=4),
+    "UrlUsageAdmin changelist": QueryBudget(max_queries=4),
+    "UrlUsageCounterAdmin changelist": QueryBudget(max_queries=4),
+    "ArchivedURLAdmin changelist": QueryBudget(max_queries=4),
+    # Celery tasks, the savepoints of their transactions are counted too
+    "create_ready_to_set_token_periodically": QueryBudget(max_queries=3),
+    "log_the_url_usages_in_bulk": QueryBudget(max_queries=5),
+    # The batch loops end with a query that finds nothing left
+    "compact_url_usages": QueryBudget(max_queries=11, max_duplicates=1),
+    "warm_redirect_cache": QueryBudget(max_queries=1),
+    "reap_expired_urls": QueryBudget(max_queries=16, max_duplicates=1),
+}
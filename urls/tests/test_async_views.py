@@ -0,0 +1,168 @@
+import asyncio
+from datetime import timedelta
+from time import time
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from urls.api.views import AsyncRedirectView
+from urls.cache import FILL_LOCK_KEY_PREFIX, NOT_FOUND, local_cache, redirect_cache
+from urls.models import URL
+from urls.usage_logger import UsageBuffer
+
+# URLManager.create sets the token, QuerySet.acreate skips it
+create_url = sync_to_async(URL.objects.create)
+
+
+class TestAsyncRedirectView(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.factory = AsyncRequestFactory()
+        self.view = AsyncRedirectView.as_view()
+
+    async def get(self, token):
+        return await self.view(self.factory.get(f"/u/{token}/"), token=token)
+
+    @patch("urls.api.views.usage_buffer.aadd")
+    async def test_redirect_with_valid_token_redirect_to_correct_url(self, mock_aadd):
+        url = await create_url(url="https://example.com")
+
+        response = await self.get(url.token)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, "https://example.com")
+        mock_aadd.assert_awaited_once()
+        self.assertEqual(mock_aadd.await_args.args[0], url.pk)
+
+    @patch("urls.api.views.usage_buffer.aadd")
+    async def test_redirect_with_expired_token_redirect_to_404_page(self, mock_aadd):
+        url = await create_url(url="https://example.com")
+        await URL.objects.filter(pk=url.pk).aupdate(expiration_date=now() - timedelta(days=1))
+
+        response = await self.get(url.token)
+
+        self.assertEqual(response.url, settings.URL_SHORTENER_404_PAGE)
+        mock_aadd.assert_not_awaited()
+
+    async def test_redirect_with_invalid_token_length_redirect_to_404_page(self):
+        response = await self.get("a" * (settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH + 1))
+
+        self.assertEqual(response.url, settings.URL_SHORTENER_404_PAGE)
+
+    @patch("urls.api.views.usage_buffer.aadd")
+    @override_settings(URL_SHORTENER_USE_CACHE=True)
+    async def test_redirect_cache_the_url_and_serve_it_from_the_cache(self, mock_aadd):
+        url = await create_url(url="https://example.com")
+
+        await self.get(url.token)
+        cached_value = await redirect_cache.aget(url.token)
+        self.assertEqual(cached_value["redirect_url"], "https://example.com")
+        self.assertEqual(cached_value["url_pk"], url.pk)
+
+        with patch.object(AsyncRedirectView, "aget_object") as mock_aget_object:
+            response = await self.get(url.token)
+        self.assertEqual(response.url, "https://example.com")
+        mock_aget_object.assert_not_awaited()
+
+    @patch("urls.api.views.usage_buffer.aadd")
+    @patch("urls.cache.LocalCache._check_generation", side_effect=AssertionError("Blocking cache call"))
+    @override_settings(URL_SHORTENER_USE_CACHE=True, URL_SHORTENER_USE_LOCAL_CACHE=True)
+    async def test_redirect_fill_the_local_cache_without_blocking_calls(self, mock_check_generation, mock_aadd):
+        url = await create_url(url="https://example.com")
+
+        await self.get(url.token)
+        self.assertEqual((await local_cache.aget(url.token))["url_pk"], url.pk)
+
+        local_cache.clear()
+        await self.get(url.token)
+        self.assertEqual((await local_cache.aget(url.token))["url_pk"], url.pk)
+        mock_check_generation.assert_not_called()
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True, URL_SHORTENER_NEGATIVE_CACHE_TTL=30)
+    async def test_redirect_with_unknown_token_cache_the_miss(self):
+        token = "a" * settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH
+
+        await self.get(token)
+
+        self.assertEqual(await redirect_cache.aget(token), NOT_FOUND)
+
+
+@override_settings(URL_SHORTENER_USE_CACHE=True, URL_SHORTENER_USE_REDIRECT_FAST_PATH=True)
+@patch("urls.api.views.usage_buffer.aadd")
+class TestAsyncRedirectCacheFill(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+
+    async def test_parallel_misses_share_a_single_lookup(self, mock_aadd):
+        url = await create_url(url="https://example.com")
+        aget_object = AsyncRedirectView.aget_object
+        lookups = []
+
+        async def slow_aget_object(view, token):
+            lookups.append(token)
+            await asyncio.sleep(0.05)
+            return await aget_object(view, token)
+
+        with patch.object(AsyncRedirectView, "aget_object", slow_aget_object):
+            responses = await asyncio.gather(*(self.async_client.get(f"/u/{url.token}/") for _ in range(10)))
+
+        self.assertEqual({response["location"] for response in responses}, {"https://example.com"})
+        self.assertEqual(lookups, [url.token])
+
+    @override_settings(URL_SHORTENER_CACHE_REFRESH_INTERVAL=60)
+    async def test_entry_is_refreshed_after_the_refresh_interval(self, mock_aadd):
+        url = await create_url(url="https://example.com")
+        await self.async_client.get(f"/u/{url.token}/")
+        await URL.objects.filter(pk=url.pk).aupdate(url="https://example.org")
+
+        with patch("urls.cache.time", return_value=time() + 61):
+            response = await self.async_client.get(f"/u/{url.token}/")
+
+        self.assertEqual(response["location"], "https://example.org")
+
+    @override_settings(URL_SHORTENER_CACHE_REFRESH_INTERVAL=60, URL_SHORTENER_USE_CACHE_LOCK=True)
+    async def test_stale_entry_is_served_while_another_process_refresh_it(self, mock_aadd):
+        url = await create_url(url="https://example.com")
+        await self.async_client.get(f"/u/{url.token}/")
+        await cache.aadd(FILL_LOCK_KEY_PREFIX + url.token, 1)
+
+        with patch("urls.cache.time", return_value=time() + 61), \
+                patch.object(AsyncRedirectView, "aget_object") as mock_aget_object:
+            response = await self.async_client.get(f"/u/{url.token}/")
+
+        self.assertEqual(response["location"], "https://example.com")
+        mock_aget_object.assert_not_called()
+
+
+class TestUsageBufferAsyncAdd(TestCase):
+    async def test_aadd_flush_in_the_background(self):
+        flushed = []
+        usage_buffer = UsageBuffer(batch_size=2, flush_interval=60, flush_callback=flushed.extend, use_timer=False)
+
+        await usage_buffer.aadd(1, "a")
+        await usage_buffer.aadd(2, "b")
+        self.assertEqual(len(usage_buffer._flush_tasks), 1)
+
+        for flush_task in list(usage_buffer._flush_tasks):
+            await flush_task
+        self.assertEqual(flushed, [[1, "a"], [2, "b"]])
+        self.assertEqual(len(usage_buffer), 0)
+
+    async def test_failed_background_flush_is_logged(self):
+        usage_buffer = UsageBuffer(batch_size=1, flush_interval=60, use_timer=False)
+
+        with patch.object(usage_buffer, "flush", side_effect=RuntimeError), self.assertLogs("urls.usage_logger", "ERROR"):
+            await usage_buffer.aadd(1, "a")
+            flush_tasks = list(usage_buffer._flush_tasks)
+            await asyncio.gather(*flush_tasks, return_exceptions=True)
+            # The done callbacks run on the next iteration of the event loop
+            await asyncio.sleep(0)
+
+        self.assertEqual(usage_buffer._flush_tasks, set())
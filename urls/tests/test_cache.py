@@ -0,0 +1,512 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from time import sleep, time
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from urls.api.views import RedirectAPIView
+from urls.cache import (
+    ENTRY_HEADER,
+    FILL_LOCK_KEY_PREFIX,
+    GENERATION_KEY,
+    NOT_FOUND,
+    LocalCache,
+    SingleFlight,
+    build_redirect_entry,
+    bump_local_cache_generation,
+    local_cache,
+    pack_redirect_entry,
+    redirect_cache,
+    should_refresh_early,
+    unpack_redirect_entry,
+)
+from urls.models import URL
+
+
+def get_redirect_url(token):
+    return reverse("urls:redirect", kwargs={"token": token})
+
+
+class TestLocalCache(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_count_hits_and_misses(self):
+        local = LocalCache(max_size=10)
+        local.set("key", "value", 10)
+
+        self.assertEqual(local.get("key"), "value")
+        self.assertIsNone(local.get("missing"))
+        self.assertEqual((local.hits, local.misses), (1, 1))
+
+    def test_set_evict_the_least_recently_used_entry(self):
+        local = LocalCache(max_size=2)
+        local.set("a", 1, 10)
+        local.set("b", 2, 10)
+        local.get("a")
+        local.set("c", 3, 10)
+
+        self.assertEqual(local.get("a"), 1)
+        self.assertIsNone(local.get("b"))
+        self.assertEqual(local.get("c"), 3)
+
+    @patch("urls.cache.monotonic")
+    def test_get_expired_entry_return_none(self, mock_monotonic):
+        local = LocalCache(max_size=10, generation_check_interval=100)
+        mock_monotonic.return_value = 100
+        local.set("key", "value", 5)
+
+        mock_monotonic.return_value = 104
+        self.assertEqual(local.get("key"), "value")
+        mock_monotonic.return_value = 105
+        self.assertIsNone(local.get("key"))
+        self.assertEqual(len(local), 0)
+
+    def test_set_with_non_positive_timeout_do_nothing(self):
+        local = LocalCache(max_size=10)
+        local.set("key", "value", 0)
+
+        self.assertIsNone(local.get("key"))
+
+    def test_bump_generation_clear_the_local_caches(self):
+        local = LocalCache(max_size=10, generation_check_interval=0)
+        local.set("key", "value", 10)
+        self.assertEqual(local.get("key"), "value")
+
+        bump_local_cache_generation()
+
+        self.assertIsNone(local.get("key"))
+
+    def test_bump_generation_when_the_generation_key_is_evicted(self):
+        local = LocalCache(max_size=10, generation_check_interval=0)
+        local.set("key", "value", 10)
+
+        def evict_and_incr(key, delta=1, version=None):
+            cache.delete(key)
+            raise ValueError(f"Key '{key}' not found")
+
+        with patch.object(caches["default"], "incr", side_effect=evict_and_incr):
+            bump_local_cache_generation()
+
+        self.assertEqual(cache.get(GENERATION_KEY), 1)
+        self.assertIsNone(local.get("key"))
+
+
+@override_settings(URL_SHORTENER_USE_CACHE=True, URL_SHORTENER_USE_LOCAL_CACHE=True)
+class TestRedirectLocalCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_redirect_view_serve_hot_tokens_from_the_local_cache(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        self.client.get(get_redirect_url(url.token))
+
+        with patch("urls.api.views.redirect_cache.get") as mock_cache_get:
+            with self.assertNumQueries(0):
+                response = self.client.get(get_redirect_url(url.token))
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response["location"], url.url)
+        mock_cache_get.assert_not_called()
+        self.assertEqual(local_cache.hits, 1)
+
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_redirect_view_fill_the_local_cache_from_the_shared_cache(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        self.client.get(get_redirect_url(url.token))
+        local_cache.delete(url.token)
+
+        with self.assertNumQueries(0):
+            self.client.get(get_redirect_url(url.token))
+        self.assertIsNotNone(local_cache.get(url.token))
+
+    def test_claimed_pool_token_keep_the_local_caches_of_the_other_processes(self):
+        other_local_cache = LocalCache(max_size=10, generation_check_interval=0)
+        other_local_cache.set("key", "value", 10)
+        URL.objects.bulk_create_ready_to_set_tokens(1)
+
+        url = URL.objects.create(url="https://example.com")
+
+        self.assertEqual(url.token, URL.objects.get().token)
+        self.assertEqual(other_local_cache.get("key"), "value")
+        url.save()
+        self.assertIsNone(other_local_cache.get("key"))
+
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_deleted_url_is_removed_from_the_local_cache(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        self.client.get(get_redirect_url(url.token))
+        self.assertIsNotNone(local_cache.get(url.token))
+
+        url.delete()
+
+        self.assertIsNone(local_cache.get(url.token))
+        response = self.client.get(get_redirect_url(url.token))
+        self.assertEqual(response["location"], settings.URL_SHORTENER_404_PAGE)
+
+
+@override_settings(URL_SHORTENER_USE_CACHE=True, URL_SHORTENER_NEGATIVE_CACHE_TTL=30)
+class TestRedirectNegativeCache(TestCase):
+    token = "aBcDe"
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_redirect_to(self, location):
+        response = self.client.get(get_redirect_url(self.token))
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response["location"], location)
+
+    def test_repeated_misses_cost_one_query_per_ttl(self):
+        with self.assertNumQueries(1):
+            for _ in range(5):
+                self.assert_redirect_to(settings.URL_SHORTENER_404_PAGE)
+
+        with patch("django.core.cache.backends.locmem.time.time", return_value=time() + 31):
+            with self.assertNumQueries(1):
+                for _ in range(5):
+                    self.assert_redirect_to(settings.URL_SHORTENER_404_PAGE)
+
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_created_token_invalidate_the_cached_miss(self, mock_log_the_url_usages):
+        self.assert_redirect_to(settings.URL_SHORTENER_404_PAGE)
+
+        URL.objects.create(url="https://example.com", token=self.token)
+
+        self.assert_redirect_to("https://example.com")
+
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_claimed_ready_to_set_token_invalidate_the_cached_miss(self, mock_log_the_url_usages):
+        with patch("urls.models.URL._create_random_string", return_value=self.token):
+            URL.objects.create_ready_to_set_token()
+        self.assert_redirect_to(settings.URL_SHORTENER_404_PAGE)
+
+        URL.objects.create(url="https://example.com")
+
+        self.assert_redirect_to("https://example.com")
+
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_bulk_created_token_invalidate_the_cached_miss(self, mock_log_the_url_usages):
+        self.assert_redirect_to(settings.URL_SHORTENER_404_PAGE)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            URL.objects.bulk_create_urls([{"url": "https://example.com", "token": self.token}])
+
+        self.assert_redirect_to("https://example.com")
+
+    @override_settings(URL_SHORTENER_NEGATIVE_CACHE_TTL=0)
+    def test_negative_cache_ttl_zero_disable_the_negative_cache(self):
+        with self.assertNumQueries(2):
+            self.assert_redirect_to(settings.URL_SHORTENER_404_PAGE)
+            self.assert_redirect_to(settings.URL_SHORTENER_404_PAGE)
+
+
+class TestSingleFlight(TestCase):
+    def test_concurrent_calls_of_the_same_key_share_one_call(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def load():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return "value"
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            leader = executor.submit(single_flight.do, "key", load)
+            started.wait()
+            followers = [executor.submit(single_flight.do, "key", load) for _ in range(4)]
+            # Let the followers reach the wait
+            sleep(0.05)
+            self.assertTrue(single_flight.is_running("key"))
+            release.set()
+            results = [leader.result()] + [follower.result() for follower in followers]
+
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(single_flight.is_running("key"))
+
+    def test_followers_receive_the_error_of_the_call(self):
+        single_flight = SingleFlight()
+
+        with self.assertRaises(ValueError):
+            single_flight.do("key", int, "not a number")
+        self.assertFalse(single_flight.is_running("key"))
+
+
+@override_settings(URL_SHORTENER_USE_CACHE=True)
+class TestRedirectCoalescedMisses(TransactionTestCase):
+    parallel_requests = 16
+
+    def setUp(self):
+        cache.clear()
+
+    def redirect(self, token, url_queries):
+        def count_url_queries(execute, sql, params, many, context):
+            if 'FROM "urls_url"' in sql:
+                url_queries.append(sql)
+            # Keep the query in flight long enough for the other requests to miss too
+            sleep(0.05)
+            return execute(sql, params, many, context)
+
+        try:
+            with connection.execute_wrapper(count_url_queries):
+                return RedirectAPIView().redirect(token)
+        finally:
+            connection.close()
+
+    def redirect_in_parallel(self, token):
+        url_queries = []
+        with ThreadPoolExecutor(max_workers=self.parallel_requests) as executor:
+            responses = list(executor.map(lambda _: self.redirect(token, url_queries), range(self.parallel_requests)))
+        return responses, url_queries
+
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_parallel_misses_of_one_token_run_one_query(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        cache.clear()
+
+        responses, url_queries = self.redirect_in_parallel(url.token)
+
+        self.assertEqual({response["location"] for response in responses}, {"https://example.com"})
+        self.assertEqual(len(url_queries), 1)
+        self.assertEqual(mock_log_the_url_usages.call_count, self.parallel_requests)
+
+    def test_parallel_misses_of_unknown_token_run_one_query(self):
+        responses, url_queries = self.redirect_in_parallel("aBcDe")
+
+        self.assertEqual({response["location"] for response in responses}, {settings.URL_SHORTENER_404_PAGE})
+        self.assertEqual(len(url_queries), 1)
+
+
+@override_settings(URL_SHORTENER_USE_CACHE=True)
+@patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+class TestRedirectCacheRefresh(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(URL_SHORTENER_USE_CACHE_LOCK=True, URL_SHORTENER_CACHE_LOCK_WAIT=1)
+    def test_miss_wait_for_the_process_that_holds_the_fill_lock(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        cache.clear()
+        cache.add(FILL_LOCK_KEY_PREFIX + url.token, 1)
+        threading.Timer(0.1, redirect_cache.set, (url.token, build_redirect_entry(url.url, url.pk, 60), 60)).start()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(get_redirect_url(url.token))
+
+        self.assertEqual(response["location"], "https://example.com")
+
+    @override_settings(URL_SHORTENER_USE_CACHE_LOCK=True, URL_SHORTENER_CACHE_LOCK_WAIT=0.05)
+    def test_miss_query_the_database_when_the_lock_holder_is_too_slow(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        cache.clear()
+        cache.add(FILL_LOCK_KEY_PREFIX + url.token, 1)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(get_redirect_url(url.token))
+
+        self.assertEqual(response["location"], "https://example.com")
+
+    @override_settings(URL_SHORTENER_CACHE_REFRESH_INTERVAL=60)
+    def test_entry_is_refreshed_after_the_refresh_interval(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        self.client.get(get_redirect_url(url.token))
+        URL.objects.filter(pk=url.pk).update(url="https://example.org")
+
+        self.assertEqual(self.client.get(get_redirect_url(url.token))["location"], "https://example.com")
+        with patch("urls.cache.time", return_value=time() + 61):
+            response = self.client.get(get_redirect_url(url.token))
+
+        self.assertEqual(response["location"], "https://example.org")
+        self.assertEqual(redirect_cache.get(url.token)["redirect_url"], "https://example.org")
+
+    @override_settings(URL_SHORTENER_CACHE_REFRESH_INTERVAL=60, URL_SHORTENER_USE_CACHE_LOCK=True)
+    def test_stale_entry_is_served_while_another_process_refresh_it(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        self.client.get(get_redirect_url(url.token))
+        cache.add(FILL_LOCK_KEY_PREFIX + url.token, 1)
+
+        with patch("urls.cache.time", return_value=time() + 61):
+            with self.assertNumQueries(0):
+                response = self.client.get(get_redirect_url(url.token))
+
+        self.assertEqual(response["location"], "https://example.com")
+
+    @override_settings(URL_SHORTENER_CACHE_REFRESH_INTERVAL=60, URL_SHORTENER_CACHE_EARLY_REFRESH_BETA=1)
+    def test_slow_entries_are_refreshed_earlier(self, mock_log_the_url_usages):
+        entry = build_redirect_entry("https://example.com", 1, 3600, compute_seconds=10)
+
+        with patch("urls.cache.time", return_value=entry["refresh_at"] - 5):
+            # Refreshed 5 seconds early when 10 * -log(1 - random()) >= 5
+            with patch("urls.cache.random", return_value=0.7):
+                self.assertTrue(should_refresh_early(entry))
+            with patch("urls.cache.random", return_value=0.1):
+                self.assertFalse(should_refresh_early(entry))
+
+
+class TestRedirectEntryPacking(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_packed_entry_unpack_to_the_same_entry(self):
+        entry = build_redirect_entry("https://example.com/é", 12, 60)
+
+        packed_entry = pack_redirect_entry(entry)
+
+        self.assertEqual(len(packed_entry), ENTRY_HEADER.size + len("https://example.com/é".encode()))
+        self.assertEqual(unpack_redirect_entry(packed_entry), {**entry, "expires_at": int(entry["expires_at"])})
+
+    @override_settings(URL_SHORTENER_CACHE_REFRESH_INTERVAL=30)
+    def test_packed_entry_keep_the_refresh_fields(self):
+        entry = build_redirect_entry("https://example.com", 12, 60, compute_seconds=0.5)
+
+        unpacked_entry = unpack_redirect_entry(pack_redirect_entry(entry))
+
+        self.assertEqual(unpacked_entry["refresh_at"], int(entry["refresh_at"]))
+        self.assertEqual(unpacked_entry["compute_seconds"], 0.5)
+        self.assertEqual(unpacked_entry["redirect_url"], "https://example.com")
+
+    def test_not_found_and_unknown_values_are_unpacked(self):
+        self.assertEqual(unpack_redirect_entry(pack_redirect_entry(NOT_FOUND)), NOT_FOUND)
+        self.assertIsNone(unpack_redirect_entry(None))
+        self.assertIsNone(unpack_redirect_entry({"redirect_url": "https://example.com", "url_pk": 1}))
+        self.assertIsNone(unpack_redirect_entry(b"\x09" + bytes(ENTRY_HEADER.size)))
+
+    @override_settings(URL_SHORTENER_CACHE_KEY_PREFIX="redirect:", URL_SHORTENER_CACHE_KEY_VERSION=3)
+    def test_entries_are_stored_under_the_prefixed_and_versioned_key(self):
+        redirect_cache.set("aaaaa", build_redirect_entry("https://example.com", 1, 60), 60)
+
+        self.assertIsNone(cache.get("aaaaa"))
+        self.assertIsInstance(cache.get("redirect:aaaaa", version=3), bytes)
+        self.assertEqual(redirect_cache.get("aaaaa")["redirect_url"], "https://example.com")
+        with override_settings(URL_SHORTENER_CACHE_KEY_VERSION=4):
+            self.assertIsNone(redirect_cache.get("aaaaa"))
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "default"},
+            "redirects": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "redirects"},
+        },
+        URL_SHORTENER_CACHE_ALIAS="redirects",
+    )
+    def test_entries_are_stored_in_the_cache_of_the_alias(self):
+        redirect_cache.set_many({"aaaaa": build_redirect_entry("https://example.com", 1, 60), "bbbbb": NOT_FOUND}, 60)
+
+        self.assertEqual(caches["default"].get_many([redirect_cache.make_key("aaaaa")], version=1), {})
+        self.assertEqual(
+            redirect_cache.get_many(["aaaaa", "bbbbb", "ccccc"]),
+            {"aaaaa": unpack_redirect_entry(caches["redirects"].get(redirect_cache.make_key("aaaaa"))), "bbbbb": NOT_FOUND},
+        )
+        redirect_cache.delete_many(["aaaaa", "bbbbb"])
+        self.assertEqual(redirect_cache.get_many(["aaaaa", "bbbbb"]), {})
+
+
+@override_settings(URL_SHORTENER_USE_CACHE=True, URL_SHORTENER_USE_CACHE_WRITE_THROUGH=True)
+@patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+class TestWriteThroughCache(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def assert_cached(self, url):
+        entry = redirect_cache.get(url.token)
+        self.assertEqual(entry["redirect_url"], url.url)
+        self.assertEqual(entry["url_pk"], url.pk)
+        self.assertAlmostEqual(entry["expires_at"], url.expiration_date.timestamp(), delta=2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(get_redirect_url(url.token))["location"], url.url)
+
+    def test_created_url_is_cached_when_its_transaction_commits(self, mock_log_the_url_usages):
+        with transaction.atomic():
+            url = URL.objects.create(url="https://example.com", expiration_date=now() + timedelta(hours=1))
+            self.assertIsNone(redirect_cache.get(url.token))
+
+        self.assert_cached(url)
+
+    def test_created_url_is_not_cached_when_its_transaction_is_rolled_back(self, mock_log_the_url_usages):
+        token = "aBcDe"
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            URL.objects.create(url="https://example.com", token=token)
+            raise RuntimeError
+
+        self.assertIsNone(redirect_cache.get(token))
+        self.assertEqual(self.client.get(get_redirect_url(token))["location"], settings.URL_SHORTENER_404_PAGE)
+
+    def test_rolled_back_savepoint_does_not_cache_its_url(self, mock_log_the_url_usages):
+        with transaction.atomic():
+            committed_url = URL.objects.create(url="https://example.com")
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                rolled_back_url = URL.objects.create(url="https://example.org", token="aBcDe")
+                raise RuntimeError
+
+        self.assert_cached(committed_url)
+        self.assertIsNone(redirect_cache.get(rolled_back_url.token))
+
+    def test_claimed_ready_to_set_token_replace_the_cached_miss(self, mock_log_the_url_usages):
+        ready_to_set_url = URL.objects.create_ready_to_set_token()
+        self.client.get(get_redirect_url(ready_to_set_url.token))
+        self.assertEqual(redirect_cache.get(ready_to_set_url.token), NOT_FOUND)
+
+        url = URL.objects.create(url="https://example.com")
+
+        self.assertEqual(url.token, ready_to_set_url.token)
+        self.assert_cached(url)
+
+    def test_admin_created_url_is_cached(self, mock_log_the_url_usages):
+        self.client.force_login(get_user_model().objects.create_superuser(username="admin", password="password"))
+        expiration_date = now() + timedelta(days=1)
+
+        self.client.post(reverse("admin:urls_url_add"), {
+            "url": "https://example.com",
+            "token": "aBcDe",
+            "expiration_date_0": expiration_date.strftime("%Y-%m-%d"),
+            "expiration_date_1": expiration_date.strftime("%H:%M:%S"),
+        })
+        self.client.logout()
+
+        self.assert_cached(URL.objects.get(token="aBcDe"))
+
+    def test_bulk_created_urls_are_cached(self, mock_log_the_url_usages):
+        URL.objects.bulk_create_ready_to_set_tokens(1)
+
+        urls = URL.objects.bulk_create_urls([{"url": "https://example.com"}, {"url": "https://example.org", "token": "aBcDe"}])
+
+        for url in urls:
+            self.assertEqual(redirect_cache.get(url.token)["redirect_url"], url.url)
+
+    def test_updated_url_is_only_deleted_from_the_cache(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        self.assert_cached(url)
+
+        url.url = "https://example.org"
+        url.save()
+
+        self.assertIsNone(redirect_cache.get(url.token))
+        self.assertEqual(self.client.get(get_redirect_url(url.token))["location"], "https://example.org")
+
+    def test_expired_and_ready_to_set_urls_are_not_cached(self, mock_log_the_url_usages):
+        expired_url = URL.objects.create(url="https://example.com", expiration_date=now() - timedelta(days=1))
+        ready_to_set_url = URL.objects.create_ready_to_set_token()
+
+        self.assertIsNone(redirect_cache.get(expired_url.token))
+        self.assertIsNone(redirect_cache.get(ready_to_set_url.token))
+
+    @override_settings(URL_SHORTENER_USE_CACHE_WRITE_THROUGH=False)
+    def test_created_url_is_not_cached_without_write_through(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+
+        self.assertIsNone(redirect_cache.get(url.token))
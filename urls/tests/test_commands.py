@@ -0,0 +1,91 @@
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.timezone import now
+
+from urls.models import URL, UrlUsage
+
+
+class TestDumpAndLoadUrlsCommand(TestCase):
+    def setUp(self):
+        self.url = URL.objects.create(url="https://example.com", name="example", expiration_date=now() + timedelta(days=3))
+        self.other_url = URL.objects.create(url="https://example2.com", description="description")
+        self.usage_created_at = now() - timedelta(days=1)
+        UrlUsage.objects.bulk_create([
+            UrlUsage(url=self.url, created_at=self.usage_created_at, is_counted=True) for _ in range(5)
+        ])
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def dump_and_load(self, model, format):
+        path = os.path.join(self.directory, f"{model}.{format}")
+        stderr = StringIO()
+        call_command("dump_urls", path, model=model, format=format, chunk_size=2, stderr=stderr)
+        self.assertIn("Exported", stderr.getvalue())
+        return path
+
+    def load(self, path, model, format):
+        stderr = StringIO()
+        call_command("load_urls", path, model=model, format=format, chunk_size=2, stderr=stderr)
+        self.assertIn("Imported", stderr.getvalue())
+
+    def assert_dump_and_load_restore_the_rows(self, format):
+        urls = list(URL.objects.order_by("pk").values_list("pk", "name", "url", "token", "expiration_date", "description"))
+        usages = list(UrlUsage.objects.order_by("pk").values_list("pk", "url_id", "created_at", "is_counted"))
+        url_path = self.dump_and_load("url", format)
+        usage_path = self.dump_and_load("usage", format)
+        URL.objects.all().delete()
+
+        self.load(url_path, "url", format)
+        self.load(usage_path, "usage", format)
+
+        self.assertEqual(list(URL.objects.order_by("pk").values_list("pk", "name", "url", "token", "expiration_date", "description")), urls)
+        self.assertEqual(list(UrlUsage.objects.order_by("pk").values_list("pk", "url_id", "created_at", "is_counted")), usages)
+
+    def test_dump_and_load_urls_with_csv_format(self):
+        self.assert_dump_and_load_restore_the_rows("csv")
+
+    def test_dump_and_load_urls_with_jsonl_format(self):
+        self.assert_dump_and_load_restore_the_rows("jsonl")
+
+    def test_dump_urls_stream_the_rows_in_chunks(self):
+        path = os.path.join(self.directory, "url.jsonl")
+        stderr = StringIO()
+
+        with self.assertNumQueries(1):
+            call_command("dump_urls", path, model="usage", chunk_size=2, stderr=stderr)
+
+        self.assertEqual(stderr.getvalue().count("Exported"), 4)
+
+    def test_load_urls_with_ignore_conflicts_skip_existing_rows(self):
+        path = self.dump_and_load("url", "jsonl")
+
+        call_command("load_urls", path, model="url", ignore_conflicts=True, stderr=StringIO())
+
+        self.assertEqual(URL.objects.count(), 2)
+
+
+class TestWarmRedirectCacheCommand(TestCase):
+    @patch("urls.management.commands.warm_redirect_cache.warm_redirect_cache")
+    def test_warm_redirect_cache_command_run_the_task(self, mock_task):
+        mock_task.return_value = 3
+        stdout = StringIO()
+
+        call_command("warm_redirect_cache", limit=5, stdout=stdout)
+
+        mock_task.assert_called_once_with(5)
+        self.assertIn("Cached 3 tokens.", stdout.getvalue())
+
+    @patch("urls.management.commands.warm_redirect_cache.warm_redirect_cache")
+    def test_warm_redirect_cache_command_with_async_send_the_task(self, mock_task):
+        call_command("warm_redirect_cache", limit=5, run_async=True, stdout=StringIO())
+
+        mock_task.delay.assert_called_once_with(5)
+        mock_task.assert_not_called()
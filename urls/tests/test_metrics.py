@@ -0,0 +1,162 @@
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.utils import override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from urls import metrics
+from urls.models import URL
+from urls.tasks import create_ready_to_set_token_periodically
+
+
+def get_redirect_url(token):
+    return reverse("urls:redirect", kwargs={"token": token})
+
+
+@override_settings(URL_SHORTENER_USE_METRICS=True)
+class TestMetrics(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+
+    def test_histogram_render_cumulative_buckets(self):
+        histogram = metrics.Histogram("test_seconds", "Test histogram.", ["view"], buckets=(0.1, 1))
+        histogram.observe(0.05, view="a")
+        histogram.observe(0.5, view="a")
+        histogram.observe(5, view="a")
+
+        rendered = histogram.render({"view": "a"}, histogram.get(view="a"))
+
+        self.assertEqual(rendered, [
+            'test_seconds_bucket{view="a",le="0.1"} 1',
+            'test_seconds_bucket{view="a",le="1"} 2',
+            'test_seconds_bucket{view="a",le="+Inf"} 3',
+            'test_seconds_sum{view="a"} 5.55',
+            'test_seconds_count{view="a"} 3',
+        ])
+        del metrics.registry.metrics["test_seconds"]
+
+    @override_settings(URL_SHORTENER_USE_METRICS=False)
+    def test_metrics_are_not_collected_when_disabled(self):
+        metrics.redirect_requests.inc(result="found")
+
+        self.assertIsNone(metrics.redirect_requests.get(result="found"))
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True)
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_redirect_count_results_cache_lookups_and_latencies(self, mock_log_the_url_usages):
+        cache.clear()
+        url = URL.objects.create(url="https://example.com")
+
+        self.client.get(get_redirect_url(url.token))
+        self.client.get(get_redirect_url(url.token))
+        self.client.get(get_redirect_url("aBcDe"))
+
+        self.assertEqual(metrics.redirect_requests.get(result="found"), 2)
+        self.assertEqual(metrics.redirect_requests.get(result="not_found"), 1)
+        self.assertEqual(metrics.redirect_cache_lookups.get(result="hit"), 1)
+        self.assertEqual(metrics.redirect_cache_lookups.get(result="miss"), 2)
+        self.assertEqual(metrics.redirect_seconds.get()[-1], 3)
+        self.assertEqual(metrics.redirect_lookup_seconds.get()[-1], 2)
+
+    def test_pool_task_observe_its_run_time_and_created_tokens(self):
+        create_ready_to_set_token_periodically()
+
+        self.assertEqual(metrics.task_seconds.get(task="create_ready_to_set_token_periodically")[-1], 1)
+        self.assertEqual(metrics.pool_tokens_created.get(), settings.URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT)
+
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_metrics_view_render_the_prometheus_text_format(self, mock_log_the_url_usages):
+        self.client.get(get_redirect_url("aBcDe"))
+
+        response = self.client.get(reverse("urls:metrics"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        content = response.content.decode()
+        self.assertIn("# TYPE url_shortener_redirect_requests_total counter", content)
+        self.assertIn('url_shortener_redirect_requests_total{result="not_found"} 1', content)
+        self.assertIn('url_shortener_redirect_seconds_bucket{le="+Inf"} 1', content)
+
+    @override_settings(URL_SHORTENER_USE_METRICS=False)
+    def test_metrics_view_is_not_found_when_disabled(self):
+        response = self.client.get(reverse("urls:metrics"))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_collect_add_up_the_snapshots_of_the_other_processes(self):
+        with TemporaryDirectory() as directory, override_settings(URL_SHORTENER_METRICS_MULTIPROCESS_DIR=directory):
+            metrics.redirect_requests.inc(result="found")
+            metrics.redirect_seconds.observe(0.01)
+            other_process_snapshot = {
+                "url_shortener_redirect_requests_total": [[["found"], 2], [["not_found"], 1]],
+                "url_shortener_redirect_seconds": [[[], metrics.redirect_seconds.get()]],
+            }
+            with open(os.path.join(directory, "metrics_1.json"), "w") as snapshot_file:
+                json.dump(other_process_snapshot, snapshot_file)
+
+            values = metrics.registry.collect()
+            self.assertTrue(os.path.exists(metrics.registry.get_snapshot_path()))
+
+        self.assertEqual(values["url_shortener_redirect_requests_total"], {("found",): 3, ("not_found",): 1})
+        self.assertEqual(values["url_shortener_redirect_seconds"][()][-1], 2)
+
+    def test_collect_keep_the_most_recent_gauge_value_of_all_processes(self):
+        with TemporaryDirectory() as directory, override_settings(URL_SHORTENER_METRICS_MULTIPROCESS_DIR=directory):
+            metrics.pool_depth.set(7)
+            set_at = metrics.pool_depth.snapshot()[0][1][1]
+            for pid, (depth, age) in enumerate([(3, -10), (5, 10)], start=1):
+                with open(os.path.join(directory, f"metrics_{pid}.json"), "w") as snapshot_file:
+                    json.dump({"url_shortener_pool_depth": [[[], [depth, set_at + age]]]}, snapshot_file)
+
+            values = metrics.registry.collect()
+            rendered = metrics.registry.render()
+
+        self.assertEqual(values["url_shortener_pool_depth"][()][0], 5)
+        self.assertIn("# TYPE url_shortener_pool_depth gauge", rendered)
+        self.assertIn("url_shortener_pool_depth 5", rendered)
+
+    def write_other_process_snapshot(self, directory, pid, snapshot):
+        with open(os.path.join(directory, f"metrics_{pid}.json"), "w") as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+
+    @patch("urls.metrics.is_process_alive", side_effect=lambda pid: pid != 2)
+    def test_collect_keep_the_values_of_exited_processes_in_a_single_file(self, mock_is_process_alive):
+        with TemporaryDirectory() as directory, override_settings(URL_SHORTENER_METRICS_MULTIPROCESS_DIR=directory):
+            metrics.redirect_requests.inc(result="found")
+            self.write_other_process_snapshot(directory, 1, {"url_shortener_redirect_requests_total": [[["found"], 2]]})
+            self.write_other_process_snapshot(directory, 2, {"url_shortener_redirect_requests_total": [[["found"], 4]]})
+
+            values = metrics.registry.collect()
+            self.assertFalse(os.path.exists(os.path.join(directory, "metrics_2.json")))
+            self.assertTrue(os.path.exists(os.path.join(directory, "exited_metrics.json")))
+            self.assertEqual(metrics.registry.collect(), values)
+
+        self.assertEqual(values["url_shortener_redirect_requests_total"], {("found",): 7})
+
+    def test_exit_snapshot_move_the_values_to_the_exited_processes(self):
+        with TemporaryDirectory() as directory, override_settings(URL_SHORTENER_METRICS_MULTIPROCESS_DIR=directory):
+            metrics.redirect_requests.inc(result="found")
+
+            metrics.registry.write_exit_snapshot()
+
+            self.assertFalse(os.path.exists(metrics.registry.get_snapshot_path()))
+            with open(metrics.registry.get_exited_snapshot_path()) as snapshot_file:
+                exited_snapshot = json.load(snapshot_file)
+            self.assertEqual(exited_snapshot["url_shortener_redirect_requests_total"], [[["found"], 1]])
+
+    def test_reused_pid_does_not_overwrite_the_file_of_the_exited_process(self):
+        with TemporaryDirectory() as directory, override_settings(URL_SHORTENER_METRICS_MULTIPROCESS_DIR=directory):
+            self.write_other_process_snapshot(directory, os.getpid(), {"url_shortener_redirect_requests_total": [[["found"], 5]]})
+            metrics.registry._written_by = None
+
+            metrics.redirect_requests.inc(result="found")
+            metrics.registry.write_snapshot()
+            values = metrics.registry.collect()
+
+        self.assertEqual(values["url_shortener_redirect_requests_total"], {("found",): 6})
@@ -0,0 +1,54 @@
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import override_settings
+from rest_framework import status
+from rest_framework.reverse import reverse
+
+from urls.api.views import RedirectAPIView, RedirectView
+from urls.models import URL
+
+
+def get_redirect_url(token):
+    return reverse("urls:redirect", kwargs={"token": token})
+
+
+@override_settings(URL_SHORTENER_USE_REDIRECT_FAST_PATH=True)
+@patch.object(RedirectView, "log_the_url_usages")
+class TestRedirectFastPathMiddleware(TestCase):
+    @patch.object(RedirectAPIView, "dispatch")
+    def test_redirect_skip_drf_and_the_session(self, mock_dispatch, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+
+        response = self.client.get(get_redirect_url(url.token))
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(response.url, "https://example.com")
+        self.assertNotIn("Vary", response)
+        mock_dispatch.assert_not_called()
+        mock_log_the_url_usages.assert_called_once_with(url.pk)
+
+    def test_redirect_with_unknown_token_redirect_to_404_page(self, mock_log_the_url_usages):
+        token = "a" * settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH
+
+        response = self.client.get(get_redirect_url(token))
+
+        self.assertEqual(response.url, settings.URL_SHORTENER_404_PAGE)
+        mock_log_the_url_usages.assert_not_called()
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True)
+    def test_redirect_with_cached_url_do_not_query_the_database(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+        self.client.get(get_redirect_url(url.token))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(get_redirect_url(url.token))
+        self.assertEqual(response.url, "https://example.com")
+
+    def test_other_routes_and_methods_go_through_the_stack(self, mock_log_the_url_usages):
+        url = URL.objects.create(url="https://example.com")
+
+        self.assertEqual(self.client.post(get_redirect_url(url.token)).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(self.client.get(reverse("urls:bulk-create")).status_code, status.HTTP_403_FORBIDDEN)
+        mock_log_the_url_usages.assert_not_called()
@@ -1,8 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
+from time import sleep
 from unittest.mock import patch
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection
+from django.test import TransactionTestCase
 from django.utils.timezone import now
 
 from utils.tests import CustomTestCase
@@ -190,3 +194,158 @@ class TestUrlModel(CustomTestCase):
             created_url = URL.objects.get_or_create_ready_to_set_token()
 
         self.assertEqual(url, created_url)
+
+    def test_bulk_create_ready_to_set_tokens_success(self):
+        with self.assertNumQueries(2):
+            """
+                1- Check the created tokens are not active
+                2- Insert all ready_to_set_token objects
+            """
+            urls = URL.objects.bulk_create_ready_to_set_tokens(25)
+
+        tokens = [url.token for url in urls]
+        self.assertEqual(len(set(tokens)), 25)
+        self.assertEqual(URL.objects.all_ready_to_set_token().filter(token__in=tokens).count(), 25)
+
+    def test_create_tokens_skip_active_tokens(self):
+        active_url = URL.objects.create(url='https://example.com')
+        candidates = iter([active_url.token, active_url.token, "aBcDe"])
+
+        with patch("urls.models.URL._create_random_string", side_effect=lambda: next(candidates)):
+            with self.assertNumQueries(3):
+                tokens = URL.create_tokens(1)
+
+        self.assertEqual(tokens, ["aBcDe"])
+
+    def test_create_tokens_with_only_active_tokens_raise_maximum_recursion(self):
+        active_url = URL.objects.create(url='https://example.com')
+
+        with patch("urls.models.URL._create_random_string", return_value=active_url.token):
+            with self.assertNumQueries(settings.URL_SHORTENER_MAXIMUM_RECURSION_DEPTH):
+                with self.assertRaisesMessage(Exception, "Maximum recursion depth occurred."):
+                    URL.create_tokens(3)
+
+    def test_claim_ready_to_set_token_with_given_token_success(self):
+        URL.objects.bulk_create_ready_to_set_tokens(3)
+        ready_to_set_url_obj = URL.objects.all_ready_to_set_token().last()
+
+        url = URL.objects.claim_ready_to_set_token("https://example.com", token=ready_to_set_url_obj.token, name="test")
+
+        self.assertEqual(url.pk, ready_to_set_url_obj.pk)
+        self.assertEqual(url.name, "test")
+        self.assertEqual(URL.objects.all_ready_to_set_token().count(), 2)
+
+    def test_claim_already_claimed_ready_to_set_token_return_none(self):
+        ready_to_set_url_obj = URL.objects.create_ready_to_set_token()
+        URL.objects.claim_ready_to_set_token("https://example.com")
+
+        with self.assertNumQueries(1):
+            url = URL.objects.claim_ready_to_set_token("https://example2.com", token=ready_to_set_url_obj.token)
+
+        self.assertIsNone(url)
+        ready_to_set_url_obj.refresh_from_db()
+        self.assertEqual(ready_to_set_url_obj.url, "https://example.com")
+
+    def test_bulk_create_urls_success(self):
+        URL.objects.bulk_create_ready_to_set_tokens(2)
+        suggested_token = URL.create_token()
+        items = [
+            {"url": "https://example.com/1"},
+            {"url": "https://example.com/2", "name": "second"},
+            {"url": "https://example.com/3", "token": suggested_token},
+            {"url": "https://example.com/4", "expiration_date": now() + timedelta(days=2)},
+        ]
+
+        results = URL.objects.bulk_create_urls(items)
+
+        self.assertEqual([url.url for url in results], [item["url"] for item in items])
+        self.assertEqual(len({url.token for url in results}), 4)
+        self.assertEqual(results[1].name, "second")
+        self.assertEqual(results[2].token, suggested_token)
+        self.assertFalse(URL.objects.all_ready_to_set_token().exists())
+        self.assertEqual(URL.objects.exclude_ready_to_set_urls().all_actives().count(), 4)
+        self.assertEqual(URL.objects.get(token=results[3].token).expiration_date.day, (now() + timedelta(days=2)).day)
+
+    def test_bulk_create_urls_return_the_error_of_invalid_items(self):
+        active_url = URL.objects.create(url="https://example.com", name="taken")
+        items = [
+            {"url": "http://example.com"},
+            {"url": settings.URL_SHORTENER_READY_TO_SET_TOKEN_URL},
+            {"url": "https://example.com/1", "token": active_url.token},
+            {"url": "https://example.com/2", "name": "taken"},
+            {"url": "https://example.com/3", "token": "aBcDe"},
+            {"url": "https://example.com/4", "token": "aBcDe"},
+            {"url": "https://example.com/5"},
+        ]
+
+        results = URL.objects.bulk_create_urls(items)
+
+        self.assertEqual(results[0].message_dict, {"url": ["The URL should start with https://"]})
+        self.assertEqual(results[1].message_dict, {"url": ["You can not use ready_to_set_token_url"]})
+        self.assertEqual(results[2].message_dict, {"token": ["This token is already active."]})
+        self.assertEqual(results[3].message_dict, {"name": ["Url with this Name already exists."]})
+        self.assertEqual(results[4].token, "aBcDe")
+        self.assertEqual(results[5].message_dict, {"token": ["This token is already active."]})
+        self.assertEqual(results[6].url, "https://example.com/5")
+        self.assertEqual(URL.objects.count(), 3)
+
+    def test_bulk_create_urls_number_of_queries_does_not_depend_on_number_of_items(self):
+        for count in (10, 100):
+            URL.objects.bulk_create_ready_to_set_tokens(count // 2)
+            items = [
+                {"url": f"https://example.com/{count}/{i}", "name": f"{count}-{i}", "token": f"{count:03d}{i:02d}"}
+                if i % 5 == 0 else {"url": f"https://example.com/{count}/{i}"}
+                for i in range(count)
+            ]
+            with self.assertMaximumNumQueries(8):
+                """
+                    1- Check the suggested tokens are not active
+                    2- Check the names are not used
+                    3- Savepoint
+                    4- Select the ready_to_set_token objects
+                    5- Update the claimed ready_to_set_token objects
+                    6- Check the created tokens are not active
+                    7- Insert the other url objects
+                    8- Release savepoint
+                """
+                results = URL.objects.bulk_create_urls(items)
+            self.assertFalse(any(isinstance(result, ValidationError) for result in results))
+
+
+class TestClaimReadyToSetTokenConcurrently(TransactionTestCase):
+    pool_size = 40
+    workers = 8
+
+    def claim(self, worker):
+        claimed = []
+        unclaimed_count = 0
+        try:
+            for i in range(self.pool_size // self.workers):
+                while True:
+                    try:
+                        url = URL.objects.claim_ready_to_set_token(f"https://example.com/{worker}/{i}")
+                        break
+                    except OperationalError:
+                        # The in-memory test database of SQLite rejects concurrent writers instead of waiting for them
+                        sleep(0.001)
+                if url is None:
+                    # Lost the race for MAXIMUM_RECURSION_DEPTH rows in a row, the caller falls back to a new token
+                    unclaimed_count += 1
+                else:
+                    claimed.append((url.pk, url.url))
+        finally:
+            connection.close()
+        return claimed, unclaimed_count
+
+    def test_concurrent_claims_never_claim_the_same_token(self):
+        URL.objects.bulk_create_ready_to_set_tokens(self.pool_size)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.claim, range(self.workers)))
+        claimed = [item for items, _ in results for item in items]
+        unclaimed_count = sum(count for _, count in results)
+
+        self.assertEqual(len({pk for pk, _ in claimed}), len(claimed))
+        self.assertEqual(len(claimed) + unclaimed_count, self.pool_size)
+        self.assertEqual(URL.objects.all_ready_to_set_token().count(), unclaimed_count)
+        self.assertEqual(set(URL.objects.exclude_ready_to_set_urls().values_list("pk", "url")), set(claimed))
@@ -0,0 +1,169 @@
+from datetime import datetime, timedelta, timezone
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from urls.models import URL, UrlUsage, UrlUsageCounter
+from urls.partitions import (
+    DEFAULT_PARTITION,
+    add_months,
+    create_usage_partitions,
+    drop_expired_usage_partitions,
+    get_month_start,
+    get_partition_end,
+    get_partition_name,
+    get_partition_names,
+    is_usage_table_partitioned,
+    partition_usage_table,
+    rotate_usage_table,
+)
+from urls.tasks import compact_url_usages, maintain_url_usage_partitions, reap_expired_urls
+
+
+class TestPartitionNames(TestCase):
+    def test_partition_of_december_end_in_january(self):
+        month_start = get_month_start(datetime(2025, 12, 15, 10, tzinfo=timezone.utc))
+
+        self.assertEqual(get_partition_name(month_start), "urls_urlusage_p202512")
+        self.assertEqual(get_partition_end("urls_urlusage_p202512"), datetime(2026, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(add_months(month_start, -12), datetime(2024, 12, 1, tzinfo=timezone.utc))
+
+
+class PartitionTestCase(TransactionTestCase):
+    def setUp(self):
+        self.url = URL.objects.create(url="https://example.com")
+        self.month_start = get_month_start(now())
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            for partition_name in get_partition_names():
+                cursor.execute(f"DROP TABLE {connection.ops.quote_name(partition_name)}")
+
+    def create_usages(self, count, created_at):
+        UrlUsage.objects.bulk_create([UrlUsage(url=self.url, created_at=created_at) for _ in range(count)])
+
+
+@skipUnless(connection.vendor != "postgresql", "PostgreSQL uses native partitions")
+@override_settings(URL_SHORTENER_USE_USAGE_PARTITIONS=True, URL_SHORTENER_USAGE_RETENTION_DAYS=30)
+class TestRotateUsageTable(PartitionTestCase):
+    def test_rotate_archive_the_usage_table_and_count_its_usages(self):
+        self.create_usages(3, self.month_start - timedelta(days=3))
+        self.create_usages(2, self.month_start + timedelta(minutes=5))
+
+        archive_table = rotate_usage_table()
+
+        self.assertEqual(archive_table, get_partition_name(add_months(self.month_start, -1)))
+        self.assertEqual(get_partition_names(), [archive_table])
+        self.assertEqual(UrlUsageCounter.objects.total(), 5)
+        # The usages of the current month stay in the usage table, the archive only holds the older ones
+        self.assertEqual(UrlUsage.objects.count(), 2)
+        self.assertFalse(UrlUsage.objects.filter(created_at__lt=self.month_start).exists())
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(archive_table)}")
+            self.assertEqual(cursor.fetchone()[0], 3)
+        # The new table is ready for the coming usages
+        self.create_usages(1, now())
+        self.assertEqual(UrlUsage.objects.count(), 3)
+        self.assertIsNone(rotate_usage_table())
+
+    def test_rotate_without_usages_of_previous_months_do_nothing(self):
+        self.create_usages(2, self.month_start + timedelta(minutes=5))
+
+        self.assertIsNone(rotate_usage_table())
+        self.assertEqual(UrlUsage.objects.count(), 2)
+
+    def test_drop_expired_partitions_after_the_retention_period(self):
+        self.create_usages(1, self.month_start - timedelta(days=3))
+        archive_table = rotate_usage_table()
+
+        self.assertEqual(drop_expired_usage_partitions(self.month_start + timedelta(days=29)), [])
+        self.assertEqual(drop_expired_usage_partitions(self.month_start + timedelta(days=30)), [archive_table])
+        self.assertEqual(get_partition_names(), [])
+
+    def test_late_rotation_keep_the_usages_of_the_current_month_until_their_retention(self):
+        self.create_usages(1, add_months(self.month_start, -3))
+        self.create_usages(2, self.month_start + timedelta(days=1))
+
+        archive_table = rotate_usage_table()
+        self.assertEqual(drop_expired_usage_partitions(self.month_start + timedelta(days=30)), [archive_table])
+
+        self.assertEqual(UrlUsage.objects.count(), 2)
+
+    @override_settings(URL_SHORTENER_EXPIRED_URL_REAPER_MODE="delete", URL_SHORTENER_EXPIRED_URL_GRACE_DAYS=1)
+    def test_urls_with_archived_usages_can_be_deleted(self):
+        self.create_usages(1, now() - timedelta(days=40))
+        other_url = URL.objects.create(url="https://example.org")
+        UrlUsage.objects.create(url=other_url, created_at=now() - timedelta(days=40))
+        rotate_usage_table()
+
+        other_url.delete()
+        URL.objects.filter(pk=self.url.pk).update(expiration_date=now() - timedelta(days=2))
+
+        self.assertEqual(reap_expired_urls(), 1)
+        self.assertFalse(URL.objects.exclude_ready_to_set_urls().exists())
+
+    @override_settings(URL_SHORTENER_USAGE_RETENTION_DAYS=60)
+    def test_maintain_task_rotate_the_usage_table(self):
+        self.create_usages(1, self.month_start - timedelta(days=3))
+
+        self.assertEqual(maintain_url_usage_partitions(), [])
+        self.assertEqual(len(get_partition_names()), 1)
+
+    def test_compaction_keep_the_old_usages_for_the_partition_drop(self):
+        self.create_usages(2, now() - timedelta(days=40))
+
+        compact_url_usages()
+
+        self.assertEqual(UrlUsage.objects.filter(is_counted=True).count(), 2)
+
+    @override_settings(URL_SHORTENER_USE_USAGE_PARTITIONS=False)
+    def test_maintain_task_do_nothing_when_partitions_are_disabled(self):
+        self.create_usages(1, self.month_start - timedelta(days=3))
+
+        self.assertEqual(maintain_url_usage_partitions(), [])
+        self.assertEqual(get_partition_names(), [])
+
+
+@skipUnless(connection.vendor == "postgresql", "Native partitions need PostgreSQL")
+@override_settings(URL_SHORTENER_USE_USAGE_PARTITIONS=True, URL_SHORTENER_USAGE_PARTITIONS_AHEAD=2)
+class TestNativeUsagePartitions(PartitionTestCase):
+    def tearDown(self):
+        # Put the plain usage table back for the other tests
+        with connection.schema_editor() as schema_editor:
+            schema_editor.execute(f"DROP TABLE {connection.ops.quote_name(UrlUsage._meta.db_table)} CASCADE")
+            schema_editor.create_model(UrlUsage)
+
+    def test_partition_usage_table_keep_the_existing_usages(self):
+        self.create_usages(3, self.month_start - timedelta(days=40))
+
+        self.assertTrue(partition_usage_table())
+        self.assertTrue(is_usage_table_partitioned())
+        self.assertFalse(partition_usage_table())
+        self.assertEqual(UrlUsage.objects.count(), 3)
+
+        created_partitions = create_usage_partitions()
+        self.assertEqual(
+            created_partitions,
+            [get_partition_name(add_months(self.month_start, months)) for months in (1, 2)],
+        )
+        self.create_usages(2, add_months(self.month_start, 1) + timedelta(days=1))
+        self.assertEqual(UrlUsage.objects.count(), 5)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {DEFAULT_PARTITION}")
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+        dropped_partitions = drop_expired_usage_partitions(add_months(self.month_start, 1) + timedelta(days=30))
+        self.assertEqual(dropped_partitions, [get_partition_name(self.month_start)])
+        self.assertEqual(UrlUsage.objects.count(), 2)
+
+    def test_compaction_delete_the_old_usages_until_the_table_is_partitioned(self):
+        self.create_usages(2, now() - timedelta(days=40))
+        self.create_usages(1, now())
+
+        compact_url_usages()
+
+        self.assertEqual(UrlUsage.objects.count(), 1)
@@ -0,0 +1,195 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+
+from urls.cache import local_cache
+from urls.models import URL, ArchivedURL, UrlUsage, UrlUsageCounter
+from urls.tasks import (
+    USAGE_DATETIME_FORMAT,
+    compact_url_usages,
+    create_ready_to_set_token_periodically,
+    log_the_url_usages_in_bulk,
+    reap_expired_urls,
+    warm_redirect_cache,
+)
+from urls.tests.query_budgets import QUERY_BUDGETS
+from urls.usage_logger import UsageBuffer
+from utils.tests import CustomTestCase, QueryBudget
+
+ROWS = 5
+
+
+class TestQueryBudgetAssertion(CustomTestCase):
+    query_budgets = {
+        "two queries": QueryBudget(max_queries=2, max_duplicates=1),
+    }
+
+    def test_query_budget_fail_on_too_many_queries(self):
+        with self.assertRaisesMessage(AssertionError, "3 queries, at most 2 expected"):
+            with self.assertQueryBudget("two queries"):
+                URL.objects.count()
+                User.objects.count()
+                UrlUsage.objects.count()
+
+    def test_query_budget_fail_on_duplicated_queries(self):
+        with self.assertRaisesMessage(AssertionError, "2 duplicated queries, at most 1 expected"):
+            with self.assertQueryBudget("two queries"):
+                for pk in range(3):
+                    list(URL.objects.filter(pk=pk))
+
+    def test_query_budget_record_the_queries_and_their_time(self):
+        with self.assertQueryBudget("two queries") as budget:
+            URL.objects.count()
+
+        self.assertEqual(budget.result.queries, 1)
+        self.assertEqual(budget.result.duplicates, 0)
+        self.assertGreaterEqual(budget.result.seconds, 0)
+        self.assertIn(budget.result, self.query_budget_results)
+
+
+# The usages are buffered and flushed in batches, their own budget is log_the_url_usages_in_bulk
+@patch("urls.api.views.usage_buffer", UsageBuffer(flush_callback=lambda usages: None, use_timer=False))
+class TestRedirectQueryBudgets(CustomTestCase):
+    query_budgets = QUERY_BUDGETS
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.url = URL.objects.create(url="https://example.com")
+        self.path = reverse("urls:redirect", kwargs={"token": self.url.token})
+
+    def test_redirect(self):
+        with self.assertQueryBudget("RedirectAPIView"):
+            self.client.get(self.path)
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True)
+    def test_redirect_with_cache(self):
+        with self.assertQueryBudget("RedirectAPIView cache miss"):
+            self.client.get(self.path)
+        with self.assertQueryBudget("RedirectAPIView cache hit"):
+            self.client.get(self.path)
+
+
+class TestResolveTokensQueryBudgets(CustomTestCase):
+    query_budgets = QUERY_BUDGETS
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username="user", password="password"))
+        self.tokens = [URL.objects.create(url=f"https://example.com/{index}").token for index in range(ROWS)]
+        self.tokens.append("a" * settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH)
+
+    def resolve(self):
+        self.client.post(reverse("urls:resolve"), {"tokens": self.tokens}, content_type="application/json")
+
+    def test_resolve(self):
+        with self.assertQueryBudget("ResolveTokensAPIView"):
+            self.resolve()
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True)
+    def test_resolve_with_cache(self):
+        with self.assertQueryBudget("ResolveTokensAPIView"):
+            self.resolve()
+        with self.assertQueryBudget("ResolveTokensAPIView cache hit"):
+            self.resolve()
+
+
+class TestURLManagerQueryBudgets(CustomTestCase):
+    query_budgets = QUERY_BUDGETS
+
+    def test_create_with_a_pool_token(self):
+        URL.objects.bulk_create_ready_to_set_tokens(1)
+
+        with self.assertQueryBudget("URLManager.create with a pool token"):
+            URL.objects.create(url="https://example.com")
+
+    def test_create_without_pool_tokens(self):
+        with self.assertQueryBudget("URLManager.create without pool tokens"):
+            URL.objects.create(url="https://example.com")
+
+
+class TestAdminQueryBudgets(CustomTestCase):
+    query_budgets = QUERY_BUDGETS
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="admin", password="password")
+        for index in range(ROWS):
+            url = URL.objects.create(url=f"https://example.com/{index}")
+            UrlUsage.objects.create(url=url)
+            UrlUsageCounter.objects.create(url=url, bucket=UrlUsageCounter.get_bucket(now()), count=1)
+            ArchivedURL.objects.create(
+                original_id=url.pk, url=url.url, token=url.token, expiration_date=now(), created_at=now(),
+            )
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelists(self):
+        for model, budget in (
+            (URL, "UrlAdmin changelist"),
+            (UrlUsage, "UrlUsageAdmin changelist"),
+            (UrlUsageCounter, "UrlUsageCounterAdmin changelist"),
+            (ArchivedURL, "ArchivedURLAdmin changelist"),
+        ):
+            path = reverse(f"admin:urls_{model._meta.model_name}_changelist")
+            with self.subTest(model=model.__name__), self.assertQueryBudget(budget):
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+
+    def test_url_changelist_sum_the_clicks_of_the_page_rows_only(self):
+        url = URL.objects.exclude_ready_to_set_urls().first()
+        UrlUsageCounter.objects.create(url=url, bucket=UrlUsageCounter.get_bucket(now() - timedelta(hours=1)), count=4)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("admin:urls_url_changelist"))
+
+        clicks = {row.pk: row.clicks for row in response.context["cl"].result_list}
+        self.assertEqual(clicks[url.pk], 5)
+        self.assertFalse(any('GROUP BY "urls_url"' in query["sql"] for query in context.captured_queries))
+
+
+class TestTaskQueryBudgets(CustomTestCase):
+    query_budgets = QUERY_BUDGETS
+
+    def test_create_ready_to_set_token_periodically(self):
+        with self.assertQueryBudget("create_ready_to_set_token_periodically"):
+            create_ready_to_set_token_periodically()
+
+    def test_log_the_url_usages_in_bulk(self):
+        urls = [URL.objects.create(url=f"https://example.com/{index}") for index in range(ROWS)]
+        usages = [[url.pk, now().strftime(USAGE_DATETIME_FORMAT)] for url in urls]
+
+        with self.assertQueryBudget("log_the_url_usages_in_bulk"):
+            log_the_url_usages_in_bulk(usages)
+
+    def test_compact_url_usages(self):
+        url = URL.objects.create(url="https://example.com")
+        UrlUsage.objects.bulk_create(UrlUsage(url=url) for _ in range(ROWS))
+
+        with self.assertQueryBudget("compact_url_usages"):
+            compact_url_usages()
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True)
+    def test_warm_redirect_cache(self):
+        for index in range(ROWS):
+            url = URL.objects.create(url=f"https://example.com/{index}")
+            UrlUsageCounter.objects.create(url=url, bucket=UrlUsageCounter.get_bucket(now()), count=1)
+
+        with self.assertQueryBudget("warm_redirect_cache"):
+            warm_redirect_cache()
+
+    @override_settings(URL_SHORTENER_EXPIRED_URL_REAPER_MODE="archive")
+    def test_reap_expired_urls(self):
+        for index in range(ROWS):
+            URL.objects.create(url=f"https://example.com/{index}", expiration_date=now() - timedelta(days=60))
+
+        with self.assertQueryBudget("reap_expired_urls"):
+            reap_expired_urls()
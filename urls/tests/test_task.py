@@ -1,14 +1,26 @@
+import os
+from datetime import timedelta
+from importlib import import_module
 from unittest.mock import patch
 
 from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase
 from django.utils.timezone import now
 from rest_framework import status
 from rest_framework.reverse import reverse
 from django.test.utils import override_settings
 
-from urls.models import URL, UrlUsage
-from urls.tasks import create_ready_to_set_token_periodically, log_the_url_usages
+from urls.cache import build_redirect_entry, redirect_cache
+from urls.models import URL, ArchivedURL, UrlUsage, UrlUsageCounter
+from urls.tasks import (
+    USAGE_DATETIME_FORMAT,
+    compact_url_usages,
+    create_ready_to_set_token_periodically,
+    log_the_url_usages_in_bulk,
+    reap_expired_urls,
+    warm_redirect_cache,
+)
 
 
 def get_redirect_url(token):
@@ -19,8 +31,23 @@ class TestUrlTask(TestCase):
     def tearDown(self):
         URL.objects.filter(pk__gte=1).delete()
 
+    @patch.dict(os.environ, {"REDIS_USERNAME": "user", "REDIS_PASSWORD": "password", "REDIS_HOST": "localhost"})
+    def test_beat_schedule_only_run_existing_tasks(self):
+        from config.celery import celery_app
+
+        for name, entry in celery_app.conf.beat_schedule.items():
+            module_name, task_name = entry["task"].rsplit(".", 1)
+            with self.subTest(name):
+                self.assertTrue(hasattr(import_module(module_name), task_name))
+
     def test_create_ready_to_set_token_start_with_zero_ready_to_set_token(self):
-        create_ready_to_set_token_periodically()
+        with self.assertNumQueries(3):
+            """
+                1- Count the ready_to_set_token objects
+                2- Check the created tokens are not active
+                3- Insert all ready_to_set_token objects
+            """
+            create_ready_to_set_token_periodically()
         self.assertEqual(URL.objects.all_ready_to_set_token().count(), settings.URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT)
 
     def test_create_ready_to_set_token_start_with_one_ready_to_set_token(self):
@@ -36,3 +63,221 @@ class TestUrlTask(TestCase):
 
         create_ready_to_set_token_periodically()
         self.assertEqual(URL.objects.all_ready_to_set_token().count(), settings.URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT)
+
+
+class TestUrlUsageTask(TestCase):
+    def setUp(self):
+        self.url = URL.objects.create(url="https://example.com")
+
+    def create_usages(self, count, created_at, is_counted=False):
+        UrlUsage.objects.bulk_create([
+            UrlUsage(url=self.url, created_at=created_at, is_counted=is_counted) for _ in range(count)
+        ])
+
+    def test_log_the_url_usages_in_bulk_increment_the_hourly_counter(self):
+        created_at = now().replace(minute=10, second=0, microsecond=0)
+        usages = [[self.url.pk, created_at.strftime(USAGE_DATETIME_FORMAT)]] * 3
+
+        log_the_url_usages_in_bulk(usages)
+        log_the_url_usages_in_bulk(usages)
+
+        counter = UrlUsageCounter.objects.get(url=self.url)
+        self.assertEqual(counter.count, 6)
+        self.assertEqual(counter.bucket, created_at.replace(minute=0))
+        self.assertEqual(UrlUsage.objects.filter(url=self.url, is_counted=True).count(), 6)
+
+    @patch("urls.querysets.COUNTER_INCREMENT_BATCH_SIZE", 2)
+    def test_usage_counter_increment_add_every_count_to_its_own_bucket(self):
+        bucket = UrlUsageCounter.get_bucket(now())
+        other_url = URL.objects.create(url="https://example.com/other")
+        UrlUsageCounter.objects.create(url=self.url, bucket=bucket, count=5)
+
+        with self.assertNumQueries(4):
+            UrlUsageCounter.objects.increment({
+                (self.url.pk, bucket): 1,
+                (self.url.pk, bucket - timedelta(hours=1)): 2,
+                (other_url.pk, bucket): 3,
+            })
+
+        self.assertEqual(UrlUsageCounter.objects.get(url=self.url, bucket=bucket).count, 6)
+        self.assertEqual(UrlUsageCounter.objects.get(url=self.url, bucket=bucket - timedelta(hours=1)).count, 2)
+        self.assertEqual(UrlUsageCounter.objects.get(url=other_url, bucket=bucket).count, 3)
+
+    def test_get_clicks_only_read_the_counters(self):
+        log_the_url_usages_in_bulk([[self.url.pk, now().strftime(USAGE_DATETIME_FORMAT)]] * 4)
+        log_the_url_usages_in_bulk([[self.url.pk, (now() - timedelta(days=2)).strftime(USAGE_DATETIME_FORMAT)]] * 2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.url.get_clicks(), 6)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.url.get_clicks(since=now() - timedelta(hours=1)), 4)
+
+    @override_settings(URL_SHORTENER_USAGE_RETENTION_DAYS=30, URL_SHORTENER_USAGE_COMPACTION_BATCH_SIZE=2)
+    def test_compact_url_usages_fold_not_counted_usages_and_delete_old_ones(self):
+        old_created_at = now() - timedelta(days=40)
+        recent_created_at = now() - timedelta(days=1)
+        self.create_usages(3, old_created_at)
+        self.create_usages(2, recent_created_at)
+        self.create_usages(4, old_created_at, is_counted=True)
+        UrlUsageCounter.objects.create(url=self.url, bucket=UrlUsageCounter.get_bucket(old_created_at), count=4)
+
+        compact_url_usages()
+
+        self.assertEqual(UrlUsageCounter.objects.get(bucket=UrlUsageCounter.get_bucket(old_created_at)).count, 7)
+        self.assertEqual(UrlUsageCounter.objects.get(bucket=UrlUsageCounter.get_bucket(recent_created_at)).count, 2)
+        self.assertEqual(UrlUsage.objects.count(), 2)
+        self.assertFalse(UrlUsage.objects.filter(is_counted=False).exists())
+        self.assertEqual(self.url.get_clicks(), 9)
+
+        compact_url_usages()
+        self.assertEqual(self.url.get_clicks(), 9)
+
+
+class TestWarmRedirectCacheTask(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create_url_with_clicks(self, clicks, **kwargs):
+        url = URL.objects.create(url="https://example.com", **kwargs)
+        UrlUsageCounter.objects.create(url=url, bucket=UrlUsageCounter.get_bucket(now()), count=clicks)
+        return url
+
+    def test_warm_redirect_cache_cache_the_most_used_urls(self):
+        hot_url = self.create_url_with_clicks(10)
+        warm_url = self.create_url_with_clicks(5, expiration_date=now() + timedelta(minutes=10))
+        cold_url = self.create_url_with_clicks(1)
+        expired_url = self.create_url_with_clicks(100, expiration_date=now() - timedelta(days=1))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(warm_redirect_cache(limit=2), 2)
+
+        self.assertEqual(redirect_cache.get(hot_url.token)["redirect_url"], hot_url.url)
+        self.assertEqual(redirect_cache.get(warm_url.token)["url_pk"], warm_url.pk)
+        self.assertIsNone(redirect_cache.get(cold_url.token))
+        self.assertIsNone(redirect_cache.get(expired_url.token))
+
+    @patch("urls.cache.redirect_cache.set_many")
+    def test_warm_redirect_cache_never_cache_an_entry_longer_than_its_url(self, mock_set_many):
+        expiration_dates = [now() + timedelta(seconds=seconds) for seconds in (100, 110, 5000, 10 ** 8)]
+        for expiration_date in expiration_dates:
+            self.create_url_with_clicks(1, expiration_date=expiration_date)
+
+        warm_redirect_cache()
+
+        self.assertEqual(mock_set_many.call_count, 3)
+        for call in mock_set_many.call_args_list:
+            entries, timeout = call.args
+            for token in entries:
+                remaining_seconds = (URL.objects.get(token=token).expiration_date - now()).total_seconds()
+                self.assertLessEqual(timeout, remaining_seconds)
+                self.assertGreater(timeout, remaining_seconds / 2)
+
+    def test_warm_redirect_cache_ignore_old_usages(self):
+        url = URL.objects.create(url="https://example.com")
+        UrlUsageCounter.objects.create(url=url, bucket=UrlUsageCounter.get_bucket(now() - timedelta(days=30)), count=10)
+
+        self.assertEqual(warm_redirect_cache(), 0)
+
+
+@override_settings(
+    URL_SHORTENER_EXPIRED_URL_REAPER_MODE="archive",
+    URL_SHORTENER_EXPIRED_URL_GRACE_DAYS=30,
+    URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT=10,
+)
+class TestReapExpiredUrlsTask(TestCase):
+    def create_url(self, token, expired_days_ago, clicks=0):
+        url = URL.objects.create(
+            url=f"https://example.com/{token}", token=token, expiration_date=now() - timedelta(days=expired_days_ago),
+        )
+        UrlUsage.objects.create(url=url, is_counted=True)
+        if clicks:
+            UrlUsageCounter.objects.create(url=url, bucket=UrlUsageCounter.get_bucket(now()), count=clicks)
+        return url
+
+    def reap(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return reap_expired_urls()
+
+    def test_reap_archive_the_urls_expired_before_the_grace_period(self):
+        expired_url = self.create_url("aaaaa", expired_days_ago=40, clicks=7)
+        recently_expired_url = self.create_url("bbbbb", expired_days_ago=10)
+        active_url = URL.objects.create(url="https://example.com")
+
+        self.assertEqual(self.reap(), 1)
+
+        self.assertFalse(URL.objects.filter(pk=expired_url.pk).exists())
+        self.assertEqual(URL.objects.filter(pk__in=[recently_expired_url.pk, active_url.pk]).count(), 2)
+        self.assertFalse(UrlUsage.objects.filter(url_id=expired_url.pk).exists())
+        archived_url = ArchivedURL.objects.get()
+        self.assertEqual(
+            (archived_url.original_id, archived_url.url, archived_url.token, archived_url.clicks),
+            (expired_url.pk, expired_url.url, "aaaaa", 7),
+        )
+
+    @override_settings(URL_SHORTENER_EXPIRED_URL_REAPER_MODE="delete")
+    def test_reap_in_delete_mode_do_not_archive(self):
+        self.create_url("aaaaa", expired_days_ago=40)
+
+        self.assertEqual(self.reap(), 1)
+
+        self.assertFalse(ArchivedURL.objects.exists())
+        self.assertFalse(UrlUsage.objects.exists())
+
+    @override_settings(URL_SHORTENER_EXPIRED_URL_REAPER_MODE=None)
+    def test_reap_is_disabled_by_default(self):
+        self.create_url("aaaaa", expired_days_ago=40)
+
+        self.assertEqual(self.reap(), 0)
+        self.assertEqual(URL.objects.count(), 1)
+
+    @override_settings(URL_SHORTENER_EXPIRED_URL_REAPER_BATCH_SIZE=2, URL_SHORTENER_EXPIRED_URL_REAPER_MAX_BATCHES=2)
+    def test_reap_stop_after_the_maximum_batches(self):
+        for i in range(5):
+            self.create_url(f"aaaa{i}", expired_days_ago=40 + i)
+
+        self.assertEqual(self.reap(), 4)
+        # The oldest ones go first
+        self.assertEqual(list(URL.objects.exclude_ready_to_set_urls().values_list("token", flat=True)), ["aaaa0"])
+        self.assertEqual(self.reap(), 1)
+
+    def test_reap_recycle_the_free_tokens_into_the_pool(self):
+        self.create_url("aaaaa", expired_days_ago=40)
+        self.create_url("bbbbb", expired_days_ago=40)
+        URL.objects.create(url="https://example.com/active", token="bbbbb")
+
+        self.reap()
+
+        self.assertEqual(list(URL.objects.all_ready_to_set_token().values_list("token", flat=True)), ["aaaaa"])
+        self.assertEqual(URL.objects.create(url="https://example.com/new").token, "aaaaa")
+
+    @override_settings(URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT=1)
+    def test_reap_do_not_grow_the_pool_over_its_limit(self):
+        URL.objects.create_ready_to_set_token()
+        self.create_url("aaaaa", expired_days_ago=40)
+
+        self.reap()
+
+        self.assertEqual(URL.objects.all_ready_to_set_token().count(), 1)
+        self.assertFalse(URL.objects.filter(token="aaaaa").exists())
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True)
+    def test_reap_evict_the_cached_entries(self):
+        self.create_url("aaaaa", expired_days_ago=40)
+        redirect_cache.set("aaaaa", build_redirect_entry("https://example.com", 1, 60), 60)
+
+        self.reap()
+
+        self.assertIsNone(redirect_cache.get("aaaaa"))
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True, URL_SHORTENER_USE_LOCAL_CACHE=True)
+    def test_reap_do_not_evict_the_urls_one_by_one(self):
+        for i in range(3):
+            self.create_url(f"aaaa{i}", expired_days_ago=40)
+
+        with patch("urls.signals.invalidate_cache") as invalidate_cache, \
+                patch("urls.tasks.delete_redirect_entries") as delete_redirect_entries:
+            self.reap()
+
+        invalidate_cache.assert_not_called()
+        delete_redirect_entries.assert_called_once_with(["aaaa0", "aaaa1", "aaaa2"])
+        self.assertFalse(URL.objects.filter(token__startswith="aaaa").exclude_ready_to_set_urls().exists())
@@ -0,0 +1,129 @@
+from unittest.mock import patch
+
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from rest_framework.reverse import reverse
+
+from urls.models import URL, TokenCounter
+from urls.token_counter import AVAILABLE_CHARS, CounterTokenGenerator, TokenPermutation, counter_token_generator
+from urls.token_filter import active_token_filter
+
+
+class TestTokenPermutation(TestCase):
+    def test_permutation_is_a_bijection_of_the_keyspace(self):
+        permutation = TokenPermutation(length=2, key="test")
+        tokens = [permutation.encode(value) for value in range(permutation.keyspace_size)]
+
+        self.assertEqual(len(set(tokens)), len(AVAILABLE_CHARS) ** 2)
+        self.assertTrue(all(len(token) == 2 for token in tokens))
+        self.assertEqual([permutation.decode(token) for token in tokens], list(range(permutation.keyspace_size)))
+
+    def test_consecutive_values_do_not_give_consecutive_tokens(self):
+        permutation = TokenPermutation(length=5, key="test")
+        tokens = [permutation.encode(value) for value in range(10)]
+
+        self.assertNotEqual(tokens, sorted(tokens))
+        self.assertEqual(len({token[:3] for token in tokens}), 10)
+
+    def test_the_key_changes_the_tokens(self):
+        self.assertNotEqual(TokenPermutation(key="first").encode(1), TokenPermutation(key="second").encode(1))
+
+
+@override_settings(URL_SHORTENER_TOKEN_GENERATOR="counter")
+class TestCounterTokens(TestCase):
+    def setUp(self):
+        counter_token_generator.clear()
+        self.addCleanup(counter_token_generator.clear)
+
+    def test_reserved_tokens_are_checked_with_a_single_query(self):
+        URL.objects.create(url="https://example.com")
+
+        with patch.object(URL.objects, "all_actives", wraps=URL.objects.all_actives) as mock_all_actives:
+            tokens = URL.create_tokens(50)
+        mock_all_actives.assert_called_once_with()
+        self.assertEqual([counter_token_generator.permutation.decode(token) for token in tokens], list(range(1, 51)))
+
+    def test_workers_never_create_the_same_token(self):
+        first_worker = CounterTokenGenerator(block_size=10)
+        second_worker = CounterTokenGenerator(block_size=10)
+
+        tokens = first_worker.create_tokens(15) + second_worker.create_tokens(15) + first_worker.create_tokens(15)
+
+        self.assertEqual(len(set(tokens)), 45)
+        self.assertEqual(TokenCounter.objects.get().value, 45)
+
+    def test_exhausted_keyspace_raise_exception(self):
+        generator = CounterTokenGenerator(permutation=TokenPermutation(length=1))
+
+        generator.create_tokens(len(AVAILABLE_CHARS))
+        with self.assertRaisesMessage(Exception, "The token keyspace is exhausted."):
+            generator.create_tokens(1)
+
+    @override_settings(URL_SHORTENER_USE_TOKEN_FILTER=True)
+    def test_active_token_from_before_the_counter_is_skipped(self):
+        active_token_filter.clear()
+        self.addCleanup(active_token_filter.clear)
+        URL.objects.create(url="https://example.com", token=counter_token_generator.permutation.encode(0)[:-1])
+        with override_settings(URL_SHORTENER_TOKEN_GENERATOR="random"):
+            legacy_url = URL.objects.create(url="https://example.com", token=counter_token_generator.permutation.encode(0))
+
+        tokens = URL.create_tokens(2)
+
+        self.assertNotIn(legacy_url.token, tokens)
+        self.assertEqual([counter_token_generator.permutation.decode(token) for token in tokens], [1, 2])
+
+    def test_active_token_from_before_the_counter_is_skipped_without_the_filter(self):
+        with override_settings(URL_SHORTENER_TOKEN_GENERATOR="random"):
+            legacy_url = URL.objects.create(url="https://example.com", token=counter_token_generator.permutation.encode(1))
+
+        tokens = URL.create_tokens(2)
+
+        self.assertNotIn(legacy_url.token, tokens)
+        self.assertEqual([counter_token_generator.permutation.decode(token) for token in tokens], [0, 2])
+
+    @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
+    def test_custom_token_of_the_token_length_is_served_and_skipped_by_the_counter(self, mock_log_the_url_usages):
+        custom_token = counter_token_generator.permutation.encode(0)
+        url = URL.objects.create(url="https://example.com", token=custom_token)
+
+        response = self.client.get(reverse("urls:redirect", kwargs={"token": custom_token}))
+        self.assertEqual(response["location"], url.url)
+        self.assertNotEqual(URL.objects.create(url="https://example2.com").token, custom_token)
+
+
+@override_settings(URL_SHORTENER_TOKEN_GENERATOR="counter")
+class TestCounterTokenBlocks(TransactionTestCase):
+    def setUp(self):
+        self.generator = CounterTokenGenerator(block_size=100)
+
+    def test_counter_is_read_once_per_block(self):
+        TokenCounter.objects.create(name="token")
+
+        with self.assertNumQueries(5):
+            """
+                1- Begin the transaction
+                2- Reserve the block
+                3- Read the end of the block
+                4- Commit
+                5- Check the tokens of the block are not active
+            """
+            self.generator.create_tokens(60)
+        with self.assertNumQueries(0):
+            self.generator.create_tokens(40)
+        with self.assertNumQueries(5):
+            self.generator.create_tokens(1)
+
+    def test_rolled_back_transaction_does_not_keep_a_block(self):
+        with transaction.atomic():
+            self.generator.create_tokens(3)
+            transaction.set_rollback(True)
+
+        self.assertEqual(self.generator.take_values(1), [0])
+        self.assertEqual(TokenCounter.objects.get().value, 100)
+
+    def test_forked_worker_does_not_share_the_block_of_its_parent(self):
+        self.generator.create_tokens(1)
+
+        with patch("urls.token_counter.os.getpid", return_value=-1):
+            self.assertEqual(self.generator.take_values(1), [100])
@@ -0,0 +1,124 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from urls.models import URL
+from urls.token_filter import BloomFilter, active_token_filter
+
+
+class TestBloomFilter(TestCase):
+    def test_bloom_filter_has_no_false_negative(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        items = [f"item-{i}" for i in range(1000)]
+        for item in items:
+            bloom_filter.add(item)
+
+        self.assertTrue(all(item in bloom_filter for item in items))
+
+    def test_bloom_filter_false_positive_rate_is_near_the_error_rate(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom_filter.add(f"item-{i}")
+
+        false_positives = sum(f"other-{i}" in bloom_filter for i in range(10_000))
+        self.assertLess(false_positives, 300)
+
+
+@override_settings(URL_SHORTENER_USE_TOKEN_FILTER=True)
+class TestActiveTokenFilter(TestCase):
+    def setUp(self):
+        active_token_filter.clear()
+        self.addCleanup(active_token_filter.clear)
+
+    def test_filter_is_built_from_the_active_tokens_on_first_use(self):
+        active_url = URL.objects.create(url="https://example.com", token="aBcDe")
+        expired_url = URL.objects.create(url="https://example2.com", token="eXpIr", expiration_date=now() - timedelta(days=1))
+
+        with self.assertNumQueries(2):
+            """
+                1- Count the active tokens
+                2- Read the active tokens
+            """
+            self.assertIn(active_url.token, active_token_filter)
+        with self.assertNumQueries(0):
+            self.assertNotIn(expired_url.token, active_token_filter)
+
+    def test_created_tokens_are_added_to_the_filter(self):
+        active_token_filter.rebuild()
+
+        url = URL.objects.create(url="https://example.com")
+        ready_to_set_urls = URL.objects.bulk_create_ready_to_set_tokens(3)
+        bulk_created_urls = URL.objects.bulk_create_urls([{"url": "https://example2.com"}])
+
+        with self.assertNumQueries(0):
+            for created_url in [url, *ready_to_set_urls, *bulk_created_urls]:
+                self.assertIn(created_url.token, active_token_filter)
+
+    def test_create_token_skip_the_query_of_the_tokens_in_the_filter(self):
+        active_url = URL.objects.create(url="https://example.com")
+        active_token_filter.rebuild()
+        candidates = iter([active_url.token, active_url.token, "aBcDe"])
+
+        with patch("urls.models.URL._create_random_string", side_effect=lambda: next(candidates)):
+            with self.assertNumQueries(1):
+                token = URL.create_token()
+
+        self.assertEqual(token, "aBcDe")
+
+    def test_create_tokens_skip_the_query_of_the_tokens_in_the_filter(self):
+        active_url = URL.objects.create(url="https://example.com")
+        active_token_filter.rebuild()
+        candidates = iter([active_url.token, "aBcDe"])
+
+        with patch("urls.models.URL._create_random_string", side_effect=lambda: next(candidates)):
+            with self.assertNumQueries(1):
+                tokens = URL.create_tokens(1)
+
+        self.assertEqual(tokens, ["aBcDe"])
+
+    @patch("urls.token_filter.monotonic")
+    def test_filter_is_rebuilt_after_the_rebuild_interval(self, mock_monotonic):
+        mock_monotonic.return_value = 0
+        url = URL.objects.create(url="https://example.com", expiration_date=now() + timedelta(days=1))
+        self.assertIn(url.token, active_token_filter)
+        URL.objects.filter(pk=url.pk).update(expiration_date=now() - timedelta(days=1))
+
+        mock_monotonic.return_value = active_token_filter.rebuild_interval
+        with patch.object(active_token_filter, "use_thread", False), self.assertNumQueries(2):
+            self.assertNotIn(url.token, active_token_filter)
+
+    @patch("urls.token_filter.monotonic")
+    def test_stale_filter_is_used_while_another_thread_rebuilds_it(self, mock_monotonic):
+        mock_monotonic.return_value = 0
+        url = URL.objects.create(url="https://example.com")
+        active_token_filter.rebuild()
+
+        mock_monotonic.return_value = active_token_filter.rebuild_interval
+        with active_token_filter._rebuild_lock, self.assertNumQueries(0):
+            self.assertIn(url.token, active_token_filter)
+
+
+@override_settings(URL_SHORTENER_USE_TOKEN_FILTER=True)
+class TestActiveTokenFilterBackgroundRebuild(TransactionTestCase):
+    def setUp(self):
+        active_token_filter.clear()
+        self.addCleanup(active_token_filter.clear)
+
+    @patch("urls.token_filter.monotonic")
+    def test_rebuild_runs_in_the_background_and_keep_the_added_tokens(self, mock_monotonic):
+        mock_monotonic.return_value = 0
+        url = URL.objects.create(url="https://example.com", expiration_date=now() + timedelta(days=1))
+        active_token_filter.rebuild()
+        URL.objects.filter(pk=url.pk).update(expiration_date=now() - timedelta(days=1))
+
+        mock_monotonic.return_value = active_token_filter.rebuild_interval
+        with self.assertNumQueries(0):
+            self.assertIn(url.token, active_token_filter)
+        created_url = URL.objects.create(url="https://example2.com")
+        active_token_filter._rebuild_thread.join()
+
+        self.assertNotIn(url.token, active_token_filter)
+        self.assertIn(created_url.token, active_token_filter)
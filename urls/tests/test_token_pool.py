@@ -0,0 +1,236 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import fakeredis
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from urls import metrics
+from urls.models import URL
+from urls.tasks import create_ready_to_set_token_periodically
+from urls.token_pool import (
+    POOL_REFILL_LOCK_KEY,
+    RedisTokenPool,
+    get_claim_bucket_keys,
+    get_low_watermark,
+    get_pool_sizes,
+    record_claims,
+)
+
+
+@override_settings(
+    URL_SHORTENER_TOKEN_POOL_BACKEND="redis",
+    URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT=5,
+    URL_SHORTENER_TOKEN_POOL_LOW_WATERMARK=2,
+)
+class TestRedisTokenPool(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.pool = RedisTokenPool(client=fakeredis.FakeRedis(decode_responses=True))
+        for target in ("urls.querysets.redis_token_pool", "urls.tasks.redis_token_pool"):
+            patcher = patch(target, self.pool)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(create_ready_to_set_token_periodically, "delay")
+        self.mock_delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_refill_fill_the_pool_up_to_the_limit_with_free_tokens(self):
+        active_url = URL.objects.create(url="https://example.com")
+
+        create_ready_to_set_token_periodically()
+        create_ready_to_set_token_periodically()
+
+        pooled_tokens = self.pool.client.smembers(self.pool.key)
+        self.assertEqual(len(pooled_tokens), 5)
+        self.assertNotIn(active_url.token, pooled_tokens)
+        self.assertFalse(URL.objects.all_ready_to_set_token().exists())
+
+    def test_create_url_claim_a_pooled_token_without_pool_queries(self):
+        self.pool.add(["aBcDe", "fGhIj", "kLmNo", "pQrSt"])
+
+        # The active token check of the popped token and the insert
+        with self.assertNumQueries(2):
+            url = URL.objects.create(url="https://example.com")
+
+        self.assertIn(url.token, {"aBcDe", "fGhIj", "kLmNo", "pQrSt"})
+        self.assertEqual(len(self.pool), 3)
+        self.assertNotIn(url.token, self.pool.client.smembers(self.pool.key))
+        self.mock_delay.assert_not_called()
+
+    def test_pool_below_the_low_watermark_schedule_a_single_refill(self):
+        self.pool.add(["aBcDe", "fGhIj", "kLmNo"])
+
+        for index in range(3):
+            URL.objects.create(url=f"https://example.com/{index}")
+
+        self.mock_delay.assert_called_once_with(refill_lock_id=cache.get(POOL_REFILL_LOCK_KEY))
+        create_ready_to_set_token_periodically(**self.mock_delay.call_args.kwargs)
+        self.assertEqual(len(self.pool), 5)
+        self.assertIsNone(cache.get(POOL_REFILL_LOCK_KEY))
+
+    def test_beat_refill_keep_the_lock_of_a_scheduled_refill(self):
+        URL.objects.create(url="https://example.com")
+        refill_lock_id = cache.get(POOL_REFILL_LOCK_KEY)
+        self.mock_delay.assert_called_once_with(refill_lock_id=refill_lock_id)
+
+        create_ready_to_set_token_periodically()
+        self.assertEqual(cache.get(POOL_REFILL_LOCK_KEY), refill_lock_id)
+
+        create_ready_to_set_token_periodically(refill_lock_id=refill_lock_id)
+        self.assertIsNone(cache.get(POOL_REFILL_LOCK_KEY))
+
+    def test_unreachable_broker_does_not_fail_the_url_creation(self):
+        self.mock_delay.side_effect = ConnectionError
+
+        with self.assertLogs("urls.token_pool", "ERROR"):
+            url = URL.objects.create(url="https://example.com")
+
+        self.assertTrue(URL.objects.filter(pk=url.pk).exists())
+        # The next claims do not retry the broker until the lock expires
+        URL.objects.create(url="https://example.com/1")
+        self.mock_delay.assert_called_once()
+
+    def test_empty_pool_fall_back_to_a_new_token(self):
+        url = URL.objects.create(url="https://example.com")
+
+        self.assertTrue(url.token)
+        self.mock_delay.assert_called_once()
+
+    def test_custom_token_is_removed_from_the_pool(self):
+        self.pool.add(["aBcDe"])
+
+        URL.objects.create(url="https://example.com", token="aBcDe")
+
+        self.assertEqual(len(self.pool), 0)
+        with self.assertRaisesMessage(ValidationError, "This token is already active."):
+            URL.objects.create(url="https://example.com", token="aBcDe")
+
+    def test_popped_token_that_is_already_active_is_dropped(self):
+        self.pool.add(["aBcDe"])
+        # Saved without URLManager.create, e.g. as the fallback token of another process, the token stays in the pool
+        URL(url="https://example.com", token="aBcDe").save()
+
+        url = URL.objects.create(url="https://example.org")
+
+        self.assertNotEqual(url.token, "aBcDe")
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(URL.objects.filter(token="aBcDe").count(), 1)
+
+    def test_unreachable_redis_fall_back_to_new_tokens(self):
+        server = fakeredis.FakeServer()
+        server.connected = False
+        self.pool._client = fakeredis.FakeRedis(server=server, decode_responses=True)
+
+        with self.assertLogs("urls.token_pool", "ERROR"):
+            url = URL.objects.create(url="https://example.com")
+            custom_url = URL.objects.create(url="https://example.com", token="aBcDe")
+            results = URL.objects.bulk_create_urls([{"url": "https://example.com/bulk"}])
+
+        self.assertTrue(url.token)
+        self.assertEqual(custom_url.token, "aBcDe")
+        self.assertTrue(results[0].token)
+
+    def test_bulk_create_urls_claim_the_pooled_tokens_first(self):
+        self.pool.add(["aBcDe", "fGhIj"])
+
+        results = URL.objects.bulk_create_urls([{"url": f"https://example.com/{index}"} for index in range(3)])
+
+        tokens = [url.token for url in results]
+        self.assertEqual(set(tokens[:2]), {"aBcDe", "fGhIj"})
+        self.assertEqual(len(set(tokens)), 3)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_recycled_tokens_go_back_to_the_pool(self):
+        expired_url = URL.objects.create(url="https://example.com", expiration_date=now() - timedelta(days=1))
+
+        self.assertEqual(URL.objects.recycle_tokens([expired_url.token]), [expired_url.token])
+        self.assertEqual(self.pool.client.smembers(self.pool.key), {expired_url.token})
+
+
+@override_settings(
+    URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL=True,
+    URL_SHORTENER_USE_METRICS=True,
+    URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT=10,
+    URL_SHORTENER_TOKEN_POOL_LOW_WATERMARK=3,
+    URL_SHORTENER_TOKEN_POOL_MAX_SIZE=500,
+    URL_SHORTENER_TOKEN_POOL_RATE_WINDOW=60,
+    URL_SHORTENER_TOKEN_POOL_REFILL_HORIZON=60,
+    URL_SHORTENER_TOKEN_POOL_REFILL_LEAD_TIME=5,
+)
+class TestAdaptivePoolRefill(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.clear()
+        patcher = patch.object(create_ready_to_set_token_periodically, "delay")
+        self.mock_delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_pool_sizes_follow_the_claim_rate(self):
+        self.assertEqual(get_pool_sizes(0), (10, 3))
+        self.assertEqual(get_pool_sizes(2), (120, 10))
+        self.assertEqual(get_pool_sizes(100), (500, 500))
+
+    def test_refill_is_sized_from_the_claim_rate(self):
+        record_claims(120)
+
+        create_ready_to_set_token_periodically()
+
+        self.assertEqual(URL.objects.all_ready_to_set_token().count(), 120)
+        self.assertEqual(metrics.pool_depth.get(), 120)
+        self.assertEqual(get_low_watermark(), 10)
+
+    def test_claim_below_the_low_watermark_schedule_a_single_refill(self):
+        create_ready_to_set_token_periodically()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(7):
+                URL.objects.create(url=f"https://example.com/{index}")
+        self.mock_delay.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(2):
+                URL.objects.create(url=f"https://example.com/other/{index}")
+        self.mock_delay.assert_called_once_with(refill_lock_id=cache.get(POOL_REFILL_LOCK_KEY))
+        self.assertEqual(metrics.pool_depth.get(), 1)
+        self.assertEqual(metrics.pool_tokens_claimed.get(), 9)
+
+    def test_empty_pool_count_the_fallback_and_schedule_a_refill(self):
+        URL.objects.create(url="https://example.com")
+        URL.objects.bulk_create_urls([{"url": "https://example.com/1"}, {"url": "https://example.com/2"}])
+
+        self.assertEqual(metrics.pool_fallbacks.get(), 3)
+        self.assertEqual(metrics.pool_depth.get(), 0)
+        self.mock_delay.assert_called_once()
+
+    def test_claim_is_counted_once_committed(self):
+        create_ready_to_set_token_periodically()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            URL.objects.create(url="https://example.com")
+            URL.objects.bulk_create_urls([{"url": "https://example.com/1"}])
+        self.assertIsNone(metrics.pool_tokens_claimed.get())
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(metrics.pool_tokens_claimed.get(), 2)
+
+    def test_claim_bucket_evicted_before_the_increment_is_recreated(self):
+        def evict_and_increment(key, delta=1, version=None):
+            cache.delete(key)
+            raise ValueError(f"Key '{key}' not found.")
+
+        with patch.object(cache, "incr", side_effect=evict_and_increment):
+            record_claims(3)
+
+        self.assertEqual(cache.get(get_claim_bucket_keys()[0]), 3)
+
+    @override_settings(URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL=False)
+    def test_fixed_pool_does_not_schedule_refills(self):
+        URL.objects.create(url="https://example.com")
+
+        self.assertEqual(metrics.pool_fallbacks.get(), 1)
+        self.mock_delay.assert_not_called()
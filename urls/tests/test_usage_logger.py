@@ -0,0 +1,141 @@
+from unittest.mock import MagicMock, patch
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.timezone import now
+from rest_framework import status
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from urls.models import URL, UrlUsage
+from urls.tasks import USAGE_DATETIME_FORMAT, log_the_url_usages_in_bulk
+from urls.usage_logger import UsageBuffer, flush_usages
+
+
+def get_redirect_url(token):
+    return reverse("urls:redirect", kwargs={"token": token})
+
+
+def count_usage_inserts(captured_queries):
+    return len([query for query in captured_queries if query["sql"].startswith('INSERT INTO "urls_urlusage"')])
+
+
+class TestUsageBuffer(APITestCase):
+    def test_flush_when_batch_size_is_reached(self):
+        flush_callback = MagicMock()
+        usage_buffer = UsageBuffer(batch_size=3, flush_interval=60, flush_callback=flush_callback, use_timer=False)
+
+        usage_buffer.add(1, "a")
+        usage_buffer.add(2, "b")
+        flush_callback.assert_not_called()
+
+        usage_buffer.add(3, "c")
+        flush_callback.assert_called_once_with([[1, "a"], [2, "b"], [3, "c"]])
+        self.assertEqual(len(usage_buffer), 0)
+
+    @patch("urls.usage_logger.monotonic")
+    def test_flush_when_flush_interval_is_passed(self, mock_monotonic):
+        flush_callback = MagicMock()
+        usage_buffer = UsageBuffer(batch_size=100, flush_interval=5, flush_callback=flush_callback, use_timer=False)
+
+        mock_monotonic.return_value = 10
+        usage_buffer.add(1, "a")
+        mock_monotonic.return_value = 14
+        usage_buffer.add(2, "b")
+        flush_callback.assert_not_called()
+
+        mock_monotonic.return_value = 15
+        usage_buffer.add(3, "c")
+        flush_callback.assert_called_once_with([[1, "a"], [2, "b"], [3, "c"]])
+
+    @patch("urls.usage_logger.monotonic")
+    def test_failed_flush_keeps_usages_and_drop_the_oldest_on_overflow(self, mock_monotonic):
+        mock_monotonic.return_value = 10
+        flush_callback = MagicMock(side_effect=ConnectionError)
+        usage_buffer = UsageBuffer(batch_size=2, flush_interval=60, capacity=3, flush_callback=flush_callback, use_timer=False)
+
+        usage_buffer.add(1, "a")
+        with self.assertLogs("urls.usage_logger", "ERROR"):
+            usage_buffer.add(2, "b")
+        self.assertEqual(len(usage_buffer), 2)
+
+        usage_buffer.add(3, "c")
+        usage_buffer.add(4, "d")
+        self.assertEqual(flush_callback.call_count, 1)
+
+        flush_callback.side_effect = None
+        flush_callback.reset_mock()
+        self.assertEqual(usage_buffer.flush(), 3)
+        flush_callback.assert_called_once_with([[2, "b"], [3, "c"], [4, "d"]])
+
+    @patch("urls.usage_logger.monotonic")
+    def test_failed_flush_back_off_before_the_next_attempt(self, mock_monotonic):
+        mock_monotonic.return_value = 10
+        flush_callback = MagicMock(side_effect=ConnectionError)
+        usage_buffer = UsageBuffer(
+            batch_size=1, flush_interval=5, flush_callback=flush_callback, use_timer=False, max_retry_delay=8
+        )
+
+        with self.assertLogs("urls.usage_logger", "ERROR"):
+            usage_buffer.add(1, "a")
+        mock_monotonic.return_value = 14
+        usage_buffer.add(2, "b")
+        self.assertEqual(flush_callback.call_count, 1)
+
+        mock_monotonic.return_value = 15
+        with self.assertLogs("urls.usage_logger", "ERROR"):
+            usage_buffer.add(3, "c")
+        self.assertEqual(flush_callback.call_count, 2)
+
+        # The delay doubles up to max_retry_delay
+        mock_monotonic.return_value = 22
+        usage_buffer.add(4, "d")
+        self.assertEqual(flush_callback.call_count, 2)
+
+        flush_callback.side_effect = None
+        mock_monotonic.return_value = 23
+        usage_buffer.add(5, "e")
+        flush_callback.assert_called_with([[1, "a"], [2, "b"], [3, "c"], [4, "d"], [5, "e"]])
+        self.assertEqual(len(usage_buffer), 0)
+
+    def test_flush_empty_buffer_do_nothing(self):
+        flush_callback = MagicMock()
+        usage_buffer = UsageBuffer(flush_callback=flush_callback, use_timer=False)
+
+        self.assertEqual(usage_buffer.flush(), 0)
+        flush_callback.assert_not_called()
+
+    @patch("urls.usage_logger.log_the_url_usages_in_bulk")
+    @override_settings(URL_SHORTENER_USE_CELERY_AS_USAGE_LOGGER=True)
+    def test_flush_usages_send_one_celery_message_per_batch(self, mock_task):
+        usages = [[1, "a"], [2, "b"]]
+        flush_usages(usages)
+
+        mock_task.delay.assert_called_once_with(usages)
+        mock_task.assert_not_called()
+
+
+class TestBatchedUsageLogging(APITestCase):
+    def test_log_the_url_usages_in_bulk_keep_the_redirect_time(self):
+        url = URL.objects.create(url="https://example.com")
+        created_at = now().replace(year=2020, microsecond=0)
+
+        with CaptureQueriesContext(connection) as context:
+            log_the_url_usages_in_bulk([[url.pk, created_at.strftime(USAGE_DATETIME_FORMAT)]] * 5)
+
+        self.assertEqual(count_usage_inserts(context.captured_queries), 1)
+        self.assertEqual(UrlUsage.objects.filter(url=url, created_at=created_at).count(), 5)
+
+    def test_n_redirects_produce_n_divided_by_batch_size_inserts(self):
+        url = URL.objects.create(url="https://example.com")
+        usage_buffer = UsageBuffer(batch_size=10, flush_interval=60, use_timer=False)
+
+        with patch("urls.api.views.usage_buffer", usage_buffer):
+            with CaptureQueriesContext(connection) as context:
+                for _ in range(25):
+                    response = self.client.get(get_redirect_url(url.token))
+                    self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+                usage_buffer.flush()
+
+        self.assertEqual(count_usage_inserts(context.captured_queries), 3)
+        self.assertEqual(UrlUsage.objects.filter(url=url).count(), 25)
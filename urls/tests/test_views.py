@@ -1,16 +1,27 @@
 from datetime import timedelta
 from random import choice
+from time import time
+from unittest import skipUnless
 from unittest.mock import patch
 
 from django.conf import settings
-from django.test.utils import override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.dateparse import parse_datetime
 from django.utils.timezone import now
 from rest_framework import status
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from urls.api.views import RedirectAPIView
+from urls.cache import NOT_FOUND, build_redirect_entry, redirect_cache
 from urls.models import URL, AVAILABLE_CHARS
 
+User = get_user_model()
+
 
 def get_redirect_url(token):
     return reverse("urls:redirect", kwargs={"token": token})
@@ -19,8 +30,8 @@ def get_redirect_url(token):
 class TestRedirectUrlView(APITestCase):
 
     @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
-    @patch("urls.api.views.cache.get")
-    @patch("urls.api.views.cache.set")
+    @patch("urls.api.views.redirect_cache.get")
+    @patch("urls.api.views.redirect_cache.set")
     @override_settings(URL_SHORTENER_USE_CACHE=True)
     def test_redirect_view_with_valid_token_redirect_to_correct_url(self, mock_cache_set, mock_cache_get, mock_log_the_url_usages):
         url = URL.objects.create(url="https://example.com")
@@ -36,8 +47,8 @@ class TestRedirectUrlView(APITestCase):
         mock_cache_set.assert_called_once()
 
     @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
-    @patch("urls.api.views.cache.get")
-    @patch("urls.api.views.cache.set")
+    @patch("urls.api.views.redirect_cache.get")
+    @patch("urls.api.views.redirect_cache.set")
     @override_settings(URL_SHORTENER_USE_CACHE=True)
     @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
     def test_redirect_view_with_valid_cached_key_redirect_to_correct_url(self, mock_cache_set, mock_cache_get, mock_log_the_url_usages):
@@ -58,13 +69,13 @@ class TestRedirectUrlView(APITestCase):
 
     @patch("urls.api.views.RedirectAPIView.log_the_url_usages")
     @patch("urls.api.views.RedirectAPIView.get_object")
-    @patch("urls.api.views.cache.get")
-    @patch("urls.api.views.cache.set")
+    @patch("urls.api.views.redirect_cache.get")
+    @patch("urls.api.views.redirect_cache.set")
     @override_settings(URL_SHORTENER_USE_CACHE=True)
     def test_redirect_view_is_cache_the_token_with_correct_key_value_ttl(self, mock_cache_set, mock_cache_get, mock_get_object, mock_log_the_url_usages):
         token = URL.create_token()
         url_obj = URL(pk=0, token=token, url="https://example.com")
-        url_obj.remaining_seconds = 12
+        url_obj.remaining_seconds = timedelta(seconds=12)
         mock_get_object.return_value = url_obj
         mock_cache_get.return_value = None
 
@@ -73,15 +84,17 @@ class TestRedirectUrlView(APITestCase):
             self.assertEqual(response.status_code, status.HTTP_302_FOUND)
             self.assertEqual(response["location"], url_obj.url)
 
-        cache_value = {
-            "redirect_url": url_obj.url,
-            "url_pk": url_obj.pk
-        }
         mock_cache_get.assert_called_once_with(token)
-        mock_cache_set.assert_called_once_with(token, cache_value, url_obj.remaining_seconds)
+        mock_cache_set.assert_called_once()
+        cache_key, cache_value, cache_timeout = mock_cache_set.call_args.args
+        self.assertEqual(cache_key, token)
+        self.assertEqual(cache_timeout, 12)
+        self.assertEqual(cache_value["redirect_url"], url_obj.url)
+        self.assertEqual(cache_value["url_pk"], url_obj.pk)
+        self.assertAlmostEqual(cache_value["expires_at"], time() + 12, delta=1)
 
-    @patch("urls.api.views.cache.get")
-    @patch("urls.api.views.cache.set")
+    @patch("urls.api.views.redirect_cache.get")
+    @patch("urls.api.views.redirect_cache.set")
     @override_settings(URL_SHORTENER_USE_CACHE=True)
     def test_redirect_view_with_expired_token_redirect_to_404_page(self, mock_cache_set, mock_cache_get):
         url = URL.objects.create(url="https://example.com", expiration_date=now() - timedelta(days=1))
@@ -93,10 +106,10 @@ class TestRedirectUrlView(APITestCase):
             self.assertEqual(response["location"], settings.URL_SHORTENER_404_PAGE)
 
         mock_cache_get.assert_called_once()
-        mock_cache_set.assert_not_called()
+        mock_cache_set.assert_called_once_with(url.token, NOT_FOUND, settings.URL_SHORTENER_NEGATIVE_CACHE_TTL)
 
-    @patch("urls.api.views.cache.get")
-    @patch("urls.api.views.cache.set")
+    @patch("urls.api.views.redirect_cache.get")
+    @patch("urls.api.views.redirect_cache.set")
     @override_settings(URL_SHORTENER_USE_CACHE=True)
     def test_redirect_view_with_ready_to_set_token_redirect_to_404_page(self, mock_cache_set, mock_cache_get):
         url = URL.objects.create_ready_to_set_token()
@@ -108,10 +121,10 @@ class TestRedirectUrlView(APITestCase):
             self.assertEqual(response["location"], settings.URL_SHORTENER_404_PAGE)
 
         mock_cache_get.assert_called_once()
-        mock_cache_set.assert_not_called()
+        mock_cache_set.assert_called_once_with(url.token, NOT_FOUND, settings.URL_SHORTENER_NEGATIVE_CACHE_TTL)
 
-    @patch("urls.api.views.cache.get")
-    @patch("urls.api.views.cache.set")
+    @patch("urls.api.views.redirect_cache.get")
+    @patch("urls.api.views.redirect_cache.set")
     @override_settings(URL_SHORTENER_USE_CACHE=True)
     def test_redirect_view_with_long_token_redirect_to_404_page(self, mock_cache_set, mock_cache_get):
         token = "".join([choice(AVAILABLE_CHARS) for _ in range(settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH + 1)])
@@ -124,8 +137,8 @@ class TestRedirectUrlView(APITestCase):
         mock_cache_get.assert_not_called()
         mock_cache_set.assert_not_called()
 
-    @patch("urls.api.views.cache.get")
-    @patch("urls.api.views.cache.set")
+    @patch("urls.api.views.redirect_cache.get")
+    @patch("urls.api.views.redirect_cache.set")
     @override_settings(URL_SHORTENER_USE_CACHE=True)
     def test_redirect_view_with_invalid_token_redirect_to_404_page(self, mock_cache_set, mock_cache_get):
         token = "".join([choice(AVAILABLE_CHARS) for _ in range(settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH)])
@@ -137,10 +150,10 @@ class TestRedirectUrlView(APITestCase):
             self.assertEqual(response["location"], settings.URL_SHORTENER_404_PAGE)
 
         mock_cache_get.assert_called_once()
-        mock_cache_set.assert_not_called()
+        mock_cache_set.assert_called_once_with(token, NOT_FOUND, settings.URL_SHORTENER_NEGATIVE_CACHE_TTL)
 
-    @patch("urls.api.views.cache.get")
-    @patch("urls.api.views.cache.set")
+    @patch("urls.api.views.redirect_cache.get")
+    @patch("urls.api.views.redirect_cache.set")
     @override_settings(URL_SHORTENER_USE_CACHE=True)
     def test_redirect_view_with_short_token_redirect_to_404_page(self, mock_cache_set, mock_cache_get):
         token = "".join([choice(AVAILABLE_CHARS) for _ in range(settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH - 1)])
@@ -153,3 +166,139 @@ class TestRedirectUrlView(APITestCase):
 
         mock_cache_get.assert_not_called()
         mock_cache_set.assert_not_called()
+
+
+class TestRedirectLookupPlan(TestCase):
+    def get_lookup_plan(self):
+        return RedirectAPIView().get_object_queryset("aBcDe")[:1].explain()
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite plan")
+    def test_lookup_search_the_active_token_index(self):
+        self.assertIn("USING INDEX active_token_lookup (token=? AND expiration_date>?)", self.get_lookup_plan())
+
+    @skipUnless(connection.vendor == "postgresql", "PostgreSQL plan")
+    def test_lookup_is_an_index_only_scan(self):
+        with connection.cursor() as cursor:
+            # The test tables are too small for the planner to prefer any index, or to prefer skipping the sort
+            # over the token hash index
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_sort = off")
+        for use_cache in (False, True):
+            with self.subTest(use_cache=use_cache), override_settings(URL_SHORTENER_USE_CACHE=use_cache):
+                plan = self.get_lookup_plan()
+                self.assertIn("Index Only Scan using active_token_lookup", plan)
+                self.assertNotIn("Sort", plan)
+
+
+class TestBulkCreateUrlView(APITestCase):
+    url = reverse("urls:bulk-create")
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", password="password")
+        self.client.force_authenticate(self.admin)
+
+    def test_bulk_create_urls_return_the_result_of_every_item(self):
+        URL.objects.bulk_create_ready_to_set_tokens(1)
+        data = {
+            "urls": [
+                {"url": "https://example.com/1"},
+                {"url": "http://example.com/2"},
+                {"url": "https://example.com/3", "token": "aBcDe", "name": "third"},
+            ]
+        }
+
+        response = self.client.post(self.url, data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.json()["results"]
+        self.assertEqual(results[0]["url"], "https://example.com/1")
+        self.assertEqual(results[0]["short_url"], f"{settings.URL_SHORTENER_BASE_URL}/{results[0]['token']}/")
+        self.assertEqual(results[1], {"errors": {"url": ["The URL should start with https://"]}})
+        self.assertEqual(results[2]["token"], "aBcDe")
+        self.assertEqual(results[2]["name"], "third")
+        self.assertEqual(URL.objects.exclude_ready_to_set_urls().count(), 2)
+
+    def test_bulk_create_urls_with_empty_list_return_bad_request(self):
+        response = self.client.post(self.url, {"urls": []}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_urls_with_non_admin_user_return_forbidden(self):
+        self.client.force_authenticate(User.objects.create_user(username="user", password="password"))
+
+        response = self.client.post(self.url, {"urls": [{"url": "https://example.com"}]}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(URL.objects.exists())
+
+
+class TestResolveTokensView(APITestCase):
+    url = reverse("urls:resolve")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(User.objects.create_user(username="user", password="password"))
+        self.active_url = URL.objects.create(url="https://example.com", expiration_date=now() + timedelta(days=1))
+        self.expired_url = URL.objects.create(url="https://example.com/expired", expiration_date=now() - timedelta(days=1))
+        self.ready_to_set_url = URL.objects.create_ready_to_set_token()
+        self.long_token = "a" * (settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH + 1)
+        self.tokens = [self.active_url.token, self.expired_url.token, self.ready_to_set_url.token, self.long_token]
+
+    def resolve(self, tokens):
+        response = self.client.post(self.url, {"tokens": tokens}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()["results"]
+
+    def assertResolvedToTheActiveUrl(self, results):
+        self.assertEqual(results[self.active_url.token]["url"], "https://example.com")
+        # The cache entries keep the expiration to the second
+        self.assertAlmostEqual(
+            parse_datetime(results[self.active_url.token]["expiration_date"]).timestamp(),
+            self.active_url.expiration_date.timestamp(),
+            delta=2,
+        )
+        for token in self.tokens[1:]:
+            self.assertIsNone(results[token])
+
+    def test_resolve_return_the_target_of_the_active_tokens(self):
+        with self.assertNumQueries(1):
+            results = self.resolve(self.tokens)
+
+        self.assertEqual(list(results), self.tokens)
+        self.assertResolvedToTheActiveUrl(results)
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True, URL_SHORTENER_NEGATIVE_CACHE_TTL=30)
+    def test_resolve_cache_the_entries_and_the_misses(self):
+        with self.assertNumQueries(1):
+            self.resolve(self.tokens)
+
+        self.assertEqual(redirect_cache.get(self.active_url.token)["url_pk"], self.active_url.pk)
+        self.assertEqual(redirect_cache.get(self.expired_url.token), NOT_FOUND)
+        with self.assertNumQueries(0):
+            results = self.resolve(self.tokens)
+        self.assertResolvedToTheActiveUrl(results)
+
+    @override_settings(URL_SHORTENER_USE_CACHE=True)
+    def test_resolve_query_only_the_tokens_that_are_not_cached(self):
+        other_url = URL.objects.create(url="https://example.org")
+        redirect_cache.set(self.active_url.token, build_redirect_entry("https://example.com/cached", self.active_url.pk, 60), 60)
+
+        with CaptureQueriesContext(connection) as queries:
+            results = self.resolve([self.active_url.token, other_url.token])
+
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn(self.active_url.token, queries[0]["sql"])
+        self.assertEqual(results[self.active_url.token]["url"], "https://example.com/cached")
+        self.assertEqual(results[other_url.token]["url"], "https://example.org")
+
+    def test_resolve_with_empty_list_return_bad_request(self):
+        response = self.client.post(self.url, {"tokens": []}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_resolve_with_anonymous_user_return_forbidden(self):
+        self.client.force_authenticate(None)
+
+        response = self.client.post(self.url, {"tokens": [self.active_url.token]}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
@@ -0,0 +1,194 @@
+"""
+Tokens derived from a counter instead of random strings.
+
+Every counter value is mapped to a token by a keyed permutation of the token keyspace followed by a base-62
+encoding, so consecutive values give unrelated looking tokens and two values never give the same token.
+The values are reserved from the database in blocks of URL_SHORTENER_TOKEN_COUNTER_BLOCK_SIZE, so a process
+only touches the counter row once per block. The tokens of a block are checked against the active tokens with one
+query when the block is reserved, the counter tokens can still be taken by custom tokens and by the random tokens
+of a deployment that used the random generator before.
+"""
+import os
+import threading
+from hashlib import blake2b
+from string import ascii_letters, digits
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+MAXIMUM_TOKEN_LENGTH = settings.URL_SHORTENER_MAXIMUM_TOKEN_LENGTH
+TOKEN_COUNTER_BLOCK_SIZE = settings.URL_SHORTENER_TOKEN_COUNTER_BLOCK_SIZE
+TOKEN_COUNTER_KEY = settings.URL_SHORTENER_TOKEN_COUNTER_KEY
+TOKEN_COUNTER_NAME = "token"
+AVAILABLE_CHARS = ascii_letters + digits
+FEISTEL_ROUNDS = 4
+# Tokens per active token check query of a reserved block
+ACTIVE_CHECK_BATCH_SIZE = 1000
+
+
+def uses_counter_tokens():
+    return settings.URL_SHORTENER_TOKEN_GENERATOR == "counter"
+
+
+class TokenPermutation:
+    """
+    Bijection between the integers of [0, len(AVAILABLE_CHARS) ** length) and the tokens of `length` characters.
+
+    The integer is shuffled by a Feistel network keyed with `key` over the smallest even number of bits that
+    covers the keyspace, the results outside the keyspace are shuffled again until they fall into it.
+    """
+
+    def __init__(self, length=MAXIMUM_TOKEN_LENGTH, key=TOKEN_COUNTER_KEY):
+        self.length = length
+        self.keyspace_size = len(AVAILABLE_CHARS) ** length
+        half_bits = ((self.keyspace_size - 1).bit_length() + 1) // 2
+        self.half_bits = max(half_bits, 1)
+        self.half_mask = (1 << self.half_bits) - 1
+        self.key = blake2b(key.encode(), digest_size=32).digest()
+
+    def _round(self, round_index, half):
+        digest = blake2b(bytes([round_index]) + half.to_bytes(8, "little"), key=self.key, digest_size=8).digest()
+        return int.from_bytes(digest, "little") & self.half_mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for round_index in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(round_index, right)
+        return (left << self.half_bits) | right
+
+    def _decrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for round_index in reversed(range(FEISTEL_ROUNDS)):
+            left, right = right ^ self._round(round_index, left), left
+        return (left << self.half_bits) | right
+
+    def encode(self, value):
+        if not 0 <= value < self.keyspace_size:
+            raise ValueError(f"{value} is outside the keyspace of {self.keyspace_size} tokens.")
+        value = self._encrypt(value)
+        while value >= self.keyspace_size:
+            value = self._encrypt(value)
+        characters = []
+        for _ in range(self.length):
+            value, index = divmod(value, len(AVAILABLE_CHARS))
+            characters.append(AVAILABLE_CHARS[index])
+        return "".join(reversed(characters))
+
+    def decode(self, token):
+        value = 0
+        for character in token:
+            value = value * len(AVAILABLE_CHARS) + AVAILABLE_CHARS.index(character)
+        value = self._decrypt(value)
+        while value >= self.keyspace_size:
+            value = self._decrypt(value)
+        return value
+
+
+class CounterTokenGenerator:
+    """
+    Collision-free tokens of the counter values, each process takes its values from a block of its own.
+
+    Inside a transaction only the needed values are reserved: if the transaction is rolled back, the counter
+    is rolled back too and this process must not keep the rest of a block that another process may reserve again.
+    """
+
+    def __init__(self, block_size=TOKEN_COUNTER_BLOCK_SIZE, permutation=None):
+        self.block_size = block_size
+        self.permutation = permutation or TokenPermutation()
+        self._next_value = 0
+        self._end_value = 0
+        # Tokens of the reserved values that were already active when they were reserved
+        self._active_tokens = set()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def create_tokens(self, count, exclude=()):
+        """
+        Create `count` distinct tokens, tokens in `exclude` are never returned.
+        """
+        tokens = []
+        exclude = set(exclude)
+        while len(tokens) < count:
+            for value in self.take_values(count - len(tokens)):
+                token = self.permutation.encode(value)
+                if token not in exclude and not self.is_active(token):
+                    tokens.append(token)
+        return tokens
+
+    def is_active(self, token):
+        """
+        Only the random and custom tokens can collide with a counter token. Those that were active when the value
+        was reserved are known, the ones created since then by this process are in the active token filter.
+        """
+        from urls.models import URL
+        from urls.token_filter import active_token_filter
+
+        return token in self._active_tokens or (
+            settings.URL_SHORTENER_USE_TOKEN_FILTER
+            and token in active_token_filter
+            and URL.objects.all_actives().filter(token=token).exists()
+        )
+
+    def get_active_tokens(self, start, end):
+        """
+        Tokens of the values of [start, end) that are already active.
+        """
+        from urls.models import URL
+
+        active_tokens = set()
+        for batch_start in range(start, end, ACTIVE_CHECK_BATCH_SIZE):
+            batch_end = min(batch_start + ACTIVE_CHECK_BATCH_SIZE, end)
+            tokens = [self.permutation.encode(value) for value in range(batch_start, batch_end)]
+            active_tokens.update(URL.objects.all_actives().filter(token__in=tokens).values_list("token", flat=True))
+        return active_tokens
+
+    def take_values(self, count):
+        values = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker must not share the block of its parent
+                self._next_value = self._end_value = 0
+                self._active_tokens = set()
+                self._pid = os.getpid()
+
+            while len(values) < count:
+                if self._next_value == self._end_value:
+                    missing_count = count - len(values)
+                    if connection.in_atomic_block:
+                        start, end = self.reserve(missing_count)
+                        self._active_tokens |= self.get_active_tokens(start, end)
+                        values.extend(range(start, end))
+                        break
+                    self._next_value, self._end_value = self.reserve(max(self.block_size, missing_count))
+                    self._active_tokens = self.get_active_tokens(self._next_value, self._end_value)
+                taken_count = min(count - len(values), self._end_value - self._next_value)
+                values.extend(range(self._next_value, self._next_value + taken_count))
+                self._next_value += taken_count
+        return values
+
+    def reserve(self, size):
+        """
+        Reserve the next `size` values of the counter, return the start and the end of the reserved range.
+        """
+        from urls.models import TokenCounter
+
+        counter = TokenCounter.objects.filter(name=TOKEN_COUNTER_NAME)
+        with transaction.atomic():
+            if not counter.update(value=F("value") + size):
+                TokenCounter.objects.get_or_create(name=TOKEN_COUNTER_NAME)
+                counter.update(value=F("value") + size)
+            end = counter.values_list("value", flat=True).get()
+
+        start = end - size
+        if start >= self.permutation.keyspace_size:
+            raise Exception("The token keyspace is exhausted.")
+        return start, min(end, self.permutation.keyspace_size)
+
+    def clear(self):
+        with self._lock:
+            self._next_value = self._end_value = 0
+            self._active_tokens = set()
+
+
+counter_token_generator = CounterTokenGenerator()
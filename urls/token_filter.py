@@ -0,0 +1,145 @@
+import logging
+import threading
+from hashlib import blake2b
+from math import ceil, log
+from time import monotonic
+
+from django.conf import settings
+from django.db import connections
+
+TOKEN_FILTER_ERROR_RATE = settings.URL_SHORTENER_TOKEN_FILTER_ERROR_RATE
+TOKEN_FILTER_REBUILD_INTERVAL = settings.URL_SHORTENER_TOKEN_FILTER_REBUILD_INTERVAL
+# Room for the tokens that are created until the next rebuild
+TOKEN_FILTER_GROWTH_FACTOR = 2
+TOKEN_FILTER_MINIMUM_CAPACITY = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Membership filter without false negatives and with about `error_rate` false positives
+    as long as it holds at most `capacity` items.
+    """
+
+    def __init__(self, capacity, error_rate=TOKEN_FILTER_ERROR_RATE):
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self._bits = bytearray(ceil(self.size / 8))
+
+    def _positions(self, item):
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], "little")
+        second_hash = int.from_bytes(digest[8:], "little") | 1
+        return ((first_hash + i * second_hash) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class ActiveTokenFilter:
+    """
+    Bloom filter of the active tokens of this process.
+
+    It is built from the database on first use and rebuilt every `rebuild_interval` seconds to forget the
+    expired tokens. Tokens created by other processes are missing until the next rebuild, so a token that
+    is not in the filter still has to be checked against the database.
+
+    Only the first build blocks, the callers have nothing to check against until then. The later rebuilds run
+    in a background thread, one at a time, while the callers keep using the previous filter.
+    """
+
+    def __init__(self, error_rate=TOKEN_FILTER_ERROR_RATE, rebuild_interval=TOKEN_FILTER_REBUILD_INTERVAL,
+                 use_thread=True):
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.use_thread = use_thread
+        self._bloom_filter = None
+        self._built_at = None
+        # Tokens added while a rebuild reads the database, they may be missing from its result
+        self._added_tokens = None
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._rebuild_thread = None
+
+    def __contains__(self, token):
+        bloom_filter = self._bloom_filter
+        if bloom_filter is None:
+            with self._rebuild_lock:
+                bloom_filter = self._bloom_filter or self._rebuild()
+        elif monotonic() - self._built_at >= self.rebuild_interval:
+            self._start_rebuild()
+            bloom_filter = self._bloom_filter or bloom_filter
+        return token in bloom_filter
+
+    def add(self, tokens):
+        with self._lock:
+            if self._added_tokens is not None:
+                self._added_tokens.extend(tokens)
+            if self._bloom_filter is not None:
+                for token in tokens:
+                    self._bloom_filter.add(token)
+
+    def rebuild(self):
+        with self._rebuild_lock:
+            self._rebuild()
+
+    def _start_rebuild(self):
+        if not self._rebuild_lock.acquire(blocking=False):
+            # Another thread is rebuilding the filter
+            return
+        if not self.use_thread:
+            try:
+                self._rebuild()
+            finally:
+                self._rebuild_lock.release()
+            return
+        self._rebuild_thread = threading.Thread(target=self._rebuild_in_background, daemon=True)
+        self._rebuild_thread.start()
+
+    def _rebuild_in_background(self):
+        try:
+            self._rebuild()
+        except Exception:
+            logger.exception("Failed to rebuild the active token filter")
+            with self._lock:
+                # Keep the previous filter until the next interval instead of retrying on every call
+                self._built_at = monotonic()
+        finally:
+            self._rebuild_lock.release()
+            # The rebuild thread owns its own database connection
+            connections.close_all()
+
+    def _rebuild(self):
+        from urls.models import URL
+
+        with self._lock:
+            self._added_tokens = []
+        try:
+            active_tokens = URL.objects.all_actives().values_list("token", flat=True).order_by()
+            capacity = max(active_tokens.count() * TOKEN_FILTER_GROWTH_FACTOR, TOKEN_FILTER_MINIMUM_CAPACITY)
+            bloom_filter = BloomFilter(capacity, self.error_rate)
+            for token in active_tokens.iterator(chunk_size=10_000):
+                bloom_filter.add(token)
+
+            with self._lock:
+                for token in self._added_tokens:
+                    bloom_filter.add(token)
+                self._bloom_filter = bloom_filter
+                self._built_at = monotonic()
+        finally:
+            with self._lock:
+                self._added_tokens = None
+        return bloom_filter
+
+    def clear(self):
+        with self._rebuild_lock, self._lock:
+            self._bloom_filter = None
+            self._built_at = None
+
+
+active_token_filter = ActiveTokenFilter()
@@ -0,0 +1,242 @@
+"""
+Size and refill of the ready-to-set token pool, and the Redis backend of the pool.
+
+The pool is refilled by `create_ready_to_set_token_periodically`, which is scheduled by beat and, as soon as
+the pool drops below its low watermark, by the claim that crossed it. With URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL
+the claims are counted per minute in the cache and every refill sizes the pool and its low watermark from
+the claim rate, so the pool lasts for URL_SHORTENER_TOKEN_POOL_REFILL_HORIZON seconds of claims and a refill
+starts URL_SHORTENER_TOKEN_POOL_REFILL_LEAD_TIME seconds of claims before the pool runs out.
+
+With URL_SHORTENER_TOKEN_POOL_BACKEND = 'redis' the tokens are kept in a Redis set instead of the ready-to-set
+rows of the URL table. A claim is a single SPOP, the token is then inserted with the new url, so creating
+a url does not read or update any pool row. The set is not checked by the other token generators, so the popped
+tokens that became active in the meantime (e.g. as a custom or fallback token) are dropped with one index lookup.
+When Redis is unreachable the pool is treated as empty and the urls get new tokens.
+"""
+import logging
+from math import ceil
+from time import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+from urls import metrics
+
+POOL_CLAIMS_KEY_PREFIX = "url_shortener:pool_claims:"
+POOL_DEPTH_KEY = "url_shortener:pool_depth"
+POOL_LOW_WATERMARK_KEY = "url_shortener:pool_low_watermark"
+POOL_REFILL_LOCK_KEY = "url_shortener:pool_refill"
+# The refill lock expires if the refill task is lost
+POOL_REFILL_LOCK_TIMEOUT = 60  # seconds
+CLAIM_BUCKET_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+
+def uses_redis_token_pool():
+    return settings.URL_SHORTENER_TOKEN_POOL_BACKEND == "redis"
+
+
+def get_claim_bucket_keys(moment=None):
+    """
+    Keys of the claim counters of the rate window, the current minute first.
+    """
+    current_bucket = int(moment or time()) // CLAIM_BUCKET_SECONDS
+    bucket_count = max(1, settings.URL_SHORTENER_TOKEN_POOL_RATE_WINDOW // CLAIM_BUCKET_SECONDS)
+    return [f"{POOL_CLAIMS_KEY_PREFIX}{bucket}" for bucket in range(current_bucket, current_bucket - bucket_count, -1)]
+
+
+def get_claim_rate():
+    """
+    Claimed tokens per second over the last URL_SHORTENER_TOKEN_POOL_RATE_WINDOW seconds.
+    """
+    keys = get_claim_bucket_keys()
+    return sum(cache.get_many(keys).values()) / (len(keys) * CLAIM_BUCKET_SECONDS)
+
+
+def get_pool_sizes(claim_rate=0):
+    """
+    Target size and low watermark of the pool for `claim_rate` claims per second.
+    """
+    target_size = min(
+        max(settings.URL_SHORTENER_READY_TO_SET_TOKEN_LIMIT, ceil(claim_rate * settings.URL_SHORTENER_TOKEN_POOL_REFILL_HORIZON)),
+        settings.URL_SHORTENER_TOKEN_POOL_MAX_SIZE,
+    )
+    low_watermark = min(
+        max(settings.URL_SHORTENER_TOKEN_POOL_LOW_WATERMARK, ceil(claim_rate * settings.URL_SHORTENER_TOKEN_POOL_REFILL_LEAD_TIME)),
+        target_size,
+    )
+    return target_size, low_watermark
+
+
+def get_low_watermark():
+    if settings.URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL:
+        return cache.get(POOL_LOW_WATERMARK_KEY, settings.URL_SHORTENER_TOKEN_POOL_LOW_WATERMARK)
+    return settings.URL_SHORTENER_TOKEN_POOL_LOW_WATERMARK
+
+
+def record_claims(count, remaining_count=None):
+    """
+    Count `count` claimed tokens and schedule a refill if the pool drops below its low watermark.
+
+    `remaining_count` is the pool depth after the claim when the backend knows it, otherwise the depth stored
+    by the last refill is decremented (only with URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL).
+    """
+    if not count:
+        return
+    metrics.pool_tokens_claimed.inc(count)
+    if settings.URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL:
+        bucket_key = get_claim_bucket_keys()[0]
+        bucket_timeout = settings.URL_SHORTENER_TOKEN_POOL_RATE_WINDOW + CLAIM_BUCKET_SECONDS
+        cache.add(bucket_key, 0, bucket_timeout)
+        try:
+            cache.incr(bucket_key, count)
+        except ValueError:
+            # Evicted since the add
+            cache.add(bucket_key, count, bucket_timeout)
+        if remaining_count is None:
+            try:
+                remaining_count = cache.decr(POOL_DEPTH_KEY, count)
+            except ValueError:
+                # The depth is unknown until the next refill
+                request_refill()
+                return
+
+    if remaining_count is not None:
+        metrics.pool_depth.set(remaining_count)
+        if remaining_count < get_low_watermark():
+            request_refill()
+
+
+def record_fallbacks(count):
+    """
+    Count `count` urls that could not claim a pooled token, the pool is empty.
+    """
+    if not count:
+        return
+    metrics.pool_fallbacks.inc(count)
+    metrics.pool_depth.set(0)
+    if uses_redis_token_pool() or settings.URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL:
+        request_refill()
+
+
+def record_pool_depth(depth, low_watermark):
+    """
+    Store the depth of the pool after a refill, the claims count down from there.
+    """
+    metrics.pool_depth.set(depth)
+    if settings.URL_SHORTENER_USE_ADAPTIVE_POOL_REFILL:
+        cache.set_many({POOL_DEPTH_KEY: depth, POOL_LOW_WATERMARK_KEY: low_watermark}, timeout=None)
+
+
+def request_refill():
+    """
+    Schedule a refill, unless one is already scheduled.
+
+    The refill task gets the id of the lock to release it when it is done. The claims never fail because
+    of the refill, if the task can not be sent the lock is kept until it expires, so the next claims do not
+    retry the broker one after the other.
+    """
+    from urls.tasks import create_ready_to_set_token_periodically
+
+    refill_lock_id = uuid4().hex
+    if not cache.add(POOL_REFILL_LOCK_KEY, refill_lock_id, POOL_REFILL_LOCK_TIMEOUT):
+        return
+    try:
+        create_ready_to_set_token_periodically.delay(refill_lock_id=refill_lock_id)
+    except Exception:
+        logger.exception("Could not schedule a refill of the token pool")
+
+
+def release_refill_lock(refill_lock_id):
+    """
+    Release the refill lock if it is still the one taken as `refill_lock_id`.
+    """
+    if cache.get(POOL_REFILL_LOCK_KEY) == refill_lock_id:
+        cache.delete(POOL_REFILL_LOCK_KEY)
+
+
+class RedisTokenPool:
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImproperlyConfigured("URL_SHORTENER_TOKEN_POOL_BACKEND = 'redis' requires the redis package.")
+            self._client = redis.Redis.from_url(settings.URL_SHORTENER_TOKEN_POOL_REDIS_URL, decode_responses=True)
+        return self._client
+
+    @property
+    def key(self):
+        return settings.URL_SHORTENER_TOKEN_POOL_REDIS_KEY
+
+    def __len__(self):
+        return self.client.scard(self.key)
+
+    def pop(self, count=1):
+        """
+        Claim up to `count` tokens, every token is returned to a single caller.
+        Return no token if Redis is unreachable, the callers fall back to new tokens.
+        """
+        from redis.exceptions import RedisError
+
+        from urls.models import URL
+
+        pipeline = self.client.pipeline()
+        pipeline.spop(self.key, count)
+        pipeline.scard(self.key)
+        try:
+            tokens, remaining_count = pipeline.execute()
+        except RedisError:
+            logger.exception("Could not pop tokens from the Redis token pool")
+            return []
+        record_claims(len(tokens), remaining_count)
+        if not tokens:
+            return []
+        active_tokens = set(URL.objects.all_actives().filter(token__in=tokens).values_list("token", flat=True))
+        return [token for token in tokens if token not in active_tokens]
+
+    def add(self, tokens):
+        if tokens:
+            self.client.sadd(self.key, *tokens)
+
+    def discard(self, tokens):
+        """
+        Remove tokens that became active without the pool, e.g. custom tokens.
+        """
+        from redis.exceptions import RedisError
+
+        if not tokens:
+            return
+        try:
+            self.client.srem(self.key, *tokens)
+        except RedisError:
+            # A popped token that is already active is dropped by pop
+            logger.exception("Could not discard tokens from the Redis token pool")
+
+    def refill(self, target_size):
+        """
+        Fill the pool up to `target_size` tokens, return the added tokens.
+
+        The tokens are checked against the active tokens of the database when they are created,
+        the tokens that are already in the pool are skipped by the set.
+        """
+        from urls.models import URL
+
+        missing_count = target_size - len(self)
+        if missing_count <= 0:
+            return []
+        tokens = URL.create_tokens(missing_count)
+        pipeline = self.client.pipeline()
+        for token in tokens:
+            pipeline.sadd(self.key, token)
+        return [token for token, is_added in zip(tokens, pipeline.execute()) if is_added]
+
+
+redis_token_pool = RedisTokenPool()
@@ -0,0 +1,152 @@
+import asyncio
+import atexit
+import logging
+import threading
+from collections import deque
+from time import monotonic
+
+from asgiref.sync import sync_to_async
+from celery.signals import worker_process_shutdown
+from django.conf import settings
+from django.db import connections
+
+from urls.tasks import log_the_url_usages_in_bulk
+
+USAGE_LOG_BATCH_SIZE = settings.URL_SHORTENER_USAGE_LOG_BATCH_SIZE
+USAGE_LOG_FLUSH_INTERVAL = settings.URL_SHORTENER_USAGE_LOG_FLUSH_INTERVAL
+USAGE_LOG_BUFFER_CAPACITY = settings.URL_SHORTENER_USAGE_LOG_BUFFER_CAPACITY
+USAGE_LOG_MAX_RETRY_DELAY = settings.URL_SHORTENER_USAGE_LOG_MAX_RETRY_DELAY
+
+logger = logging.getLogger(__name__)
+
+
+def flush_usages(usages):
+    if settings.URL_SHORTENER_USE_CELERY_AS_USAGE_LOGGER:
+        # One broker message per batch instead of one per redirect
+        log_the_url_usages_in_bulk.delay(usages)
+    else:
+        log_the_url_usages_in_bulk(usages)
+
+
+class UsageBuffer:
+    """
+    In-process ring buffer of url usages.
+
+    Usages are flushed to `flush_callback` as a single batch whenever `batch_size` usages are pending or
+    the oldest pending usage is older than `flush_interval` seconds. If flushing fails, the error is logged,
+    the usages are kept and, once `capacity` is exceeded, the oldest ones are dropped. The next flush is then
+    only attempted after a delay that doubles with each failure, up to `max_retry_delay` seconds.
+    """
+
+    def __init__(self, batch_size=USAGE_LOG_BATCH_SIZE, flush_interval=USAGE_LOG_FLUSH_INTERVAL,
+                 capacity=USAGE_LOG_BUFFER_CAPACITY, flush_callback=flush_usages, use_timer=True,
+                 max_retry_delay=USAGE_LOG_MAX_RETRY_DELAY):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retry_delay = max_retry_delay
+        self.flush_callback = flush_callback
+        self.use_timer = use_timer
+        self._usages = deque(maxlen=max(capacity, batch_size))
+        self._lock = threading.Lock()
+        self._oldest_usage_at = None
+        self._timer = None
+        self._flush_tasks = set()
+        self._retry_delay = 0
+        self._retry_at = None
+
+    def __len__(self):
+        return len(self._usages)
+
+    def add(self, url_id, created_at):
+        if self._append(url_id, created_at):
+            self.flush()
+
+    async def aadd(self, url_id, created_at):
+        """
+        Same as `add`, but the flush runs in the background instead of blocking the event loop.
+        """
+        if self._append(url_id, created_at):
+            flush_task = asyncio.create_task(sync_to_async(self.flush)())
+            # The event loop only keeps a weak reference to the tasks
+            self._flush_tasks.add(flush_task)
+            flush_task.add_done_callback(self._flush_task_done)
+
+    def _flush_task_done(self, flush_task):
+        self._flush_tasks.discard(flush_task)
+        # Retrieve the exception, it would otherwise only be reported when the task is garbage collected
+        if not flush_task.cancelled() and (exception := flush_task.exception()) is not None:
+            logger.error("Background flush of the url usages failed", exc_info=exception)
+
+    def _append(self, url_id, created_at):
+        with self._lock:
+            if not self._usages:
+                self._oldest_usage_at = monotonic()
+                self._schedule_timer(self.flush_interval)
+            self._usages.append([url_id, created_at])
+            if self._retry_at is not None and monotonic() < self._retry_at:
+                # Backing off after a failed flush, the requests do not retry it one after the other
+                return False
+            return (
+                len(self._usages) >= self.batch_size
+                or monotonic() - self._oldest_usage_at >= self.flush_interval
+            )
+
+    def flush(self):
+        with self._lock:
+            usages = list(self._usages)
+            self._usages.clear()
+            self._cancel_timer()
+
+        if not usages:
+            return 0
+
+        try:
+            self.flush_callback(usages)
+        except Exception:
+            with self._lock:
+                # Keep the failed batch in front of the newer usages, the oldest ones are dropped on overflow
+                self._usages = deque(usages + list(self._usages), maxlen=self._usages.maxlen)
+                self._oldest_usage_at = monotonic()
+                self._retry_delay = min(max(self._retry_delay * 2, self.flush_interval, 1), self.max_retry_delay)
+                retry_delay = self._retry_delay
+                self._retry_at = monotonic() + retry_delay
+                self._cancel_timer()
+                self._schedule_timer(retry_delay)
+            logger.exception("Failed to flush %s url usages, retrying in %s seconds", len(usages), retry_delay)
+            return 0
+
+        with self._lock:
+            self._retry_delay = 0
+            self._retry_at = None
+        return len(usages)
+
+    def _schedule_timer(self, delay):
+        if not self.use_timer or delay <= 0 or self._timer is not None:
+            return
+        self._timer = threading.Timer(delay, self._flush_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread owns its own database connection
+            connections.close_all()
+
+
+usage_buffer = UsageBuffer()
+
+
+def drain_usage_buffer(**kwargs):
+    return usage_buffer.flush()
+
+
+atexit.register(drain_usage_buffer)
+# Prefork children leave with os._exit() and skip atexit handlers
+worker_process_shutdown.connect(drain_usage_buffer, weak=False)
@@ -1,9 +1,106 @@
+import json
+import os
+import re
+from collections import Counter
+
 from django.test.utils import CaptureQueriesContext
 from django.db import connection
 from django.test import TestCase
 
+# Literals are replaced, so the same statement with other parameters counts as a duplicate
+SQL_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+class QueryBudget:
+    """
+    Most queries, duplicated statements and seconds of SQL that a code path may spend.
+    """
+
+    def __init__(self, max_queries, max_duplicates=0, max_seconds=None):
+        self.max_queries = max_queries
+        self.max_duplicates = max_duplicates
+        self.max_seconds = max_seconds
+
+
+class QueryBudgetResult:
+    def __init__(self, name, budget, captured_queries):
+        self.name = name
+        self.budget = budget
+        self.captured_queries = captured_queries
+        self.queries = len(captured_queries)
+        self.seconds = sum(float(query["time"]) for query in captured_queries)
+        statements = Counter(normalize_sql(query["sql"]) for query in captured_queries)
+        self.duplicated_statements = {sql: count for sql, count in statements.items() if count > 1}
+        self.duplicates = sum(count - 1 for count in self.duplicated_statements.values())
+
+    def get_violations(self):
+        violations = []
+        if self.queries > self.budget.max_queries:
+            violations.append("%d queries, at most %d expected" % (self.queries, self.budget.max_queries))
+        if self.duplicates > self.budget.max_duplicates:
+            violations.append(
+                "%d duplicated queries, at most %d expected" % (self.duplicates, self.budget.max_duplicates)
+            )
+        if self.budget.max_seconds is not None and self.seconds > self.budget.max_seconds:
+            violations.append("%.3fs of SQL, at most %.3fs expected" % (self.seconds, self.budget.max_seconds))
+        return violations
+
+    def as_dict(self):
+        return {
+            "queries": self.queries,
+            "max_queries": self.budget.max_queries,
+            "duplicates": self.duplicates,
+            "max_duplicates": self.budget.max_duplicates,
+            "seconds": self.seconds,
+            "max_seconds": self.budget.max_seconds,
+        }
+
+    def format(self):
+        return "%s: %d/%d queries, %d/%d duplicated, %.3fs of SQL" % (
+            self.name, self.queries, self.budget.max_queries, self.duplicates, self.budget.max_duplicates, self.seconds,
+        )
+
+
+def normalize_sql(sql):
+    return SQL_LITERAL_PATTERN.sub("?", sql)
+
+
+def write_query_budget_report(results):
+    """
+    Merge the results into the JSON report at QUERY_BUDGET_REPORT, e.g. to keep it as a CI artifact.
+    """
+    path = os.environ.get("QUERY_BUDGET_REPORT")
+    if not path or not results:
+        return
+    report = {}
+    if os.path.exists(path):
+        with open(path) as report_file:
+            report = json.load(report_file)
+    report.update({result.name: result.as_dict() for result in results})
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2, sort_keys=True)
+
 
 class CustomTestCase(TestCase):
+    # Name to QueryBudget, the budgets checked by assertQueryBudget
+    query_budgets = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.query_budget_results = []
+
+    @classmethod
+    def tearDownClass(cls):
+        write_query_budget_report(cls.query_budget_results)
+        super().tearDownClass()
+
+    def assertQueryBudget(self, name):
+        """
+        Assert that the queries executed within the context stay within the budget `name` of `query_budgets`.
+        """
+        return _AssertQueryBudget(self, name, self.query_budgets[name])
+
     def assertMinimumNumQueries(self, min_queries):
         """
         Assert that at least `min_queries` queries are executed within the context.
@@ -23,6 +120,40 @@ class CustomTestCase(TestCase):
         return _AssertQueryCountRange(self, min_queries, max_queries)
 
 
+class _AssertQueryBudget:
+    def __init__(self, test_case, name, budget):
+        self.test_case = test_case
+        self.name = name
+        self.budget = budget
+
+    def __enter__(self):
+        self.context = CaptureQueriesContext(connection)
+        self.context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        self.result = QueryBudgetResult(self.name, self.budget, self.context.captured_queries)
+        self.test_case.query_budget_results.append(self.result)
+        violations = self.result.get_violations()
+        if violations:
+            self.test_case.fail(
+                "%s is over its query budget: %s\nCaptured queries were:\n%s\nDuplicated queries were:\n%s" % (
+                    self.name,
+                    ", ".join(violations),
+                    "\n".join(
+                        "%d. %s" % (i, query["sql"])
+                        for i, query in enumerate(self.context.captured_queries, start=1)
+                    ),
+                    "\n".join(
+                        "%dx %s" % (count, sql) for sql, count in self.result.duplicated_statements.items()
+                    ) or "-",
+                )
+            )
+
+
 class _AssertMinimumNumQueries:
     def __init__(self, test_case, min_queries):
         self.test_case = test_case